@@ -1,96 +1,363 @@
+import io
+from contextlib import closing
+from datetime import datetime, timedelta
+
 import pyocle
-from chalice import Chalice, CognitoUserPoolAuthorizer
-from chalice.app import SNSEvent
-from mongoengine import connect
-from pyocle.service.ses import TemplatedEmailForm, SimpleEmailService
+from chalice import Chalice, CognitoUserPoolAuthorizer, Rate, Response
+from chalice.app import SNSEvent, SQSEvent
 
-from chalicelib.form import ContactMessageCreationForm, ContactMessageQueryParameters
+import chalicelib.database
+import chalicelib.export
+import chalicelib.metrics
+import chalicelib.response
+from chalicelib.compression import Compressor
+from chalicelib.config import int_env_var
+from chalicelib.metrics import stage
+from chalicelib.form import ContactMessageQueryParameters, ContactMessageFieldsQueryParameters, \
+    ContactMessageStatisticsQueryParameters, ContactMessageExportQueryParameters, ContactMessageReadForm, \
+    ContactMessageFlagForm, ContactMessageUpdateForm, resolve_creation_form, resolve_json_form
 from chalicelib.model import ContactMessageCollection
-from chalicelib.service import ContactMessageService
+from chalicelib.notification import NotificationService
+from chalicelib.outbox import OutboxRelay
+from chalicelib.ratelimit import RateLimitExceededError
+from chalicelib.service import BulkCreateFailedError, ContactMessageService
 
 app = Chalice(app_name='contact-message-service')
 app.log.setLevel('DEBUG')
 
-connection_string = pyocle.config.connection_string(default='')
-connect(host=connection_string)
-
+# The database connection and AWS clients are created on first use rather than on import.
+# This keeps cold starts cheap for functions that never use them.
 cms = ContactMessageService()
+notifications = NotificationService()
+outbox_relay = OutboxRelay()
+compressor = Compressor()
+# Binary media types are deployed with the api, so COMPRESSION_ENABLED must be set in the stage's environment variables
+app.api.binary_types = compressor.binary_types(app.api.binary_types)
 authorizer = CognitoUserPoolAuthorizer('portfolio-userpool',
                                        provider_arns=[
                                            'arn:aws:cognito-idp:us-east-2:811393626934:userpool/us-east-2_MLclIlI5Y'])
 
 
+def current_user_id() -> str:
+    """
+    :return: The id of the user making the current request, as verified by the authorizer
+    """
+    return app.current_request.context['authorizer']['claims']['sub']
+
+
+@app.middleware('all')
+def log_database_metrics(event, get_response):
+    """
+    Logs the database connection pool metrics collected while handling each event
+    """
+    response = get_response(event)
+    metrics = chalicelib.database.pool_metrics.snapshot(reset=True)
+    if metrics['checkouts'] > 0 or metrics['checkoutFailures'] > 0:
+        app.log.info(f'Database pool metrics: {metrics} healthy: {chalicelib.database.healthy()}')
+
+    return response
+
+
+@app.middleware('http')
+def compress_response(event, get_response):
+    """
+    Compresses response bodies in an encoding accepted by the client once they reach COMPRESSION_MIN_SIZE
+    """
+    return compressor.compress(get_response(event), event.headers.get('accept-encoding'))
+
+
 @app.route('/', methods=['POST'], cors=True)
 @pyocle.response.error_handler
+@chalicelib.metrics.timed
 def create_contact_message():
     """
-    Endpoint used for create contact messages. This endpoint is open to anonymous users.
+    Endpoint used for create contact messages. This endpoint is open to anonymous users,
+    so each sender address and email is rate limited before anything is published.
 
     :return: The created response with created resource information
     """
 
-    form = pyocle.form.resolve_form(app.current_request.raw_body, ContactMessageCreationForm)
+    with stage('validate'):
+        form = resolve_creation_form(app.current_request.raw_body)
+
     identity = app.current_request.context['identity']
-    published_form = cms.publish_form_with_identity(form, identity)
-    return pyocle.response.accepted(published_form)
+    try:
+        with stage('publish'):
+            published_form = cms.publish_form_with_identity(form, identity)
+    except RateLimitExceededError as ex:
+        return chalicelib.response.too_many_requests(ex.retry_after)
+
+    with stage('serialize'):
+        return pyocle.response.accepted(published_form)
 
 
 @app.route('/{identifier}', methods=['GET'], cors=True, authorizer=authorizer)
 @pyocle.response.error_handler
+@chalicelib.metrics.timed
 def get_single_contact_message(identifier: str):
     """
-    Endpoint used to retrieve a specific contact message
+    Endpoint used to retrieve a specific contact message.
+    Responses carry an ETag so clients can revalidate with If-None-Match and receive a 304 when unchanged.
 
     :param identifier: The contact message id that will be used to find the specific contact message
     :return: The found contact message
     """
 
-    contact_message = cms.find_one(identifier)
-    return pyocle.response.ok(contact_message)
+    with stage('validate'):
+        query_params = pyocle.form.resolve_query_params(app.current_request.query_params,
+                                                        ContactMessageFieldsQueryParameters)
+
+    with stage('query'):
+        contact_message = cms.find_one_cached(identifier)
+
+    etag = chalicelib.response.entity_tag(contact_message.id, contact_message.time_updated, query_params.fields)
+    if chalicelib.response.etag_matches(app.current_request.headers.get('if-none-match'), etag):
+        return chalicelib.response.not_modified(etag)
+
+    if query_params.fields is not None:
+        contact_message.select_fields(query_params.fields)
+
+    with stage('serialize'):
+        return chalicelib.response.ok(contact_message, headers=chalicelib.response.validator_headers(etag))
+
+
+@app.route('/read', methods=['POST'], cors=True, authorizer=authorizer)
+@pyocle.response.error_handler
+@chalicelib.metrics.timed
+def mark_contact_messages_read():
+    """
+    Endpoint used to mark contact messages read by the requesting user
+
+    :return: The number of matched and modified contact messages
+    """
+
+    with stage('validate'):
+        form = resolve_json_form(app.current_request.raw_body, ContactMessageReadForm)
+
+    with stage('update'):
+        result = cms.mark_read(form.ids, current_user_id())
+
+    with stage('serialize'):
+        return chalicelib.response.ok(result)
+
+
+@app.route('/flag', methods=['POST'], cors=True, authorizer=authorizer)
+@pyocle.response.error_handler
+@chalicelib.metrics.timed
+def flag_contact_messages():
+    """
+    Endpoint used to flag or unflag contact messages for the requesting user. Flagged messages are also marked read.
+
+    :return: The number of matched and modified contact messages
+    """
+
+    with stage('validate'):
+        form = resolve_json_form(app.current_request.raw_body, ContactMessageFlagForm)
+
+    with stage('update'):
+        result = cms.mark_read(form.ids, current_user_id(), flagged=form.flagged)
+
+    with stage('serialize'):
+        return chalicelib.response.ok(result)
+
+
+@app.route('/stats', methods=['GET'], cors=True, authorizer=authorizer)
+@pyocle.response.error_handler
+@chalicelib.metrics.timed
+def get_contact_message_statistics():
+    """
+    Endpoint used to retrieve contact message statistics
+
+    :return: The contact message statistics
+    """
+
+    with stage('validate'):
+        query_params = pyocle.form.resolve_query_params(app.current_request.query_params,
+                                                        ContactMessageStatisticsQueryParameters)
+
+    with stage('query'):
+        statistics = cms.statistics_cached(query_params.since())
+
+    with stage('serialize'):
+        return chalicelib.response.ok(statistics)
+
+
+@app.route('/export', methods=['GET'], cors=True, authorizer=authorizer)
+@pyocle.response.error_handler
+@chalicelib.metrics.timed
+def export_contact_messages():
+    """
+    Endpoint used to export contact messages as newline delimited json.
+    Messages are streamed from the database and the response stops at the last whole message that fits within
+    EXPORT_MAX_BYTES. Incomplete exports include an X-Next-Cursor header used to request the remaining messages.
+
+    :return: The exported contact messages
+    """
+
+    with stage('validate'):
+        query_params = pyocle.form.resolve_query_params(app.current_request.query_params,
+                                                        ContactMessageExportQueryParameters)
+
+    # Messages are read while they are written, so the export stage covers both the queries and serialization
+    body = io.StringIO()
+    with stage('export'), closing(cms.iter_documents_raw(**query_params.query())) as contact_messages:
+        result = chalicelib.export.write_ndjson(
+            contact_messages,
+            body,
+            max_bytes=int_env_var('EXPORT_MAX_BYTES', chalicelib.export.DEFAULT_MAX_BYTES)
+        )
+
+    headers = {'Content-Type': 'application/x-ndjson'}
+    if not result.complete:
+        headers['X-Next-Cursor'] = cms.cursor(result.last_document)
+
+    return Response(body=body.getvalue(), headers=headers)
 
 
 @app.route('/', methods=['GET'], cors=True, authorizer=authorizer)
 @pyocle.response.error_handler
+@chalicelib.metrics.timed
 def get_multiple_contact_message():
     """
-    Endpoint used to retrieve contact messages
+    Endpoint used to retrieve contact messages. Searches given with q are sorted by relevance.
+    Total counts are included in pagination details when requested.
 
     :return: The found contact messages
     """
 
-    query_params = pyocle.form.resolve_query_params(app.current_request.query_params, ContactMessageQueryParameters)
-    contact_messages = cms.find_paginated(**query_params.dict(exclude_none=True))
+    with stage('validate'):
+        query_params = pyocle.form.resolve_query_params(app.current_request.query_params,
+                                                        ContactMessageQueryParameters)
+
+    with stage('query'):
+        if query_params.q is None:
+            contact_messages = cms.find_paginated_raw(**query_params.query())
+            next_cursor = cms.next_cursor(contact_messages, query_params.limit)
+        else:
+            contact_messages = cms.search_paginated_raw(**query_params.query())
+            next_cursor = cms.next_search_cursor(contact_messages, query_params.limit)
+
+        total_count = cms.count_cached(**query_params.filters()) if query_params.total else None
+
     collection = ContactMessageCollection(contact_messages)
-    return pyocle.response.ok(collection, query_params)
+    pagination_details = chalicelib.response.PaginationDetails(
+        page=query_params.page,
+        limit=query_params.limit,
+        next_cursor=next_cursor,
+        total_count=total_count
+    )
+    with stage('serialize'):
+        return chalicelib.response.ok(collection, pagination_details)
+
+
+@app.route('/', methods=['PATCH'], cors=True, authorizer=authorizer)
+@pyocle.response.error_handler
+@chalicelib.metrics.timed
+def update_multiple_contact_messages():
+    """
+    Endpoint used to archive or mark responded many contact messages selected by id or by filter
+
+    :return: The number of matched and modified contact messages
+    """
+
+    with stage('validate'):
+        form = resolve_json_form(app.current_request.raw_body, ContactMessageUpdateForm)
+
+    filters = form.filter.filters() if form.filter is not None else None
+    with stage('update'):
+        result = cms.update_many(form.changes(), identifiers=form.ids, filters=filters)
+
+    with stage('serialize'):
+        return chalicelib.response.ok(result)
 
 
 @app.on_sns_message('contact-message-created')
+@chalicelib.metrics.timed
 def send_email_on_received(event: SNSEvent):
     """
-    Sends an email to Justin's dev email when triggered by sns
+    Sends an email to Justin's dev email when triggered by sns.
+    In digest mode the notification is buffered and only full digests are sent.
 
     :param event: The sns event instance that triggered this function
     """
-    form = TemplatedEmailForm(
-        source='JS Portfolio <no-reply@justinsexton.net>',
-        to_addresses=[
-            'justinsexton.dev@gmail.com'
-        ],
-        configuration_set='contact-message-created',
-        template='contact-message-created',
-        template_data=event.message
-    )
-    response = SimpleEmailService().send_templated_email(form)
-    app.log.info(f'Contact message created notification email sent.')
-    app.log.debug(response)
+    sent = notifications.notify(event.message)
+    app.log.info(f'Contact message created notification handled. {sent} notifications sent.')
 
 
-@app.on_sns_message('contact-message-created')
-def insert_into_database_on_received(event: SNSEvent):
+@app.schedule(Rate(5, unit=Rate.MINUTES))
+@chalicelib.metrics.timed
+def send_notification_digest(event):
     """
-    Creates a record in the contact message database when triggered by a sns event
+    Sends digests of buffered notifications once they are full or their oldest notification has waited
+    NOTIFICATION_DIGEST_MAX_AGE_SECONDS
 
-    :param event: The sns event instance that triggered this function
+    :param event: The scheduled event instance that triggered this function
+    """
+    if not notifications.digest_enabled:
+        return
+
+    sent = notifications.flush()
+    app.log.info(f'Notification digests flushed. {sent} notifications sent.')
+
+
+@app.schedule(Rate(1, unit=Rate.MINUTES))
+@chalicelib.metrics.timed
+def relay_outbox(event):
     """
-    contact_message = cms.create_with_sns_event(event)
-    app.log.info(f'Contact message created: {contact_message}')
+    Publishes contact messages placed in the outbox while outbox mode is enabled.
+    Returns without touching the database when outbox mode is disabled, so the outbox should be drained before
+    OUTBOX_ENABLED is turned off.
+
+    :param event: The scheduled event instance that triggered this function
+    """
+    if not cms.outbox_enabled:
+        return
+
+    result = outbox_relay.relay()
+    for identifier, reason in result.failures.items():
+        app.log.error(f'Outbox message {identifier} could not be published and will be retried: {reason}')
+
+    if result.published_count > 0:
+        app.log.info(f'Outbox relayed {result.published_count} messages.')
+
+
+@app.schedule(Rate(1, unit=Rate.DAYS))
+@chalicelib.metrics.timed
+def move_archived_contact_messages(event):
+    """
+    Moves contact messages archived more than CONTACT_MESSAGE_ARCHIVE_AFTER_DAYS ago into the archive collection
+
+    :param event: The scheduled event instance that triggered this function
+    """
+    archived_before = datetime.utcnow() - timedelta(days=int_env_var('CONTACT_MESSAGE_ARCHIVE_AFTER_DAYS', 90))
+    moved_count = cms.move_archived(archived_before)
+    app.log.info(f'Moved {moved_count} archived contact messages to the archive.')
+
+
+@app.on_sqs_message(queue='contact-message-created', batch_size=10)
+@chalicelib.metrics.timed
+def insert_batch_into_database_on_received(event: SQSEvent):
+    """
+    Creates records in the contact message database for a batch of queued contact message created messages.
+    Only the messages whose write failed are reported back to be retried. Messages that are not valid contact
+    messages are logged and dropped. Reporting single messages requires the event source mapping to enable
+    ReportBatchItemFailures. When no write succeeded the whole batch is failed instead, so it is retried even
+    without that setting.
+
+    :param event: The sqs event instance that triggered this function
+    :return: Batch item failures identifying the messages that should be retried
+    :raises BulkCreateFailedError: When every write failed
+    """
+    result = cms.create_with_sqs_event(event)
+    for message_id, reason in result.rejections.items():
+        app.log.error(f'Contact message {message_id} is invalid and was dropped: {reason}')
+
+    for message_id, reason in result.failures.items():
+        app.log.error(f'Contact message {message_id} could not be created and will be retried: {reason}')
+
+    if result.created_count == 0 and len(result.failures) > 0:
+        raise BulkCreateFailedError(result)
+
+    app.log.info(f'Contact message batch processed. {result.created_count} created, '
+                 f'{len(result.failures)} failed, {len(result.rejections)} dropped.')
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in result.failures]}
@@ -0,0 +1,78 @@
+"""
+Measures cold start cost of every Chalice handler. Each sample runs in a fresh interpreter that imports the
+application and invokes a single handler, reporting import time and time to the first response separately.
+Mongo is replaced with mongomock and AWS calls are stubbed, so only client construction and local work is measured.
+
+    python -m benchmarks.cold_start [--samples 5] [--handler create_contact_message]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict
+
+from bson import ObjectId
+
+from benchmarks.common import CONTACT_MESSAGE_CREATION_FORM, queued_contact_message, stub_external_services
+
+HANDLERS: Dict[str, Callable] = {
+    'create_contact_message': lambda client: client.http.request(
+        'POST', '/', body=json.dumps(CONTACT_MESSAGE_CREATION_FORM), headers={'Content-Type': 'application/json'}
+    ),
+    'get_single_contact_message': lambda client: client.http.request('GET', f'/{ObjectId()}'),
+    'get_multiple_contact_message': lambda client: client.http.request('GET', '/'),
+    'send_email_on_received': lambda client: client.lambda_.invoke(
+        'send_email_on_received', client.events.generate_sns_event(message=queued_contact_message())
+    ),
+    'insert_batch_into_database_on_received': lambda client: client.lambda_.invoke(
+        'insert_batch_into_database_on_received',
+        client.events.generate_sqs_event([queued_contact_message() for _ in range(10)])
+    )
+}
+
+
+def run_child(handler: str):
+    started = time.perf_counter()
+    stub_external_services()
+    import app
+    imported = time.perf_counter()
+
+    from chalice.test import Client
+    with Client(app.app) as client:
+        HANDLERS[handler](client)
+    responded = time.perf_counter()
+
+    print(json.dumps({'import': imported - started, 'first_response': responded - imported}))
+
+
+def sample(handler: str) -> Dict[str, float]:
+    environment = {'AWS_DEFAULT_REGION': 'us-east-2', **os.environ, 'PYTHONWARNINGS': 'ignore'}
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.cold_start', '--child', handler],
+                            env=environment, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--handler', choices=list(HANDLERS), action='append')
+    parser.add_argument('--child', choices=list(HANDLERS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child)
+        return
+
+    print(f'{"handler":<40} {"import ms":>10} {"first response ms":>18} {"total ms":>10}')
+    for handler in args.handler or HANDLERS:
+        samples = [sample(handler) for _ in range(args.samples)]
+        imported = statistics.median(result['import'] for result in samples) * 1000
+        responded = statistics.median(result['first_response'] for result in samples) * 1000
+        print(f'{handler:<40} {imported:>10.1f} {responded:>18.1f} {imported + responded:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
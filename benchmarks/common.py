@@ -0,0 +1,40 @@
+"""
+Fixtures shared by the benchmarks that invoke the application handlers locally
+"""
+import json
+
+from bson import ObjectId
+
+CONTACT_MESSAGE_CREATION_FORM = {
+    'message': 'Hello there, I would like to talk about a project.',
+    'reason': 'business',
+    'sender': {
+        'alias': 'benchmark',
+        'phone': '1234567890',
+        'email': 'benchmark@email.com'
+    }
+}
+
+
+def queued_contact_message() -> str:
+    """
+    :return: A contact message creation form as it is published to the contact message created topic
+    """
+    sender = {**CONTACT_MESSAGE_CREATION_FORM['sender'], 'ip': '127.0.0.1', 'user_agent': 'benchmark'}
+    return json.dumps({**CONTACT_MESSAGE_CREATION_FORM, 'id': str(ObjectId()), 'sender': sender})
+
+
+def stub_external_services():
+    """
+    Replaces the encrypted connection string with mongomock and stubs AWS calls that would leave the machine.
+    Clients are still constructed so their cost is included in the measurement.
+    """
+    from unittest import mock
+
+    import pyocle
+    from pyocle.service.ses import SimpleEmailService
+    from pyocle.service.sns import SimpleNotificationService
+
+    mock.patch.object(pyocle.config, 'connection_string', return_value='mongomock://localhost/benchmark').start()
+    mock.patch.object(SimpleNotificationService, 'publish', return_value={'MessageId': 'benchmark'}).start()
+    mock.patch.object(SimpleEmailService, 'send_templated_email', return_value={'MessageId': 'benchmark'}).start()
@@ -0,0 +1,74 @@
+"""
+Compares the CPU cost of compressing GET /mail response bodies against the bytes saved, for every supported coding
+and level. Messages are generated from a small vocabulary so they compress roughly like written text rather than
+the repeated characters used by the serialization benchmark. Brotli is only measured when the brotli package is
+installed.
+
+    python -m benchmarks.compression [--page-size 1 10 100] [--repeat 20]
+"""
+import argparse
+import random
+import timeit
+from typing import Callable, Dict
+
+from benchmarks.serialization import raw_contact_message, serialize_raw
+from chalicelib.compression import Compressor, GZIP, BROTLI, brotli
+
+WORDS = ['project', 'website', 'contract', 'hello', 'the', 'a', 'we', 'would', 'like', 'to', 'talk', 'about',
+         'your', 'portfolio', 'availability', 'rate', 'python', 'team', 'remote', 'timeline', 'budget', 'and',
+         'design', 'backend', 'api', 'thanks', 'for', 'reaching', 'out', 'next', 'week', 'call', 'is', 'of']
+
+GZIP_LEVELS = [1, 4, 6, 9]
+
+BROTLI_QUALITIES = [1, 4, 5, 9, 11]
+
+
+def page_body(page_size: int) -> bytes:
+    """
+    :return: A serialized page of contact messages with text messages of about 2000 characters
+    """
+    sons = []
+    for index in range(page_size):
+        words = random.Random(index)
+        son = raw_contact_message(index)
+        son['message'] = ' '.join(words.choice(WORDS) for _ in range(400))[:2000]
+        sons.append(son)
+
+    return serialize_raw(sons).encode('utf-8')
+
+
+def encoders() -> Dict[str, Callable[[bytes], bytes]]:
+    """
+    :return: Encoders for every measured coding and level keyed by label
+    """
+    measured = {}
+    for level in GZIP_LEVELS:
+        measured[f'{GZIP} {level}'] = Compressor(enabled=True, gzip_level=level).encoders[GZIP]
+
+    if brotli is not None:
+        for quality in BROTLI_QUALITIES:
+            measured[f'{BROTLI} {quality}'] = Compressor(enabled=True, brotli_quality=quality).encoders[BROTLI]
+
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"page size":>9} {"coding":<8} {"bytes":>9} {"compressed":>11} {"ratio":>6} {"cpu ms":>8} '
+          f'{"kB saved/ms":>12}')
+    for page_size in args.page_size:
+        body = page_body(page_size)
+        for label, encode in encoders().items():
+            compressed = len(encode(body))
+            milliseconds = timeit.timeit(lambda: encode(body), number=args.repeat) / args.repeat * 1000
+            saved = (len(body) - compressed) / 1000 / milliseconds
+            print(f'{page_size:>9} {label:<8} {len(body):>9} {compressed:>11} {len(body) / compressed:>6.1f} '
+                  f'{milliseconds:>8.3f} {saved:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
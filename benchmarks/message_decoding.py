@@ -0,0 +1,47 @@
+"""
+Compares decode throughput of published contact messages with jsonpickle against the typed decoder
+used by the ingestion handlers.
+
+    python -m benchmarks.message_decoding [--number 20000]
+"""
+import argparse
+import json
+import timeit
+
+import jsonpickle
+from bson import ObjectId
+
+from chalicelib.form import decode_contact_message
+
+MESSAGE = json.dumps({
+    'message': 'Hello there, I would like to talk about a project. ' * 20,
+    'reason': 'business',
+    'sender': {
+        'alias': 'benchmark',
+        'phone': '1234567890',
+        'email': 'benchmark@email.com',
+        'ip': '127.0.0.1',
+        'user_agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)'
+    },
+    'id': str(ObjectId())
+})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000, help='messages decoded per measurement')
+    args = parser.parse_args()
+
+    assert jsonpickle.decode(MESSAGE) == decode_contact_message(MESSAGE), 'Decoders must produce identical fields'
+
+    results = {}
+    for name, decode in [('jsonpickle', jsonpickle.decode), ('typed', decode_contact_message)]:
+        seconds = min(timeit.repeat(lambda: decode(MESSAGE), number=args.number, repeat=5))
+        results[name] = args.number / seconds
+        print(f'{name:>10}: {results[name]:>12,.0f} messages/s')
+
+    print(f'{"speedup":>10}: {results["typed"] / results["jsonpickle"]:>12.2f}x')
+
+
+if __name__ == '__main__':
+    main()
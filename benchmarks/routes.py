@@ -0,0 +1,184 @@
+"""
+Measures latency and throughput of every route and message handler through the Chalice local test client.
+The contact message collection is seeded with the requested number of messages, cycling through the given reader
+counts, before each handler is invoked repeatedly. Seeded messages lack denormalized reader counts, as messages stored
+before the reader-counts migration do. Mongo is replaced with mongomock and AWS calls are stubbed, so results compare
+runs of this benchmark rather than predict deployed latency. Rate limiting and duplicate suppression are disabled so
+repeated creations are all published.
+
+    python -m benchmarks.routes [--messages 1000] [--readers 0 3 20] [--requests 200] [--route "GET /"]
+"""
+import argparse
+import base64
+import json
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.common import CONTACT_MESSAGE_CREATION_FORM, queued_contact_message, stub_external_services
+from benchmarks.serialization import raw_contact_message
+
+# Seeded messages are inserted in batches so large volumes never build a single list of every document
+SEED_BATCH_SIZE = 10_000
+
+READ_BATCH_SIZE = 10
+
+USER_ID = 'benchmark'
+
+
+def authorization() -> Dict[str, str]:
+    """
+    Local mode decodes the claims of the authorization token without verifying its signature
+    """
+    claims = base64.urlsafe_b64encode(json.dumps({'sub': USER_ID, 'cognito:username': USER_ID}).encode()).decode()
+    return {'Authorization': f'header.{claims.rstrip("=")}.signature', 'Content-Type': 'application/json'}
+
+
+class Context:
+    """
+    State shared by benchmarked requests: the seeded contact message ids and values prepared before timing starts
+    """
+
+    def __init__(self, identifiers: List[str], cursor: str):
+        self.identifiers = identifiers
+        self.cursor = cursor
+        self.headers = authorization()
+        self.random = random.Random(0)
+
+    def identifier(self) -> str:
+        return self.random.choice(self.identifiers)
+
+    def sample(self, count: int) -> List[str]:
+        return self.random.sample(self.identifiers, min(count, len(self.identifiers)))
+
+
+def _creation_form(index: int) -> str:
+    message = f'{CONTACT_MESSAGE_CREATION_FORM["message"]} {index}'
+    return json.dumps({**CONTACT_MESSAGE_CREATION_FORM, 'message': message})
+
+
+ROUTES: Dict[str, Callable[[Any, Context, int], Any]] = {
+    'POST /': lambda client, context, index: client.http.request(
+        'POST', '/', body=_creation_form(index), headers={'Content-Type': 'application/json'}
+    ),
+    'GET /{id}': lambda client, context, index: client.http.request(
+        'GET', f'/{context.identifier()}', headers=context.headers
+    ),
+    'GET /': lambda client, context, index: client.http.request('GET', '/', headers=context.headers),
+    'GET /?reason&archived': lambda client, context, index: client.http.request(
+        'GET', '/?reason=business&archived=false', headers=context.headers
+    ),
+    'GET /?cursor': lambda client, context, index: client.http.request(
+        'GET', f'/?cursor={context.cursor}', headers=context.headers
+    ),
+    'GET /?total': lambda client, context, index: client.http.request('GET', '/?total=true', headers=context.headers),
+    'GET /stats': lambda client, context, index: client.http.request('GET', '/stats', headers=context.headers),
+    'POST /read': lambda client, context, index: client.http.request(
+        'POST', '/read', body=json.dumps({'ids': context.sample(READ_BATCH_SIZE)}), headers=context.headers
+    ),
+    'POST /flag': lambda client, context, index: client.http.request(
+        'POST', '/flag', body=json.dumps({'ids': context.sample(READ_BATCH_SIZE), 'flagged': index % 2 == 0}),
+        headers=context.headers
+    ),
+    'PATCH /': lambda client, context, index: client.http.request(
+        'PATCH', '/', body=json.dumps({'ids': context.sample(READ_BATCH_SIZE), 'responded': index % 2 == 0}),
+        headers=context.headers
+    ),
+    'sns send_email_on_received': lambda client, context, index: client.lambda_.invoke(
+        'send_email_on_received', client.events.generate_sns_event(message=queued_contact_message())
+    ),
+    'sqs insert_batch_into_database_on_received': lambda client, context, index: client.lambda_.invoke(
+        'insert_batch_into_database_on_received',
+        client.events.generate_sqs_event([queued_contact_message() for _ in range(10)])
+    )
+}
+
+
+def seed(message_count: int, reader_counts: List[int]) -> List[str]:
+    """
+    Inserts message_count contact messages, cycling through the given reader counts. Messages are stored without
+    denormalized reader counts, as messages stored before the reader-counts migration are.
+
+    :return: The ids of the inserted contact messages
+    """
+    from chalicelib.database import ensure_connection
+    from chalicelib.model import ContactMessage
+
+    ensure_connection()
+    collection = ContactMessage._get_collection()
+    identifiers = []
+    for start in range(0, message_count, SEED_BATCH_SIZE):
+        sons = [raw_contact_message(index, reader_counts[index % len(reader_counts)], reader_counts=False)
+                for index in range(start, min(start + SEED_BATCH_SIZE, message_count))]
+        collection.insert_many(sons)
+        identifiers.extend(str(son['_id']) for son in sons)
+
+    return identifiers
+
+
+def measure(request: Callable[[int], Any], request_count: int) -> Dict[str, float]:
+    """
+    :param request: Makes a single request given its index
+    :param request_count: The number of timed requests
+    :return: The p50 and p99 latency in milliseconds and the requests completed per second
+    """
+    latencies = []
+    for index in range(request_count):
+        started = time.perf_counter()
+        response = request(index)
+        latencies.append(time.perf_counter() - started)
+        status_code = getattr(response, 'status_code', 200)
+        if status_code >= 400:
+            raise RuntimeError(f'Request failed with status {status_code}: {response.body}')
+
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+        'ops': len(latencies) / sum(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--readers', type=int, nargs='+', default=[0, 3, 20])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--route', choices=list(ROUTES), action='append')
+    args = parser.parse_args()
+
+    stub_external_services()
+    import app
+    from chalice.test import Client
+    from chalicelib.duplicate import DuplicateDetector
+    from chalicelib.metrics import metric_logger
+    from chalicelib.ratelimit import RateLimiter
+
+    app.cms.rate_limiter = RateLimiter(enabled=False)
+    app.cms.duplicates = DuplicateDetector(enabled=False)
+    metric_logger.enabled = False
+    app.app.log.setLevel('WARNING')
+
+    started = time.perf_counter()
+    identifiers = seed(args.messages, args.readers)
+    print(f'Seeded {len(identifiers)} contact messages with {args.readers} readers '
+          f'in {time.perf_counter() - started:.1f}s')
+
+    with Client(app.app) as client:
+        first_page = client.http.request('GET', '/', headers=authorization()).json_body
+        context = Context(identifiers, first_page['meta']['paginationDetails'].get('nextCursor', ''))
+
+        print(f'{"route":<44} {"p50 ms":>10} {"p99 ms":>10} {"ops/sec":>10}')
+        for route in args.route or ROUTES:
+            def request(index: int):
+                return ROUTES[route](client, context, index)
+
+            measure(request, args.warmup)
+            result = measure(request, args.requests)
+            print(f'{route:<44} {result["p50"]:>10.2f} {result["p99"]:>10.2f} {result["ops"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Compares the per document cost of serializing a page of contact messages through hydrated documents
+against raw documents read with as_pymongo().
+
+    python -m benchmarks.serialization [--page-size 100] [--repeat 50]
+"""
+import argparse
+import timeit
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import pyocle
+from bson import ObjectId
+
+from chalicelib.model import ContactMessage, ContactMessageCollection, RawDocument
+
+
+def raw_contact_message(index: int, reader_count: int = 3, reader_counts: bool = True) -> Dict[str, Any]:
+    """
+    :param index: Index used to vary the generated document
+    :param reader_count: Number of readers embedded in the generated document
+    :param reader_counts: Whether the denormalized reader and flagged counts are stored. Documents stored before
+                          reader counts existed lack them until the reader-counts migration is run
+    :return: A contact message as it is stored in mongo
+    """
+    time_created = datetime(2020, 1, 1) + timedelta(minutes=index)
+    readers = [
+        {'userId': f'user {reader}', 'flagged': reader % 2 == 0, 'timeUpdated': time_created}
+        for reader in range(reader_count)
+    ]
+    counts = {
+        'readerCount': len(readers),
+        'flaggedCount': sum(1 for reader in readers if reader['flagged'])
+    } if reader_counts else {}
+    return {
+        '_id': ObjectId(),
+        'message': 'm' * 2000,
+        'reason': 'business',
+        'archived': index % 2 == 0,
+        'responded': index % 3 == 0,
+        'sender': {
+            'alias': f'sender {index}',
+            'phone': '1234567890',
+            'email': f'sender{index}@email.com',
+            'ip': '127.0.0.1',
+            'userAgent': 'Mozilla/5.0'
+        },
+        'readers': readers,
+        **counts,
+        'timeCreated': time_created,
+        'timeUpdated': time_created
+    }
+
+
+def serialize_hydrated(sons: List[Dict[str, Any]]) -> str:
+    contact_messages = [ContactMessage._from_son(son) for son in sons]
+    return pyocle.response.ok(ContactMessageCollection(contact_messages)).body
+
+
+def serialize_raw(sons: List[Dict[str, Any]]) -> str:
+    contact_messages = [RawDocument(ContactMessage, son) for son in sons]
+    return pyocle.response.ok(ContactMessageCollection(contact_messages)).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    sons = [raw_contact_message(index) for index in range(args.page_size)]
+    unmigrated_sons = [raw_contact_message(index, reader_counts=False) for index in range(args.page_size)]
+    assert serialize_hydrated(sons) == serialize_raw(sons), 'Serialized pages must be identical'
+    assert serialize_hydrated(unmigrated_sons) == serialize_raw(unmigrated_sons), 'Serialized pages must be identical'
+
+    results = {}
+    for name, serialize in [('hydrated', serialize_hydrated), ('raw', serialize_raw)]:
+        seconds = min(timeit.repeat(lambda: serialize(sons), number=1, repeat=args.repeat))
+        results[name] = seconds
+        print(f'{name:>10}: {seconds * 1000:8.2f} ms/page {seconds / args.page_size * 1e6:8.1f} us/document')
+
+    print(f'{"speedup":>10}: {results["hydrated"] / results["raw"]:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures contact message creation form validations per second, from raw request body to publish payload,
+for valid and invalid payloads. The legacy pipeline parses with jsonpickle and patches a dict() copy of the form.
+
+    python -m benchmarks.validation [--seconds 1.0]
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict
+
+import pyocle
+from pyocle.form import FormValidationError
+
+from chalicelib.form import ContactMessageCreationForm, resolve_creation_form
+
+IDENTITY = {'sourceIp': '127.0.0.1', 'userAgent': 'benchmark'}
+
+PAYLOADS = {
+    'valid': {
+        'message': 'Hello there, I would like to talk about a project. ' * 10,
+        'reason': 'Business',
+        'sender': {'alias': 'benchmark', 'phone': '(123) 456-7890', 'email': 'benchmark@email.com'}
+    },
+    'invalid': {
+        'message': '',
+        'reason': 'unknown',
+        'sender': {'alias': 'benchmark', 'phone': '12-34', 'email': 'not an email'}
+    }
+}
+
+
+def legacy_pipeline(raw_body: bytes) -> Dict[str, Any]:
+    form = pyocle.form.resolve_form(raw_body, ContactMessageCreationForm)
+    payload = form.dict()
+    payload['sender']['ip'] = IDENTITY.get('sourceIp', 'unknown')
+    payload['sender']['user_agent'] = IDENTITY.get('userAgent', 'unknown')
+    payload['reason'] = payload['reason'].value
+    return payload
+
+
+def fast_pipeline(raw_body: bytes) -> Dict[str, Any]:
+    return resolve_creation_form(raw_body).contact_message_dict(IDENTITY)
+
+
+def validations_per_second(pipeline: Callable[[bytes], Any], raw_body: bytes, seconds: float) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        try:
+            pipeline(raw_body)
+        except FormValidationError:
+            pass
+        count += 1
+
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1.0, help='time spent measuring each pipeline and payload')
+    args = parser.parse_args()
+
+    valid_body = json.dumps(PAYLOADS['valid']).encode('utf-8')
+    assert legacy_pipeline(valid_body) == fast_pipeline(valid_body), 'Pipelines must build identical payloads'
+
+    print(f'{"payload":<10} {"legacy/s":>12} {"fast/s":>12} {"speedup":>8}')
+    for name, payload in PAYLOADS.items():
+        raw_body = json.dumps(payload).encode('utf-8')
+        legacy = validations_per_second(legacy_pipeline, raw_body, args.seconds)
+        fast = validations_per_second(fast_pipeline, raw_body, args.seconds)
+        print(f'{name:<10} {legacy:>12,.0f} {fast:>12,.0f} {fast / legacy:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Least recently used cache with an optional time to live.
+    Intended to live for the life of a container so warm invocations can share results.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_size: The number of entries kept before the least recently used entry is evicted
+        :param ttl_seconds: Seconds an entry is kept before it expires. Entries never expire when not given
+        :param clock: Clock used to expire entries
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        :param key: The key of the entry to retrieve
+        :param default: The value returned when there is no entry or the entry has expired
+        :return: The cached value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires = entry
+            if expires is not None and expires <= self._clock():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Caches a value, evicting the least recently used entry when the cache is full
+
+        :param key: The key of the entry
+        :param value: The value to cache
+        """
+        expires = None if self.ttl_seconds is None else self._clock() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """
+        Removes an entry if it exists
+
+        :param key: The key of the entry to remove
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
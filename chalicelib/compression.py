@@ -0,0 +1,188 @@
+import base64
+import json
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from chalice import Response
+from chalice.app import handle_extra_types
+
+from chalicelib.config import bool_env_var, int_env_var
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+ANY_MEDIA_TYPE = '*/*'
+
+
+class CompressedResponse(Response):
+    """
+    Response whose body is already compressed. The body is always base64 encoded when handed to API Gateway, which
+    only decodes it back to binary when the client's Accept header matches one of the api's binary media types.
+    See Compressor.binary_types for the binary media types compressed responses require.
+    """
+
+    def to_dict(self, binary_types=None):
+        response = super().to_dict()
+        response['body'] = base64.b64encode(self.body).decode('ascii')
+        response['isBase64Encoded'] = True
+        return response
+
+
+class Compressor:
+    """
+    Compresses response bodies in the encoding the client prefers according to its Accept-Encoding header.
+    Brotli is offered only when the brotli package is installed. Bodies smaller than the minimum size are sent
+    as is, since compressing them saves little and costs a few hundred bytes of headers and framing at worst.
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 min_size: Optional[int] = None,
+                 gzip_level: Optional[int] = None,
+                 brotli_quality: Optional[int] = None):
+        """
+        :param enabled: Whether responses are compressed. Defaults to COMPRESSION_ENABLED
+        :param min_size: Smallest body, in bytes, that is compressed. Defaults to COMPRESSION_MIN_SIZE
+        :param gzip_level: Gzip compression level from 1 to 9. Defaults to COMPRESSION_GZIP_LEVEL
+        :param brotli_quality: Brotli quality from 0 to 11. Defaults to COMPRESSION_BROTLI_QUALITY
+        """
+        self.enabled = enabled if enabled is not None else bool_env_var('COMPRESSION_ENABLED', False)
+        self.min_size = min_size if min_size is not None else int_env_var('COMPRESSION_MIN_SIZE', 1024)
+        self.gzip_level = gzip_level or int_env_var('COMPRESSION_GZIP_LEVEL', 6)
+        self.brotli_quality = brotli_quality if brotli_quality is not None \
+            else int_env_var('COMPRESSION_BROTLI_QUALITY', 4)
+
+    def binary_types(self, binary_types: List[str]) -> List[str]:
+        """
+        Compressed bodies are returned for any Accept header, so while compression is enabled every media type is
+        treated as binary. API Gateway then decodes every base64 encoded body, and Chalice base64 encodes every
+        response body in turn. Chalice also rejects requests without an Accept header once every type is binary.
+
+        :param binary_types: The binary media types configured for the api
+        :return: The binary media types the api needs to serve compressed responses
+        """
+        if not self.enabled or ANY_MEDIA_TYPE in binary_types:
+            return binary_types
+
+        return binary_types + [ANY_MEDIA_TYPE]
+
+    @property
+    def encoders(self) -> Dict[str, Callable[[bytes], bytes]]:
+        """
+        :return: Supported encoders keyed by content coding, most preferred first
+        """
+        encoders = {}
+        if brotli is not None:
+            encoders[BROTLI] = lambda data: brotli.compress(data, quality=self.brotli_quality)
+
+        encoders[GZIP] = self._gzip
+        return encoders
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """
+        Selects the supported content coding the client weighs highest. Ties are broken by server preference.
+
+        :param accept_encoding: The Accept-Encoding header value. None when the header was not sent
+        :return: The selected content coding. None when the client accepts no supported coding
+        """
+        if not accept_encoding:
+            return None
+
+        weights = dict(_parse_accept_encoding(accept_encoding))
+        selected, selected_weight = None, 0.0
+        for coding in self.encoders:
+            weight = weights.get(coding, weights.get('*', 0.0))
+            if weight > selected_weight:
+                selected, selected_weight = coding, weight
+
+        return selected
+
+    def compress(self, response: Response, accept_encoding: Optional[str]) -> Response:
+        """
+        Compresses the body of a response when compression is enabled, the body is large enough and the client
+        accepts a supported coding. Strong entity tags are weakened on compressed responses since the compressed
+        bytes differ from the representation they identify. Conditional requests use weak comparison so they
+        still match.
+
+        :param response: The response to compress
+        :param accept_encoding: The Accept-Encoding header value of the request
+        :return: The compressed response, or the given response when it is not compressed
+        """
+        if not self.enabled or 'Content-Encoding' in _header_names(response):
+            return response
+
+        body = _body_bytes(response.body)
+        if len(body) < self.min_size:
+            return response
+
+        headers = dict(response.headers)
+        headers['Vary'] = _vary(headers.get('Vary'))
+        coding = self.negotiate(accept_encoding)
+        if coding is None:
+            response.headers = headers
+            return response
+
+        etag = headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            headers['ETag'] = f'W/{etag}'
+
+        headers['Content-Encoding'] = coding
+        return CompressedResponse(body=self.encoders[coding](body), headers=headers,
+                                  status_code=response.status_code)
+
+    def _gzip(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+
+def _parse_accept_encoding(accept_encoding: str) -> List[Tuple[str, float]]:
+    """
+    :return: Every content coding listed with its weight. Codings with malformed weights are ignored
+    """
+    codings = []
+    for part in accept_encoding.split(','):
+        coding, *parameters = [token.strip() for token in part.split(';')]
+        if not coding:
+            continue
+
+        weight = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+
+        codings.append((coding.lower(), weight))
+
+    return codings
+
+
+def _header_names(response: Response) -> List[str]:
+    return [name.title() for name in response.headers]
+
+
+def _body_bytes(body: Union[str, bytes, object]) -> bytes:
+    if isinstance(body, bytes):
+        return body
+
+    if not isinstance(body, str):
+        body = json.dumps(body, separators=(',', ':'), default=handle_extra_types)
+
+    return body.encode('utf-8')
+
+
+def _vary(vary: Optional[str]) -> str:
+    if not vary:
+        return 'Accept-Encoding'
+
+    if 'accept-encoding' in [value.strip().lower() for value in vary.split(',')]:
+        return vary
+
+    return f'{vary}, Accept-Encoding'
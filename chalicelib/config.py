@@ -0,0 +1,34 @@
+import pyocle
+
+
+def int_env_var(name: str, default: int) -> int:
+    """
+    Retrieves an integer setting from the environment
+
+    :param name: The name of the environment variable to retrieve
+    :param default: The value used when the environment variable is not set
+    :return: The integer setting
+    """
+    return int(pyocle.config.env_var(name, default=str(default)))
+
+
+def float_env_var(name: str, default: float) -> float:
+    """
+    Retrieves a decimal setting from the environment
+
+    :param name: The name of the environment variable to retrieve
+    :param default: The value used when the environment variable is not set
+    :return: The decimal setting
+    """
+    return float(pyocle.config.env_var(name, default=str(default)))
+
+
+def bool_env_var(name: str, default: bool) -> bool:
+    """
+    Retrieves a boolean setting from the environment. The values true, 1 and yes are considered true
+
+    :param name: The name of the environment variable to retrieve
+    :param default: The value used when the environment variable is not set
+    :return: The boolean setting
+    """
+    return pyocle.config.env_var(name, default=str(default)).lower() in ('true', '1', 'yes')
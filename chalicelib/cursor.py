@@ -0,0 +1,49 @@
+import base64
+import binascii
+from typing import Any, List, Sequence
+
+from bson import json_util
+from bson.json_util import JSONOptions
+
+# Cursors only ever round trip through this module so we pin the options used to decode them.
+# Naive datetimes are used so decoded values compare correctly against those stored by mongoengine.
+_JSON_OPTIONS = JSONOptions(tz_aware=False)
+
+
+class InvalidCursorError(ValueError):
+    """
+    Error used to denote that a pagination cursor could not be decoded
+    """
+    pass
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encodes the sort key values of a document into an opaque cursor string.
+    Values may be any BSON compatible type such as ObjectId and datetime.
+
+    :param values: The sort key values of the last document returned in a page
+    :return: The url safe cursor string
+    """
+    serialized = json_util.dumps(list(values), json_options=_JSON_OPTIONS)
+    return base64.urlsafe_b64encode(serialized.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Decodes a cursor string created with encode_cursor back to its sort key values.
+    Raises InvalidCursorError if the given string is not a cursor.
+
+    :param cursor: The cursor string to decode
+    :return: The decoded sort key values
+    """
+    try:
+        serialized = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        values = json_util.loads(serialized.decode('utf-8'), json_options=_JSON_OPTIONS)
+    except (binascii.Error, UnicodeError, ValueError) as ex:
+        raise InvalidCursorError('value is not a valid cursor') from ex
+
+    if not isinstance(values, list) or len(values) == 0:
+        raise InvalidCursorError('value is not a valid cursor')
+
+    return values
@@ -0,0 +1,190 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import pyocle
+from mongoengine import DEFAULT_CONNECTION_NAME, register_connection
+from mongoengine import connection
+from pymongo import monitoring
+
+from chalicelib.config import int_env_var
+from chalicelib.metrics import command_timings
+
+
+class ConnectionPoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener collecting how often connections are checked out of the pool and how long
+    each checkout waited for a connection to become available.
+    Metrics accumulate until reset so they can be reported per invocation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        :param reset: Whether the metrics should be reset once read
+        :return: The metrics collected since the last reset
+        """
+        with self._lock:
+            metrics = {
+                'checkouts': self.checkouts,
+                'checkoutFailures': self.checkout_failures,
+                'connectionsCreated': self.connections_created,
+                'connectionsClosed': self.connections_closed,
+                'totalWaitMs': round(self.total_wait_seconds * 1000, 3),
+                'maxWaitMs': round(self.max_wait_seconds * 1000, 3)
+            }
+            if reset:
+                self._reset()
+
+            return metrics
+
+    def connection_check_out_started(self, event):
+        # Checkouts block the calling thread so the start time is tracked per thread
+        self._checkout_started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = self._wait_seconds()
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def connection_check_out_failed(self, event):
+        self._wait_seconds()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def _reset(self):
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _wait_seconds(self) -> float:
+        started = getattr(self._checkout_started, 'value', None)
+        self._checkout_started.value = None
+        return 0.0 if started is None else time.perf_counter() - started
+
+
+class HeartbeatMonitor(monitoring.ServerHeartbeatListener):
+    """
+    Server heartbeat listener remembering the outcome of the latest heartbeat of every server.
+    The client sends heartbeats in the background, so health can be read without any network round trip.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers: Dict[Any, bool] = {}
+
+    def healthy(self) -> Optional[bool]:
+        """
+        :return: Whether any server answered its latest heartbeat. None if no heartbeat has completed yet
+        """
+        with self._lock:
+            if len(self._servers) == 0:
+                return None
+
+            return any(self._servers.values())
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with self._lock:
+            self._servers[event.connection_id] = True
+
+    def failed(self, event):
+        with self._lock:
+            self._servers[event.connection_id] = False
+
+
+pool_metrics = ConnectionPoolMetrics()
+heartbeat_monitor = HeartbeatMonitor()
+
+
+def connection_settings() -> Dict[str, Any]:
+    """
+    Builds mongo client settings from the environment. Each setting can be overridden with an environment variable.
+    Defaults favour a single threaded Lambda container: a small pool that is kept warm between invocations and
+    timeouts that fail well before the function does.
+
+    :return: Keyword arguments for the mongo client
+    """
+    return {
+        'maxPoolSize': int_env_var('MONGO_MAX_POOL_SIZE', 2),
+        'minPoolSize': int_env_var('MONGO_MIN_POOL_SIZE', 0),
+        'maxIdleTimeMS': int_env_var('MONGO_MAX_IDLE_TIME_MS', 300000),
+        'waitQueueTimeoutMS': int_env_var('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+        'serverSelectionTimeoutMS': int_env_var('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'connectTimeoutMS': int_env_var('MONGO_CONNECT_TIMEOUT_MS', 5000),
+        'socketTimeoutMS': int_env_var('MONGO_SOCKET_TIMEOUT_MS', 20000),
+        'heartbeatFrequencyMS': int_env_var('MONGO_HEARTBEAT_FREQUENCY_MS', 10000),
+        'retryWrites': True,
+        'retryReads': True
+    }
+
+
+def ensure_connection(alias: str = DEFAULT_CONNECTION_NAME):
+    """
+    Registers the application database connection the first time the database is needed.
+    Decrypting the connection string and creating the mongo client is deferred until first use so functions that
+    never touch the database do not pay for either on cold start.
+    The client is then reused by every following invocation of a warm container.
+    Connections already registered under the alias, such as those registered by tests, are left untouched.
+
+    :param alias: The mongoengine connection alias to register
+    """
+    # mongoengine does not expose whether an alias has been registered without also creating its client
+    if alias in connection._connection_settings:
+        return
+
+    register_connection(
+        alias,
+        host=pyocle.config.connection_string(default=''),
+        event_listeners=[pool_metrics, heartbeat_monitor, command_timings],
+        **connection_settings()
+    )
+
+
+def healthy() -> Optional[bool]:
+    """
+    Reports database health from the client's background heartbeats. Checking health never opens a connection,
+    sends a command or recreates the client, so unhealthy periods cannot cause reconnect storms.
+    The client recovers on its own once heartbeats succeed again.
+
+    :return: Whether the database is reachable. None if the connection has not been used yet
+    """
+    return heartbeat_monitor.healthy()
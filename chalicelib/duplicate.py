@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from bson import ObjectId
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from chalicelib.cache import LRUCache
+from chalicelib.config import bool_env_var, int_env_var
+from chalicelib.database import ensure_connection, healthy
+from chalicelib.model import ContactMessageFingerprint
+
+
+class DuplicateDetector:
+    """
+    Detects contact messages whose fingerprint was already published within a window.
+    The first message published with a fingerprint claims it in a collection shared by every container.
+    Duplicates found are also kept in a container cache so repeated resubmissions to a warm container are detected
+    without a database round trip.
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 window_seconds: Optional[int] = None,
+                 cache: Optional[LRUCache] = None):
+        """
+        :param enabled: Whether duplicates are detected. Defaults to DUPLICATE_SUPPRESSION_ENABLED
+        :param window_seconds: How long a fingerprint stays claimed. Defaults to DUPLICATE_WINDOW_SECONDS
+        :param cache: Cache of claimed fingerprints. Defaults to a cache of DUPLICATE_CACHE_SIZE whose entries
+                      expire after at most 5 minutes, so claims released by other containers are not remembered long
+        """
+        self.enabled = enabled if enabled is not None else bool_env_var('DUPLICATE_SUPPRESSION_ENABLED', True)
+        self.window_seconds = window_seconds or int_env_var('DUPLICATE_WINDOW_SECONDS', 3600)
+        self.cache = cache or LRUCache(
+            max_size=int_env_var('DUPLICATE_CACHE_SIZE', 1024),
+            ttl_seconds=min(self.window_seconds, 300)
+        )
+
+    @property
+    def collection(self) -> Collection:
+        """
+        :return: The fingerprint collection. The database connection is registered on first use
+        """
+        ensure_connection()
+        return ContactMessageFingerprint._get_collection()
+
+    def claim(self, fingerprint: str, contact_message_id: Union[str, ObjectId]) -> Optional[str]:
+        """
+        Claims a fingerprint for a contact message with a single upsert. Expired claims the TTL monitor has not
+        removed yet are taken over. Messages are treated as originals when the database is unavailable, straight away
+        while heartbeats report the database down rather than after waiting for server selection to time out.
+
+        :param fingerprint: The fingerprint of the contact message
+        :param contact_message_id: The identifier of the contact message being published
+        :return: The identifier of the original contact message when the fingerprint is already claimed
+        """
+        if not self.enabled:
+            return None
+
+        original_id = self.cache.get(fingerprint)
+        if original_id is not None:
+            return original_id
+
+        if healthy() is False:
+            logging.getLogger(__name__).warning('Fingerprint claims unavailable, message treated as original: '
+                                                'database is down')
+            return None
+
+        now = datetime.utcnow()
+        try:
+            self.collection.update_one(
+                {'_id': fingerprint, 'timeExpires': {'$lte': now}},
+                {'$set': {
+                    'contactMessageId': ObjectId(contact_message_id),
+                    'timeExpires': now + timedelta(seconds=self.window_seconds)
+                }},
+                upsert=True
+            )
+            return None
+        except DuplicateKeyError:
+            claim = self.collection.find_one({'_id': fingerprint}, {'contactMessageId': 1})
+            if claim is None:
+                # The claim was released since the upsert
+                return None
+
+            original_id = str(claim['contactMessageId'])
+            self.cache.set(fingerprint, original_id)
+            return original_id
+        except PyMongoError as ex:
+            logging.getLogger(__name__).warning(f'Fingerprint claims unavailable, message treated as original: {ex}')
+            return None
+
+    def release(self, fingerprint: str):
+        """
+        Releases a claim so the fingerprint can be published again, such as after the claiming message failed to publish
+
+        :param fingerprint: The fingerprint of the contact message
+        """
+        if not self.enabled:
+            return
+
+        self.cache.pop(fingerprint)
+        if healthy() is False:
+            logging.getLogger(__name__).warning('Fingerprint claim could not be released: database is down')
+            return
+
+        try:
+            self.collection.delete_one({'_id': fingerprint})
+        except PyMongoError as ex:
+            logging.getLogger(__name__).warning(f'Fingerprint claim could not be released: {ex}')
@@ -0,0 +1,106 @@
+import argparse
+import json
+import sys
+from typing import Any, Iterable, Optional, Sequence, TextIO
+
+import pyocle
+from mongoengine import connect
+
+from chalicelib.service import ContactMessageService
+
+# Responses are returned through API gateway which limits synchronous Lambda responses to 6 MB
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class ExportResult:
+    """
+    Outcome of writing documents as newline delimited json.
+    When the result is incomplete, the last written document is where the export should continue from.
+    """
+
+    def __init__(self, count: int, bytes_written: int, last_document: Optional[Any], complete: bool):
+        self.count = count
+        self.bytes_written = bytes_written
+        self.last_document = last_document
+        self.complete = complete
+
+    def __repr__(self):
+        return f'ExportResult(count={self.count}, bytes_written={self.bytes_written}, complete={self.complete})'
+
+
+def write_ndjson(documents: Iterable[Any],
+                 stream: TextIO,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_bytes: Optional[int] = None) -> ExportResult:
+    """
+    Writes documents to a stream as newline delimited json, one serialized document per line.
+    Lines are buffered and written in chunks of roughly chunk_size bytes so only a single chunk is ever held
+    in memory. Documents are serialized with __getstate__, the same as response bodies.
+
+    :param documents: The documents to write. Generators are consumed lazily
+    :param stream: The text stream written to
+    :param chunk_size: The number of bytes buffered before they are written to the stream
+    :param max_bytes: The number of bytes after which writing stops at the last whole document. Unlimited if not given.
+                      The first document is always written, even when larger, so every export makes progress
+    :return: The export result
+    """
+    chunk = []
+    chunk_bytes = 0
+    count = 0
+    bytes_written = 0
+    last_document = None
+
+    for document in documents:
+        # Non ascii characters are escaped so string lengths are byte lengths
+        line = json.dumps(document.__getstate__(), separators=(',', ':')) + '\n'
+        if max_bytes is not None and count > 0 and bytes_written + chunk_bytes + len(line) > max_bytes:
+            stream.write(''.join(chunk))
+            return ExportResult(count, bytes_written + chunk_bytes, last_document, complete=False)
+
+        chunk.append(line)
+        chunk_bytes += len(line)
+        count += 1
+        last_document = document
+
+        if chunk_bytes >= chunk_size:
+            stream.write(''.join(chunk))
+            bytes_written += chunk_bytes
+            chunk = []
+            chunk_bytes = 0
+
+    stream.write(''.join(chunk))
+    return ExportResult(count, bytes_written + chunk_bytes, last_document, complete=True)
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """
+    Command line entry point used to export every contact message for backups and analysis.
+
+    :param argv: The command line arguments. Defaults to sys.argv
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(prog='python -m chalicelib.export',
+                                     description='Export contact messages as newline delimited json')
+    parser.add_argument('--host', help='Mongo connection string. Defaults to the decrypted CONNECTION_STRING')
+    parser.add_argument('--output', help='File the export is written to. Defaults to standard output')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Number of messages read from the database per round trip')
+    args = parser.parse_args(argv)
+
+    connect(host=args.host or pyocle.config.connection_string())
+    documents = ContactMessageService().iter_documents_raw(batch_size=args.batch_size)
+
+    if args.output is None:
+        result = write_ndjson(documents, sys.stdout)
+    else:
+        with open(args.output, 'w') as output:
+            result = write_ndjson(documents, output)
+
+    print(f'Exported {result.count} contact messages', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,25 @@
+import hashlib
+import json
 import re
-from typing import Dict, Any, Optional, Union
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Union, List, Set, Type, TypeVar
 
-from pydantic import BaseModel, Field, EmailStr, Extra, validator
+import pyocle
+from bson import ObjectId
+from pydantic import BaseModel, Field, EmailStr, Extra, validator, root_validator, conint, conlist, constr
 from pydantic.validators import str_validator
 from pyocle.form import PaginationQueryParameters
 
-from chalicelib.model import Reason
+from chalicelib.cursor import decode_cursor
+from chalicelib.model import Reason, ContactMessage, json_field_names
+
+
+_PHONE_NUMBER_PATTERN = re.compile(
+    r'^(\+?\d{0,4})?\s?-?\s?(\(?\d{3}\)?)\s?-?\s?(\(?\d{3}\)?)\s?-?\s?(\(?\d{4}\)?)?$'
+)
+_NON_DIGIT_PATTERN = re.compile(r'\D')
+
+T = TypeVar('T', bound=BaseModel)
 
 
 class PhoneNumberNotValidError(ValueError):
@@ -36,7 +50,7 @@ class PhoneStr(str):
     @classmethod
     def validate(cls, value: Union[str]) -> str:
         # Verifies that a given string is a valid phone number
-        match = re.match(r'^(\+?\d{0,4})?\s?-?\s?(\(?\d{3}\)?)\s?-?\s?(\(?\d{3}\)?)\s?-?\s?(\(?\d{4}\)?)?$', value)
+        match = _PHONE_NUMBER_PATTERN.match(value)
         valid = match is not None
         if not valid:
             raise PhoneNumberNotValidError('value is not a valid phone number')
@@ -51,7 +65,7 @@ def _clean_phone_number(phone_number: str) -> str:
     :param phone_number: The phone number string to clean
     :return: The cleaned phone number string
     """
-    return re.sub(r'\D', '', phone_number)
+    return _NON_DIGIT_PATTERN.sub('', phone_number)
 
 
 class SenderCreationForm(BaseModel):
@@ -93,11 +107,409 @@ class ContactMessageCreationForm(BaseModel):
         anystr_strip_whitespace = True
         extra = Extra.forbid
 
+    def fingerprint(self) -> str:
+        """
+        Hashes the message and sender alias normalized for case and whitespace.
+        The sender email is left out since spam is resubmitted from rotating emails.
+
+        :return: The hex encoded fingerprint of the message
+        """
+        normalized = '\x1f'.join(' '.join(value.lower().split()) for value in (self.message, self.sender.alias))
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def contact_message_dict(self, identity: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Builds the contact message fields described by this form and the identity of its sender.
+        Fields are read directly rather than copying the form with dict() and patching the copy.
+
+        :param identity: The request identity of the sender
+        :return: The contact message fields ready to be created or published
+        """
+        return {
+            'message': self.message,
+            'reason': self.reason.value,
+            'sender': {
+                'alias': self.sender.alias,
+                'phone': self.sender.phone,
+                'email': self.sender.email,
+                'ip': identity.get('sourceIp', 'unknown'),
+                'user_agent': identity.get('userAgent', 'unknown')
+            }
+        }
+
+
+class ContactMessageReadForm(BaseModel):
+    """
+    Form representing contact messages that will be marked read by the requesting user
+    """
+    ids: conlist(str, min_items=1, max_items=100)
+
+    @validator('ids')
+    def validate_ids(cls, value: List[str]) -> List[str]:
+        return _validate_contact_message_ids(value)
+
+    class Config:
+        extra = Extra.forbid
+
+
+class ContactMessageFlagForm(ContactMessageReadForm):
+    """
+    Form representing contact messages that will be flagged or unflagged by the requesting user.
+    Flagging a message also marks it read.
+    """
+    flagged: bool = True
+
 
-class ContactMessageQueryParameters(PaginationQueryParameters):
+class ContactMessageUpdateFilterForm(BaseModel):
     """
-    Query parameters that can be used when requesting a list of contact messages
+    Form representing the contact messages selected by a bulk update.
+    Filters match the filters accepted when listing contact messages. At least one filter must be given so a bulk
+    update never selects every contact message by accident.
     """
     reason: Optional[str] = None
     archived: Optional[bool] = None
     responded: Optional[bool] = None
+    q: Optional[constr(strip_whitespace=True, min_length=1, max_length=200)] = None
+
+    @root_validator(skip_on_failure=True)
+    def validate_filtered(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :param values: The validated form values
+        :return: The unchanged form values
+        """
+        if all(value is None for value in values.values()):
+            raise ValueError('at least one filter must be given')
+
+        return values
+
+    class Config:
+        extra = Extra.forbid
+
+    def filters(self) -> Dict[str, Any]:
+        """
+        :return: The given filters keyed by contact message field name, including the search
+        """
+        return self.dict(exclude_none=True)
+
+
+class ContactMessageUpdateForm(BaseModel):
+    """
+    Form representing changes applied to many contact messages at once.
+    Contact messages are selected either by id or by filter, never both.
+    """
+    ids: Optional[conlist(str, min_items=1, max_items=100)] = None
+    filter: Optional[ContactMessageUpdateFilterForm] = None
+    archived: Optional[bool] = None
+    responded: Optional[bool] = None
+
+    @validator('ids')
+    def validate_ids(cls, value: Optional[List[str]]) -> Optional[List[str]]:
+        return value if value is None else _validate_contact_message_ids(value)
+
+    @root_validator(skip_on_failure=True)
+    def validate_selection_and_changes(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :param values: The validated form values
+        :return: The unchanged form values
+        """
+        if (values.get('ids') is None) == (values.get('filter') is None):
+            raise ValueError('exactly one of ids or filter must be given')
+
+        if values.get('archived') is None and values.get('responded') is None:
+            raise ValueError('at least one of archived or responded must be given')
+
+        return values
+
+    class Config:
+        extra = Extra.forbid
+
+    def changes(self) -> Dict[str, bool]:
+        """
+        :return: The given changes keyed by contact message field name
+        """
+        return self.dict(include={'archived', 'responded'}, exclude_none=True)
+
+
+def _validate_contact_message_ids(value: List[str]) -> List[str]:
+    """
+    Ids are validated together since pyocle cannot describe errors located at a list index.
+
+    :param value: The contact message ids to validate
+    :return: The unchanged contact message ids
+    """
+    invalid_ids = [identifier for identifier in value if not ObjectId.is_valid(identifier)]
+    if len(invalid_ids) > 0:
+        raise ValueError(f'invalid contact message ids: {", ".join(invalid_ids)}')
+
+    return value
+
+
+def resolve_json_form(raw_body: Union[None, str, bytes], form_type: Type[T]) -> T:
+    """
+    Same as pyocle.form.resolve_form except the body is parsed once with the standard json parser instead of
+    jsonpickle, which is considerably faster and never reconstructs objects.
+
+    :param raw_body: The raw request body
+    :param form_type: The form type to resolve
+    :return: The resolved form
+    """
+    try:
+        data = json.loads(raw_body)
+    except (TypeError, ValueError):
+        # Bodies that are missing or not json are left to pyocle so the error response stays the same
+        data = raw_body
+
+    return pyocle.form.resolve_form(data, form_type)
+
+
+def resolve_creation_form(raw_body: Union[None, str, bytes]) -> ContactMessageCreationForm:
+    """
+    Same as resolve_json_form for contact message creation forms
+
+    :param raw_body: The raw request body
+    :return: The resolved form
+    """
+    return resolve_json_form(raw_body, ContactMessageCreationForm)
+
+
+class MessageDecodeError(ValueError):
+    """
+    Error used to denote that a published message did not have the shape of a contact message
+    """
+    pass
+
+
+_MESSAGE_KEYS = {'message', 'reason', 'sender'}
+_OPTIONAL_MESSAGE_KEYS = {'id'}
+_SENDER_KEYS = {'alias', 'email', 'ip', 'user_agent'}
+_OPTIONAL_SENDER_KEYS = {'phone'}
+
+
+def decode_contact_message(message: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    Decodes a published contact message straight into contact message fields.
+    Unlike jsonpickle, the message is parsed with the standard json parser, never reconstructs arbitrary objects and
+    is rejected as soon as its shape differs from a published contact message.
+
+    :param message: The published message
+    :return: The contact message fields ready to be created
+    """
+    try:
+        data = json.loads(message)
+    except (TypeError, ValueError) as ex:
+        raise MessageDecodeError('message is not valid json') from ex
+
+    return contact_message_fields(data)
+
+
+def contact_message_fields(data: Any) -> Dict[str, Any]:
+    """
+    Same as decode_contact_message for messages that have already been parsed.
+
+    :param data: The parsed published message
+    :return: The contact message fields ready to be created
+    """
+    _verify_keys(data, _MESSAGE_KEYS, _OPTIONAL_MESSAGE_KEYS, 'message')
+    sender = data['sender']
+    _verify_keys(sender, _SENDER_KEYS, _OPTIONAL_SENDER_KEYS, 'sender')
+
+    fields = {
+        'message': _decode_str(data, 'message'),
+        'reason': _decode_reason(data),
+        'sender': {
+            'alias': _decode_str(sender, 'alias'),
+            'phone': _decode_str(sender, 'phone', optional=True),
+            'email': _decode_str(sender, 'email'),
+            'ip': _decode_str(sender, 'ip'),
+            'user_agent': _decode_str(sender, 'user_agent')
+        }
+    }
+
+    identifier = _decode_str(data, 'id', optional=True)
+    if identifier is not None:
+        if not ObjectId.is_valid(identifier):
+            raise MessageDecodeError('id is not a valid object id')
+
+        fields['id'] = identifier
+
+    return fields
+
+
+def _verify_keys(data: Any, required: set, optional: set, name: str):
+    if not isinstance(data, dict):
+        raise MessageDecodeError(f'{name} is not an object')
+
+    keys = data.keys()
+    if not required <= keys or not keys <= required | optional:
+        raise MessageDecodeError(f'{name} has unexpected fields: {", ".join(sorted(keys))}')
+
+
+def _decode_str(data: Dict[str, Any], key: str, optional: bool = False) -> Optional[str]:
+    value = data.get(key)
+    if value is None and optional:
+        return None
+
+    if not isinstance(value, str):
+        raise MessageDecodeError(f'{key} is not a string')
+
+    return value
+
+
+def _decode_reason(data: Dict[str, Any]) -> str:
+    reason = _decode_str(data, 'reason')
+    try:
+        return Reason(reason).value
+    except ValueError as ex:
+        raise MessageDecodeError(f'{reason} is not a valid reason') from ex
+
+
+class ContactMessageFieldsQueryParameters(BaseModel):
+    """
+    Query parameters used to select a subset of contact message fields.
+    Fields are given as a comma separated list of the names used in responses. Ex. fields=reason,timeCreated
+    """
+    fields: Optional[List[str]] = None
+
+    @validator('fields', pre=True)
+    def resolve_fields(cls, value: Union[None, str, List[str]]) -> Optional[List[str]]:
+        """
+        Splits the comma separated fields and maps each response name to its contact message field name.
+
+        :param value: The comma separated field names
+        :return: The contact message field names. None if no fields were given
+        """
+        if value is None:
+            return None
+
+        # Field names are accepted as well since resolved query parameters are validated a second time
+        field_names = json_field_names(ContactMessage)
+        field_names.update({name: name for name in field_names.values()})
+
+        names = [name.strip() for name in (value.split(',') if isinstance(value, str) else value)]
+        unknown_names = [name for name in names if name not in field_names]
+        if len(unknown_names) > 0:
+            raise ValueError(f'unknown fields: {", ".join(unknown_names)}')
+
+        return [field_names[name] for name in names]
+
+
+class ContactMessageFilterQueryParameters(ContactMessageFieldsQueryParameters):
+    """
+    Query parameters used to filter contact messages and continue from a cursor position
+    """
+    reason: Optional[str] = None
+    archived: Optional[bool] = None
+    responded: Optional[bool] = None
+    cursor: Optional[str] = None
+
+    @validator('cursor')
+    def validate_cursor(cls, value: Optional[str]) -> Optional[str]:
+        """
+        Verifies that a given cursor was produced by a previous request so malformed cursors are rejected
+        as bad input rather than failing once the query is executed.
+
+        :param value: The cursor string to validate
+        :return: The unchanged cursor string
+        """
+        if value is not None:
+            decode_cursor(value)
+
+        return value
+
+    def filters(self) -> Dict[str, Any]:
+        """
+        :return: The given filter parameters keyed by contact message field name
+        """
+        return self.dict(include={'reason', 'archived', 'responded'}, exclude_none=True)
+
+
+class ContactMessageQueryParameters(ContactMessageFilterQueryParameters, PaginationQueryParameters):
+    """
+    Query parameters that can be used when requesting a list of contact messages.
+    When a cursor is given, the page parameter is ignored and results continue after the cursor position.
+    Total counts are only included in pagination details when requested with total=true.
+    Searches given with q are sorted by relevance, so their cursors cannot be used without the search and vice versa.
+    Contact messages moved to the archive are only selected when requested with includeArchive=true.
+    """
+    q: Optional[constr(strip_whitespace=True, min_length=1, max_length=200)] = None
+    total: bool = False
+    include_archive: bool = Field(False, alias='includeArchive')
+
+    class Config:
+        # Resolved query parameters are validated a second time using field names
+        allow_population_by_field_name = True
+
+    @root_validator(skip_on_failure=True)
+    def validate_cursor_matches_search(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Search cursors hold a relevance score where list cursors hold a creation time.
+
+        :param values: The validated query parameters
+        :return: The unchanged query parameters
+        """
+        cursor = values.get('cursor')
+        if cursor is None:
+            return values
+
+        is_search_cursor = isinstance(decode_cursor(cursor)[0], (int, float))
+        if is_search_cursor != (values.get('q') is not None):
+            raise ValueError('cursor does not match the search')
+
+        return values
+
+    def filters(self) -> Dict[str, Any]:
+        """
+        :return: The given filter parameters keyed by contact message field name, including the search
+                 and whether archived contact messages are included
+        """
+        return self.dict(include={'reason', 'archived', 'responded', 'q', *self._archive_option()}, exclude_none=True)
+
+    def query(self) -> Dict[str, Any]:
+        """
+        :return: The parameters used to select a page of contact messages
+        """
+        return self.dict(exclude={'total', 'include_archive'} - self._archive_option(), exclude_none=True)
+
+    def _archive_option(self) -> Set[str]:
+        """
+        The archive option is only passed on when given so queries of the contact message collection alone
+        are unchanged
+
+        :return: The archive option field name when contact messages moved to the archive are included
+        """
+        return {'include_archive'} if self.include_archive else set()
+
+
+class ContactMessageExportQueryParameters(ContactMessageFilterQueryParameters):
+    """
+    Query parameters that can be used when exporting contact messages.
+    The batch size is the number of messages read from the database per round trip.
+    """
+    batch_size: conint(ge=1, le=1000) = Field(500, alias='batchSize')
+
+    class Config:
+        # Resolved query parameters are validated a second time using field names
+        allow_population_by_field_name = True
+
+    def query(self) -> Dict[str, Any]:
+        """
+        :return: The parameters used to stream contact messages
+        """
+        return self.dict(exclude_none=True)
+
+
+class ContactMessageStatisticsQueryParameters(BaseModel):
+    """
+    Query parameters that can be used when requesting contact message statistics
+    """
+    days: conint(ge=1, le=366) = 30
+
+    def since(self, now: Optional[datetime] = None) -> datetime:
+        """
+        Windows start at midnight so every request made on the same day shares the same window.
+
+        :param now: The current time. Defaults to the current UTC time
+        :return: The start of the window of days creations are counted in, including the current day
+        """
+        today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+        return today - timedelta(days=self.days - 1)
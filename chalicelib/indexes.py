@@ -0,0 +1,208 @@
+import argparse
+import sys
+from datetime import datetime
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+import pyocle
+from bson import ObjectId
+from mongoengine import Document, connect
+
+from chalicelib.cursor import encode_cursor
+from chalicelib.model import ContactMessage, ArchivedContactMessage, ContactMessageFingerprint, OutboxMessage, \
+    PendingNotification, RateLimitCounter, Reason
+from chalicelib.service import ContactMessageService, ResourceService
+
+IndexKey = List[Tuple[str, int]]
+
+# Documents whose indexes are created and verified by this command
+MANAGED_DOCUMENTS = (ContactMessage, ArchivedContactMessage, PendingNotification, OutboxMessage, RateLimitCounter,
+                     ContactMessageFingerprint)
+
+# Sample values used to build every query shape that can be produced by ContactMessageQueryParameters filters
+CONTACT_MESSAGE_FILTER_SAMPLES = {
+    'reason': Reason.BUSINESS.value,
+    'archived': False,
+    'responded': False
+}
+
+
+def declared_indexes(document: Type[Document]) -> Dict[str, IndexKey]:
+    """
+    :param document: The document type whose declared indexes will be returned
+    :return: The indexes declared in the document meta keyed by index name
+    """
+    return {spec['name']: list(spec['fields']) for spec in document._meta['index_specs']}
+
+
+def missing_indexes(document: Type[Document]) -> Dict[str, IndexKey]:
+    """
+    Compares the indexes declared by a document with those that exist in its collection.
+
+    :param document: The document type whose indexes will be verified
+    :return: The declared indexes that do not exist in the collection keyed by index name
+    """
+    existing = [_existing_key(index) for index in document._get_collection().index_information().values()]
+    return {name: key for name, key in declared_indexes(document).items() if _text_sorted(key) not in existing}
+
+
+def query_shapes(filter_samples: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    :param filter_samples: Sample value for every field that may be filtered on
+    :return: Every combination of the given filters, including no filters at all
+    """
+    fields = list(filter_samples)
+    return [
+        {field: filter_samples[field] for field in selected}
+        for size in range(len(fields) + 1)
+        for selected in combinations(fields, size)
+    ]
+
+
+def covering_index(document: Type[Document], filters: Sequence[str], ordering: Sequence[str]) -> Optional[str]:
+    """
+    Finds a declared index able to serve an equality query on the given filters sorted by the given ordering.
+    Such an index starts with the filter fields, in any order, followed by the ordering fields.
+
+    :param document: The document type being queried
+    :param filters: The field names the query filters on
+    :param ordering: The field names the query is sorted by, prefixed with '-' for descending order
+    :return: The name of the covering index. None if no declared index covers the query
+    """
+    filter_keys = {_db_field(document, field) for field in filters}
+    sort_keys = [(_db_field(document, field.lstrip('-')), -1 if field.startswith('-') else 1) for field in ordering]
+
+    for name, key in declared_indexes(document).items():
+        prefix = key[:len(filter_keys)]
+        suffix = key[len(filter_keys):]
+        if {field for field, _ in prefix} == filter_keys and suffix == sort_keys:
+            return name
+
+    return None
+
+
+def winning_index(query_set) -> Optional[str]:
+    """
+    Asks the query planner which index it would use for a given query set.
+
+    :param query_set: The query set to explain
+    :return: The name of the index used. None if the planner resorted to a collection scan or an in memory sort
+    """
+    plan = query_set.explain()['queryPlanner']['winningPlan']
+    stages = list(_plan_stages(plan.get('queryPlan', plan)))
+    if any(stage.get('stage') in ('COLLSCAN', 'SORT') for stage in stages):
+        return None
+
+    return next((stage['indexName'] for stage in stages if 'indexName' in stage), None)
+
+
+def report(service: ResourceService,
+           filter_samples: Dict[str, Any]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Builds a coverage report for every query a resource service issues.
+
+    :param service: The resource service whose queries will be reported on
+    :param filter_samples: Sample value for every field the service may filter on
+    :return: Tuples of query description, declared covering index and the index used by the planner
+    """
+    document = service.document
+    rows = [('find_one(id)', '_id_', winning_index(document.objects(id=ObjectId())))]
+
+    cursor = encode_cursor([ObjectId() if field == '-id' else datetime.utcnow() for field in service.ordering])
+    for filters in query_shapes(filter_samples):
+        declared = covering_index(document, list(filters), service.ordering)
+        description = ', '.join(filters) or 'no filters'
+
+        page_query = service.query_paginated(page=1, limit=1, **filters)
+        rows.append((f'find_paginated({description})', declared, winning_index(page_query)))
+
+        cursor_query = service.query_paginated(page=0, limit=1, cursor=cursor, **filters)
+        rows.append((f'find_paginated({description}, cursor)', declared, winning_index(cursor_query)))
+
+    return rows
+
+
+def _existing_key(index: Dict[str, Any]) -> IndexKey:
+    """
+    :param index: Index information reported by the server
+    :return: The index key. Text indexes are reported with internal keys so their weighted fields are used instead
+    """
+    key = list(index['key'])
+    if ('_fts', 'text') in key:
+        key = [(field, value) for field, value in key if field not in ('_fts', '_ftsx')]
+        key += [(field, 'text') for field in index['weights']]
+
+    return _text_sorted(key)
+
+
+def _text_sorted(key: IndexKey) -> IndexKey:
+    """
+    The order of text fields does not matter, so they are sorted to allow keys to be compared
+
+    :param key: The index key
+    :return: The index key with its text fields sorted
+    """
+    return [part for part in key if part[1] != 'text'] + sorted(part for part in key if part[1] == 'text')
+
+
+def _db_field(document: Type[Document], field: str) -> str:
+    return document._fields[field].db_field
+
+
+def _plan_stages(plan: Dict[str, Any]):
+    """
+    Walks a query plan tree yielding every stage
+
+    :param plan: The query plan stage to walk from
+    """
+    yield plan
+    if 'inputStage' in plan:
+        yield from _plan_stages(plan['inputStage'])
+
+    for input_stage in plan.get('inputStages', []):
+        yield from _plan_stages(input_stage)
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """
+    Command line entry point used to manage contact message indexes outside of function start up.
+
+    :param argv: The command line arguments. Defaults to sys.argv
+    :return: Exit code. Non zero when verification fails
+    """
+    parser = argparse.ArgumentParser(prog='python -m chalicelib.indexes',
+                                     description='Create and verify contact message service indexes')
+    parser.add_argument('command', choices=['create', 'verify', 'report'],
+                        help='create missing indexes, verify declared indexes exist or report query coverage')
+    parser.add_argument('--host', help='Mongo connection string. Defaults to the decrypted CONNECTION_STRING')
+    args = parser.parse_args(argv)
+
+    connect(host=args.host or pyocle.config.connection_string())
+
+    if args.command == 'create':
+        for document in MANAGED_DOCUMENTS:
+            document.ensure_indexes()
+            print(f'Ensured {document.__name__} indexes: {", ".join(declared_indexes(document))}')
+        return 0
+
+    if args.command == 'verify':
+        missing = {}
+        for document in MANAGED_DOCUMENTS:
+            missing.update({f'{document.__name__}.{name}': key for name, key in missing_indexes(document).items()})
+
+        for name, key in missing.items():
+            print(f'Missing index {name}: {key}')
+
+        print('All declared indexes exist' if not missing else f'{len(missing)} declared indexes are missing')
+        return 1 if missing else 0
+
+    rows = report(ContactMessageService(), CONTACT_MESSAGE_FILTER_SAMPLES)
+    for query, declared, used in rows:
+        status = 'covered' if used is not None else 'NOT COVERED'
+        print(f'{query}: {status} (declared: {declared}, planner: {used})')
+
+    return 0 if all(used is not None for _, _, used in rows) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from pymongo import monitoring
+
+from chalicelib.config import bool_env_var
+
+NAMESPACE = 'ContactMessageService'
+
+DIMENSIONS = ['Route', 'ColdStart']
+
+
+class Timings:
+    """
+    Durations, in milliseconds, and counts recorded while a single handler invocation runs.
+    Durations recorded more than once under the same name are summed.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, milliseconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + milliseconds
+
+    def increment(self, name: str, count: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def __repr__(self):
+        return f'Timings(durations={self.durations}, counts={self.counts})'
+
+
+# Lambda runs one invocation per container at a time, but timings are kept per thread so tools running
+# handlers concurrently never mix invocations
+_current = threading.local()
+
+
+def current_timings() -> Optional[Timings]:
+    """
+    :return: The timings of the invocation running on this thread. None outside of a timed handler
+    """
+    return getattr(_current, 'timings', None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Records how long the enclosed block takes as a stage of the current invocation.
+    Does nothing outside of a timed handler.
+
+    :param name: The name of the stage, such as validate, query or serialize
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings()
+        if timings is not None:
+            timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+class CommandTimings(monitoring.CommandListener):
+    """
+    Command listener recording the duration of every mongo command sent during a timed invocation.
+    Commands are recorded in total and per command name.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        timings = current_timings()
+        if timings is None:
+            return
+
+        milliseconds = event.duration_micros / 1000
+        timings.add('mongo', milliseconds)
+        timings.add(f'mongo.{event.command_name}', milliseconds)
+        timings.increment('mongoCommands')
+
+
+class MetricLogger:
+    """
+    Writes invocation timings as CloudWatch embedded metric format log lines, dimensioned by route and whether the
+    invocation was the first of its container. Lambda ships standard output to CloudWatch Logs, which extracts the
+    metrics from each line without any API call.
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 namespace: str = NAMESPACE,
+                 write: Callable[[str], Any] = print,
+                 clock: Callable[[], float] = time.time):
+        """
+        :param enabled: Whether metrics are written. Defaults to METRICS_ENABLED
+        :param namespace: The CloudWatch namespace metrics are published to
+        :param write: Writes a single log line
+        :param clock: Clock, in seconds since the epoch, used to timestamp metrics
+        """
+        self.enabled = enabled if enabled is not None else bool_env_var('METRICS_ENABLED', True)
+        self.namespace = namespace
+        self.cold_start = True
+        self._write = write
+        self._clock = clock
+
+    def log(self, route: str, timings: Timings):
+        """
+        :param route: The name of the handler that was invoked
+        :param timings: The timings recorded by the invocation
+        """
+        cold_start = self.cold_start
+        self.cold_start = False
+        if self.enabled:
+            self._write(json.dumps(self.record(route, timings, cold_start), separators=(',', ':')))
+
+    def record(self, route: str, timings: Timings, cold_start: bool) -> Dict[str, Any]:
+        """
+        :return: The embedded metric format record of the given timings
+        """
+        metrics = [{'Name': name, 'Unit': 'Milliseconds'} for name in timings.durations]
+        metrics += [{'Name': name, 'Unit': 'Count'} for name in timings.counts]
+        return {
+            '_aws': {
+                'Timestamp': int(self._clock() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [DIMENSIONS],
+                    'Metrics': metrics
+                }]
+            },
+            'Route': route,
+            'ColdStart': str(cold_start).lower(),
+            **{name: round(milliseconds, 3) for name, milliseconds in timings.durations.items()},
+            **timings.counts
+        }
+
+
+command_timings = CommandTimings()
+metric_logger = MetricLogger()
+
+
+def timed(decorated: Callable) -> Callable:
+    """
+    Records the total duration of a handler along with the stages and mongo commands it runs, then logs them as
+    metrics. Invocations that raise are logged as well. Place directly above the handler, below
+    pyocle.response.error_handler, since the error handler does not keep the name of the handler it wraps.
+
+    @app.route('/')
+    @error_handler
+    @timed
+    def route():
+        with stage('query'):
+            ...
+
+    :param decorated: The handler to time. Its name is used as the route dimension
+    :return: The timed handler
+    """
+
+    @functools.wraps(decorated)
+    def wrapped_handler(*args, **kwargs):
+        timings = Timings()
+        _current.timings = timings
+        started = time.perf_counter()
+        try:
+            return decorated(*args, **kwargs)
+        finally:
+            timings.add('total', (time.perf_counter() - started) * 1000)
+            _current.timings = None
+            metric_logger.log(decorated.__name__, timings)
+
+    return wrapped_handler
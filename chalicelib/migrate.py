@@ -0,0 +1,33 @@
+import argparse
+import sys
+from typing import Sequence
+
+import pyocle
+from mongoengine import connect
+
+from chalicelib.service import ContactMessageService
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """
+    Command line entry point used to migrate existing contact messages after deploying model changes.
+
+    :param argv: The command line arguments. Defaults to sys.argv
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(prog='python -m chalicelib.migrate',
+                                     description='Migrate existing contact messages')
+    parser.add_argument('command', choices=['reader-counts'],
+                        help='recompute reader and flagged counts of every message from its readers')
+    parser.add_argument('--host', help='Mongo connection string. Defaults to the decrypted CONNECTION_STRING')
+    args = parser.parse_args(argv)
+
+    connect(host=args.host or pyocle.config.connection_string())
+
+    updated_count = ContactMessageService().backfill_reader_counts()
+    print(f'Set reader counts on {updated_count} contact messages')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,18 @@
+import functools
 import json
 from datetime import datetime
 from enum import Enum
-from typing import Sequence
+from typing import Sequence, Iterable, Dict, Any, Optional, FrozenSet, Type, Union
 
+from bson import ObjectId
 from mongoengine import BooleanField
 from mongoengine import DateTimeField
+from mongoengine import DictField
 from mongoengine import EmailField
 from mongoengine import EmbeddedDocumentField
+from mongoengine import IntField
 from mongoengine import ListField
+from mongoengine import ObjectIdField
 from mongoengine import StringField
 from mongoengine_goodjson import Document, EmbeddedDocument
 from pyocle.serialization import CamelCaseAttributesMixin
@@ -82,9 +87,42 @@ class ReaderCollection(CamelCaseAttributesMixin):
             self.flagged_by_you = None
 
 
-class ContactMessage(Document):
+class FieldSelectionMixin:
     """
-    Represents contact message document in mongo
+    Mixin for documents that can be serialized with only a subset of their fields.
+    Documents selected with QuerySet.only() hold default values for every field that was not selected,
+    which would otherwise be serialized as if they were stored values.
+    """
+    _selected_fields: Optional[FrozenSet[str]] = None
+
+    def select_fields(self, fields: Iterable[str]):
+        """
+        Limits serialization to the given fields. The document id is always serialized.
+
+        :param fields: The document field names that will be serialized
+        :return: The same document
+        """
+        self._selected_fields = frozenset(['id'] + [self._fields[field].db_field for field in fields])
+        return self
+
+    def _filter_selected_fields(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        if self._selected_fields is None:
+            return state
+
+        return {key: value for key, value in state.items() if key in self._selected_fields}
+
+
+def json_field_names(document) -> Dict[str, str]:
+    """
+    :param document: The document type to inspect
+    :return: Document field names keyed by the name used when the document is serialized
+    """
+    return {'id' if name == 'id' else field.db_field: name for name, field in document._fields.items()}
+
+
+class ContactMessageDocument(FieldSelectionMixin, Document):
+    """
+    Represents the contact message fields and indexes shared by every contact message storage tier
     """
     message = StringField(min_length=1, max_length=2000, required=True)
     reason = StringField(enum=Reason, required=True)
@@ -92,12 +130,142 @@ class ContactMessage(Document):
     responded = BooleanField(default=False, required=True)
     sender = EmbeddedDocumentField(document_type=Sender, required=True)
     readers = ListField(EmbeddedDocumentField(Reader))
+    # Maintained alongside readers by every update so summaries never need to scan the readers
+    reader_count = IntField(db_field='readerCount', default=0, required=True)
+    flagged_count = IntField(db_field='flaggedCount', default=0, required=True)
     time_created = DateTimeField(db_field='timeCreated', default=datetime.utcnow, required=True)
     time_updated = DateTimeField(db_field='timeUpdated', default=datetime.utcnow, required=True)
 
+    # Every combination of list filters has an index with the filters as an equality prefix followed by the list
+    # sort order, so list queries neither scan the collection nor sort in memory.
+    # Searches are served by the text index instead.
+    # Indexes are created with `python -m chalicelib.indexes create` rather than on function start up.
+    meta = {
+        'abstract': True,
+        'auto_create_index': False,
+        'indexes': [
+            {'name': 'time_created', 'fields': ['-time_created', '-id']},
+            {'name': 'reason', 'fields': ['reason', '-time_created', '-id']},
+            {'name': 'archived', 'fields': ['archived', '-time_created', '-id']},
+            {'name': 'responded', 'fields': ['responded', '-time_created', '-id']},
+            {'name': 'reason_archived', 'fields': ['reason', 'archived', '-time_created', '-id']},
+            {'name': 'reason_responded', 'fields': ['reason', 'responded', '-time_created', '-id']},
+            {'name': 'archived_responded', 'fields': ['archived', 'responded', '-time_created', '-id']},
+            {'name': 'reason_archived_responded', 'fields': ['reason', 'archived', 'responded', '-time_created', '-id']},
+            {'name': 'text_search', 'fields': ['$message', '$sender.alias', '$sender.email']}
+        ]
+    }
+
     def __getstate__(self):
         json_str = self.to_json(follow_reference=True)
-        return json.loads(json_str)
+        return self._filter_selected_fields(json.loads(json_str))
+
+
+class ContactMessage(ContactMessageDocument):
+    """
+    Represents contact message document in mongo
+    """
+
+
+class ArchivedContactMessage(ContactMessageDocument):
+    """
+    Represents an archived contact message moved out of the contact message collection by tiering.
+    Archived contact messages keep the shape and indexes of contact messages so they can be read the same way.
+    """
+    meta = {
+        'collection': 'contact_message_archive'
+    }
+
+
+class RawDocument(FieldSelectionMixin):
+    """
+    Read only view over a document selected with QuerySet.as_pymongo().
+    Serializes to the same state as a document's __getstate__ without hydrating a document instance
+    or round tripping through a json string. Fields can be read as attributes by their document field names.
+    Fields missing from documents stored before the field existed read as their defaults, as they do once hydrated.
+    Documents selected with a projection should not be defaulted, as the fields they lack were projected away.
+    """
+
+    def __init__(self, document_type: Type[Document], son: Dict[str, Any], defaults: bool = True):
+        self._document_type = document_type
+        self._fields = document_type._fields
+        self._defaults = stored_defaults(document_type) if defaults else {}
+        self._son = son
+
+    def __getattr__(self, name: str) -> Any:
+        field = self._fields.get(name)
+        if field is None:
+            raise AttributeError(name)
+
+        return self._son.get(field.db_field, self._defaults.get(field.db_field))
+
+    def to_son(self) -> Dict[str, Any]:
+        """
+        :return: The raw document as selected from the database. Must not be modified
+        """
+        return self._son
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, RawDocument) and other._son == self._son
+
+    def __repr__(self):
+        return f'RawDocument({self._son})'
+
+    def __getstate__(self):
+        return self._filter_selected_fields(raw_to_state(self._with_defaults()))
+
+    def _with_defaults(self) -> Dict[str, Any]:
+        if all(db_field in self._son for db_field in self._defaults):
+            return self._son
+
+        # Missing fields are placed in field order so the state matches the hydrated document key for key
+        son = {}
+        for name in self._document_type._fields_ordered:
+            db_field = self._fields[name].db_field
+            if db_field in self._son:
+                son[db_field] = self._son[db_field]
+            elif db_field in self._defaults:
+                son[db_field] = self._defaults[db_field]
+
+        son.update({key: value for key, value in self._son.items() if key not in son})
+        return son
+
+
+@functools.lru_cache(maxsize=None)
+def stored_defaults(document_type: Type[Document]) -> Dict[str, Any]:
+    """
+    :param document_type: The document type to inspect
+    :return: The defaults mongoengine fills in for fields missing from a stored document, keyed by db field name.
+             Defaults that depend on when they are computed, such as the current time, are left out
+    """
+    defaults = {}
+    for field in document_type._fields.values():
+        default = field.default() if isinstance(field, ListField) else field.default
+        if default is not None and not callable(default):
+            defaults[field.db_field] = default
+
+    return defaults
+
+
+def raw_to_state(value: Any) -> Any:
+    """
+    Converts raw BSON values to the json compatible values produced by mongoengine_goodjson.
+    Document ids are renamed from _id to id, object ids become strings and datetimes become ISO formatted strings.
+    Keys are left untouched since they are already stored with their camel cased db field names.
+
+    :param value: The raw value to convert
+    :return: The converted value
+    """
+    if isinstance(value, dict):
+        return {('id' if key == '_id' else key): raw_to_state(item) for key, item in value.items() if key != '_cls'}
+    if isinstance(value, list):
+        return [raw_to_state(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return value
 
 
 class ContactMessageCollection(CamelCaseAttributesMixin):
@@ -107,6 +275,128 @@ class ContactMessageCollection(CamelCaseAttributesMixin):
     Will be most commonly used in responses
     """
 
-    def __init__(self, contact_messages: Sequence[ContactMessage]):
+    def __init__(self, contact_messages: Sequence[Union[ContactMessage, RawDocument]]):
         self.count = len(contact_messages)
         self.contact_messages = contact_messages
+
+
+class PendingNotification(Document):
+    """
+    Represents a contact message notification waiting to be sent as part of a digest.
+    Notifications are claimed by the flush sending them so concurrent flushes never send the same notification twice.
+    """
+    template_data = DictField(db_field='templateData', required=True)
+    claimed_by = StringField(db_field='claimedBy')
+    time_claimed = DateTimeField(db_field='timeClaimed')
+    time_created = DateTimeField(db_field='timeCreated', default=datetime.utcnow, required=True)
+
+    meta = {
+        'collection': 'pending_notification',
+        'auto_create_index': False,
+        'indexes': [
+            {'name': 'time_created', 'fields': ['time_created']}
+        ]
+    }
+
+
+class OutboxMessage(Document):
+    """
+    Represents a message waiting in the outbox to be published.
+    The next attempt time doubles as a lease: relays push it forward while publishing so concurrent relays skip
+    messages already being published.
+    """
+    topic_arn = StringField(db_field='topicArn', required=True)
+    message = StringField(required=True)
+    attempts = IntField(default=0, required=True)
+    last_error = StringField(db_field='lastError')
+    claimed_by = StringField(db_field='claimedBy')
+    time_next_attempt = DateTimeField(db_field='timeNextAttempt', default=datetime.utcnow, required=True)
+    time_created = DateTimeField(db_field='timeCreated', default=datetime.utcnow, required=True)
+
+    meta = {
+        'collection': 'outbox',
+        'auto_create_index': False,
+        'indexes': [
+            {'name': 'time_next_attempt', 'fields': ['time_next_attempt']}
+        ]
+    }
+
+
+class RateLimitCounter(Document):
+    """
+    Represents the number of requests a client made within a fixed rate limit window.
+    Counters are identified by the hashed client key and window start, and are removed by a TTL index once their
+    window has expired.
+    """
+    id = StringField(primary_key=True)
+    count = IntField(default=0, required=True)
+    time_expires = DateTimeField(db_field='timeExpires', required=True)
+
+    meta = {
+        'collection': 'rate_limit_counter',
+        'auto_create_index': False,
+        'indexes': [
+            {'name': 'time_expires', 'fields': ['time_expires'], 'expireAfterSeconds': 0}
+        ]
+    }
+
+
+class ContactMessageFingerprint(Document):
+    """
+    Represents the claim of the first contact message published with a fingerprint.
+    Claims are removed by a TTL index once their suppression window has expired.
+    """
+    id = StringField(primary_key=True)
+    contact_message_id = ObjectIdField(db_field='contactMessageId', required=True)
+    time_expires = DateTimeField(db_field='timeExpires', required=True)
+
+    meta = {
+        'collection': 'contact_message_fingerprint',
+        'auto_create_index': False,
+        'indexes': [
+            {'name': 'time_expires', 'fields': ['time_expires'], 'expireAfterSeconds': 0}
+        ]
+    }
+
+
+class MessageCounts(CamelCaseAttributesMixin):
+    """
+    Number of contact messages in each state
+    """
+
+    def __init__(self, total: int = 0, archived: int = 0, responded: int = 0, read_by_any: int = 0):
+        self.total = total
+        self.archived = archived
+        self.responded = responded
+        self.read_by_any = read_by_any
+
+    def __add__(self, other: 'MessageCounts') -> 'MessageCounts':
+        return MessageCounts(
+            total=self.total + other.total,
+            archived=self.archived + other.archived,
+            responded=self.responded + other.responded,
+            read_by_any=self.read_by_any + other.read_by_any
+        )
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, MessageCounts) and vars(other) == vars(self)
+
+    def __repr__(self):
+        return f'MessageCounts(total={self.total}, archived={self.archived}, ' \
+               f'responded={self.responded}, read_by_any={self.read_by_any})'
+
+
+class ContactMessageStatistics(CamelCaseAttributesMixin):
+    """
+    Summary of every contact message.
+    Will be most commonly used in responses
+    """
+
+    def __init__(self, by_reason: Dict[str, MessageCounts], created_per_day: Dict[str, int]):
+        """
+        :param by_reason: Message counts keyed by reason
+        :param created_per_day: Number of messages created keyed by ISO formatted day. Days without messages are omitted
+        """
+        self.counts = sum(by_reason.values(), MessageCounts())
+        self.by_reason = by_reason
+        self.created_per_day = created_per_day
@@ -0,0 +1,142 @@
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pyocle.service.ses import SimpleEmailService, TemplatedEmailForm
+
+from chalicelib.config import bool_env_var, int_env_var
+from chalicelib.model import PendingNotification
+from chalicelib.service import ResourceService
+
+EMAIL_SOURCE = 'JS Portfolio <no-reply@justinsexton.net>'
+EMAIL_TO_ADDRESSES = ['justinsexton.dev@gmail.com']
+
+# Claims held longer than this are assumed to belong to a flush that failed without releasing them
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+class NotificationService(ResourceService):
+    """
+    Sends contact message created notification emails.
+    In digest mode notifications are buffered as pending notifications and sent together as one summary email once
+    a digest is full or its oldest notification has waited long enough.
+    """
+
+    def __init__(self,
+                 digest_enabled: Optional[bool] = None,
+                 digest_max_size: Optional[int] = None,
+                 digest_max_age: Optional[timedelta] = None):
+        """
+        :param digest_enabled: Whether notifications are sent as digests. Defaults to NOTIFICATION_DIGEST_ENABLED
+        :param digest_max_size: Most notifications sent in one digest. Defaults to NOTIFICATION_DIGEST_MAX_SIZE
+        :param digest_max_age: Longest a notification waits before its digest is due.
+                               Defaults to NOTIFICATION_DIGEST_MAX_AGE_SECONDS
+        """
+        super().__init__(PendingNotification, ordering=('time_created', 'id'))
+        self.digest_enabled = digest_enabled if digest_enabled is not None \
+            else bool_env_var('NOTIFICATION_DIGEST_ENABLED', False)
+        self.digest_max_size = digest_max_size or int_env_var('NOTIFICATION_DIGEST_MAX_SIZE', 50)
+        self.digest_max_age = digest_max_age or \
+            timedelta(seconds=int_env_var('NOTIFICATION_DIGEST_MAX_AGE_SECONDS', 900))
+        self._ses = None
+
+    @property
+    def ses(self) -> SimpleEmailService:
+        """
+        :return: The email service. The client is created on first use
+        """
+        if self._ses is None:
+            self._ses = SimpleEmailService()
+
+        return self._ses
+
+    def notify(self, message: str) -> int:
+        """
+        Notifies that a contact message was created. The notification is sent immediately unless digest mode is
+        enabled, in which case it is buffered and digests are only sent once full.
+
+        :param message: The published contact message
+        :return: The number of notifications sent
+        """
+        if not self.digest_enabled:
+            self.ses.send_templated_email(self._email_form('contact-message-created', message))
+            return 1
+
+        self.collection.insert_one(PendingNotification(template_data=json.loads(message)).to_mongo())
+        return self.flush(full_only=True)
+
+    def flush(self, now: Optional[datetime] = None, full_only: bool = False) -> int:
+        """
+        Sends digests while one is due. A digest is due when it is full or its oldest notification has waited
+        longer than the maximum digest age.
+
+        :param now: The current time. Defaults to the current UTC time
+        :param full_only: Whether only full digests are sent regardless of age
+        :return: The number of notifications sent
+        """
+        now = now or datetime.utcnow()
+        sent = 0
+        while self._digest_due(now, full_only):
+            token = str(ObjectId())
+            notifications = self._claim(token, now)
+            if len(notifications) == 0:
+                break
+
+            # Claimed notifications are selected by id since claimedBy is not indexed
+            claimed = {'_id': {'$in': [notification['_id'] for notification in notifications]}, 'claimedBy': token}
+
+            try:
+                self.ses.send_templated_email(self._email_form('contact-message-digest', json.dumps({
+                    'count': len(notifications),
+                    'contactMessages': [notification['templateData'] for notification in notifications]
+                })))
+            except Exception:
+                self.collection.update_many(claimed, {'$unset': {'claimedBy': '', 'timeClaimed': ''}})
+                raise
+
+            self.collection.delete_many(claimed)
+            sent += len(notifications)
+
+        return sent
+
+    def _digest_due(self, now: datetime, full_only: bool) -> bool:
+        claimable = self._claimable(now)
+        if self.collection.count_documents(claimable, limit=self.digest_max_size) >= self.digest_max_size:
+            return True
+
+        if full_only:
+            return False
+
+        oldest = self.collection.find_one(claimable, {'timeCreated': 1}, sort=[('timeCreated', 1)])
+        return oldest is not None and oldest['timeCreated'] <= now - self.digest_max_age
+
+    def _claim(self, token: str, now: datetime) -> List[Dict[str, Any]]:
+        """
+        Claims the oldest claimable notifications, up to the maximum digest size.
+        The claim is a single conditional update so notifications claimed by a concurrent flush are skipped.
+
+        :param token: Identifies the flush claiming notifications
+        :param now: The current time
+        :return: The claimed notifications, oldest first
+        """
+        claimable = self._claimable(now)
+        oldest = self.collection.find(claimable, {'_id': 1}).sort('timeCreated', 1).limit(self.digest_max_size)
+        identifiers = [notification['_id'] for notification in oldest]
+        self.collection.update_many(
+            {'_id': {'$in': identifiers}, **claimable},
+            {'$set': {'claimedBy': token, 'timeClaimed': now}}
+        )
+        return list(self.collection.find({'_id': {'$in': identifiers}, 'claimedBy': token}).sort('timeCreated', 1))
+
+    def _claimable(self, now: datetime) -> Dict[str, Any]:
+        return {'$or': [{'claimedBy': None}, {'timeClaimed': {'$lt': now - CLAIM_TIMEOUT}}]}
+
+    def _email_form(self, template: str, template_data: str) -> TemplatedEmailForm:
+        return TemplatedEmailForm(
+            source=EMAIL_SOURCE,
+            to_addresses=EMAIL_TO_ADDRESSES,
+            configuration_set='contact-message-created',
+            template=template,
+            template_data=template_data
+        )
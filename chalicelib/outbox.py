@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Sequence
+
+from bson import ObjectId
+from pyocle.service.sns import SimpleNotificationService
+
+from chalicelib.model import OutboxMessage
+from chalicelib.service import ResourceService
+
+# SNS accepts at most 10 entries per batch publish
+MAX_BATCH_SIZE = 10
+
+
+class RelayResult:
+    """
+    Outcome of relaying outbox messages.
+    Failures are keyed by outbox message id and will be retried once their backoff elapses.
+    """
+
+    def __init__(self, published_count: int, failures: Dict[str, str]):
+        self.published_count = published_count
+        self.failures = failures
+
+    def __repr__(self):
+        return f'RelayResult(published_count={self.published_count}, failures={self.failures})'
+
+
+class OutboxRelay(ResourceService):
+    """
+    Publishes messages placed in the outbox. Messages are claimed in batches and published with a single batch
+    publish per topic. Failed messages are retried with exponential backoff.
+    """
+
+    def __init__(self,
+                 sns: Optional[SimpleNotificationService] = None,
+                 batch_size: int = MAX_BATCH_SIZE,
+                 lease: timedelta = timedelta(minutes=2),
+                 backoff_base: timedelta = timedelta(seconds=5),
+                 backoff_max: timedelta = timedelta(minutes=15)):
+        """
+        :param sns: The notification service used to publish. Created on first use when not given
+        :param batch_size: The number of messages claimed and published at a time. At most 10
+        :param lease: How long claimed messages are hidden from other relays while being published
+        :param backoff_base: Delay before the first retry. Each following retry waits twice as long
+        :param backoff_max: Longest delay between retries
+        """
+        super().__init__(OutboxMessage, ordering=('time_next_attempt', 'id'))
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sns = sns
+
+    @property
+    def sns(self) -> SimpleNotificationService:
+        """
+        :return: The notification service. The client is created on first use
+        """
+        if self._sns is None:
+            self._sns = SimpleNotificationService()
+
+        return self._sns
+
+    def relay(self, now: Optional[datetime] = None, max_batches: int = 10) -> RelayResult:
+        """
+        Publishes due outbox messages, oldest first, until none are due or the maximum number of batches is reached.
+
+        :param now: The current time. Defaults to the current UTC time
+        :param max_batches: The most batches published by this relay
+        :return: The relay result
+        """
+        now = now or datetime.utcnow()
+        published_count = 0
+        failures = {}
+        for _ in range(max_batches):
+            messages = self._claim(str(ObjectId()), now)
+            if len(messages) == 0:
+                break
+
+            batch_failures = self._publish(messages)
+            self.collection.delete_many({
+                '_id': {'$in': [message['_id'] for message in messages if str(message['_id']) not in batch_failures]}
+            })
+            for message in messages:
+                if str(message['_id']) in batch_failures:
+                    self._retry_later(message, batch_failures[str(message['_id'])], now)
+
+            published_count += len(messages) - len(batch_failures)
+            failures.update(batch_failures)
+
+        return RelayResult(published_count=published_count, failures=failures)
+
+    def backoff(self, attempts: int) -> timedelta:
+        """
+        :param attempts: The number of failed attempts so far
+        :return: The delay before the next attempt
+        """
+        return min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+
+    def _claim(self, token: str, now: datetime) -> List[Dict[str, Any]]:
+        """
+        Claims the due outbox messages that have waited longest. Claimed messages are leased by pushing their
+        next attempt forward, so concurrent relays skip them and they are retried if this relay never finishes.
+
+        :param token: Identifies the relay claiming messages
+        :param now: The current time
+        :return: The claimed messages
+        """
+        due = {'timeNextAttempt': {'$lte': now}}
+        oldest = self.collection.find(due, {'_id': 1}).sort('timeNextAttempt', 1).limit(self.batch_size)
+        identifiers = [message['_id'] for message in oldest]
+        self.collection.update_many(
+            {'_id': {'$in': identifiers}, **due},
+            {'$set': {'claimedBy': token, 'timeNextAttempt': now + self.lease}}
+        )
+        # Claimed messages are read back by id since claimedBy is not indexed
+        return list(self.collection.find({'_id': {'$in': identifiers}, 'claimedBy': token}))
+
+    def _publish(self, messages: Sequence[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        :param messages: The messages to publish
+        :return: The reason each message could not be published keyed by outbox message id
+        """
+        failures = {}
+        messages = sorted(messages, key=lambda message: message['topicArn'])
+        for topic_arn, topic_messages in groupby(messages, key=lambda message: message['topicArn']):
+            entries = [{'Id': str(message['_id']), 'Message': message['message']} for message in topic_messages]
+            try:
+                response = self.sns.client.publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=entries)
+            except Exception as ex:
+                failures.update({entry['Id']: str(ex) for entry in entries})
+                continue
+
+            failures.update({failure['Id']: failure.get('Message', failure['Code']) for failure in response['Failed']})
+
+        return failures
+
+    def _retry_later(self, message: Dict[str, Any], reason: str, now: datetime):
+        attempts = message.get('attempts', 0) + 1
+        self.collection.update_one({'_id': message['_id']}, {
+            '$set': {'attempts': attempts, 'lastError': reason, 'timeNextAttempt': now + self.backoff(attempts)},
+            '$unset': {'claimedBy': ''}
+        })
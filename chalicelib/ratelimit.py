@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from chalicelib.cache import LRUCache
+from chalicelib.config import bool_env_var, int_env_var
+from chalicelib.database import ensure_connection, healthy
+from chalicelib.model import RateLimitCounter
+
+
+class RateLimitExceededError(Exception):
+    """
+    Raised when a client has made more requests than allowed within the rate limit window
+    """
+
+    def __init__(self, retry_after: int):
+        """
+        :param retry_after: Seconds until the client may make another request
+        """
+        super().__init__(f'Rate limit exceeded. Retry after {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to capacity tokens that refill continuously at a fixed rate.
+    Each request takes a single token and requests are rejected while the bucket is empty.
+    """
+
+    def __init__(self, capacity: int, refill_per_second: float, clock: Callable[[], float] = time.monotonic):
+        """
+        :param capacity: The most tokens the bucket holds. The bucket starts full
+        :param refill_per_second: Tokens added to the bucket per second
+        :param clock: Clock used to refill the bucket
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._time_refilled = clock()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        """
+        :return: Whether a token was available and taken
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
+
+    def retry_after(self) -> int:
+        """
+        :return: Whole seconds until the next token is available
+        """
+        with self._lock:
+            self._refill()
+            return max(math.ceil((1 - self._tokens) / self.refill_per_second), 0)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._time_refilled) * self.refill_per_second)
+        self._time_refilled = now
+
+
+class RateLimiter:
+    """
+    Limits how many requests each client key makes within a window.
+    Every key is first checked against a token bucket kept by the container, so clients hammering a warm container
+    are rejected without any database round trip. Requests the bucket allows are then counted in a fixed window
+    counter shared by every container, which enforces the limit regardless of which container serves the request.
+    Keys are hashed before they are stored so counters never hold addresses.
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 max_requests: Optional[int] = None,
+                 window_seconds: Optional[int] = None,
+                 buckets: Optional[LRUCache] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        :param enabled: Whether requests are limited. Defaults to RATE_LIMIT_ENABLED
+        :param max_requests: The most requests a key makes per window. Defaults to RATE_LIMIT_MAX_REQUESTS
+        :param window_seconds: The length of a window. Defaults to RATE_LIMIT_WINDOW_SECONDS
+        :param buckets: Cache of token buckets keyed by hashed key. Defaults to a cache of RATE_LIMIT_CACHE_SIZE
+        :param clock: Clock, in seconds since the epoch, used to select windows and refill buckets
+        """
+        self.enabled = enabled if enabled is not None else bool_env_var('RATE_LIMIT_ENABLED', True)
+        self.max_requests = max_requests or int_env_var('RATE_LIMIT_MAX_REQUESTS', 5)
+        self.window_seconds = window_seconds or int_env_var('RATE_LIMIT_WINDOW_SECONDS', 600)
+        self.buckets = buckets or LRUCache(max_size=int_env_var('RATE_LIMIT_CACHE_SIZE', 1024))
+        self._clock = clock
+
+    @property
+    def collection(self) -> Collection:
+        """
+        :return: The rate limit counter collection. The database connection is registered on first use
+        """
+        ensure_connection()
+        return RateLimitCounter._get_collection()
+
+    def acquire(self, *keys: str):
+        """
+        Counts a request against every given key.
+
+        :param keys: The keys identifying the client making the request, such as its address
+        :raises RateLimitExceededError: When any key has made too many requests
+        """
+        if not self.enabled:
+            return
+
+        digests = [hashlib.sha1(key.encode('utf-8')).hexdigest() for key in keys]
+        for digest in digests:
+            bucket = self._bucket(digest)
+            if not bucket.take():
+                raise RateLimitExceededError(bucket.retry_after())
+
+        now = self._clock()
+        window_start = int(now // self.window_seconds) * self.window_seconds
+        window_end = window_start + self.window_seconds
+        for digest in digests:
+            if self._count(digest, window_start, window_end) > self.max_requests:
+                raise RateLimitExceededError(max(math.ceil(window_end - now), 1))
+
+    def _bucket(self, digest: str) -> TokenBucket:
+        bucket = self.buckets.get(digest)
+        if bucket is None:
+            bucket = TokenBucket(self.max_requests, self.max_requests / self.window_seconds, self._clock)
+            self.buckets.set(digest, bucket)
+
+        return bucket
+
+    def _count(self, digest: str, window_start: int, window_end: int) -> int:
+        """
+        Counts a request in the shared window counter with a single upsert.
+        Requests are allowed when the database is unavailable so the contact form never depends on it.
+        Requests are allowed straight away while heartbeats report the database down, rather than each waiting for
+        server selection to time out.
+
+        :return: The number of requests counted in the window, including this one
+        """
+        if healthy() is False:
+            logging.getLogger(__name__).warning('Rate limit counter unavailable, request allowed: database is down')
+            return 0
+
+        try:
+            counter = self.collection.find_one_and_update(
+                {'_id': f'{digest}:{window_start}'},
+                {'$inc': {'count': 1}, '$setOnInsert': {'timeExpires': datetime.utcfromtimestamp(window_end)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as ex:
+            logging.getLogger(__name__).warning(f'Rate limit counter unavailable, request allowed: {ex}')
+            return 0
+
+        return counter['count']
@@ -0,0 +1,114 @@
+import hashlib
+import math
+from typing import Any, Dict, Optional
+
+import pyocle
+from chalice import Response
+from pyocle.serialization import CamelCaseAttributesMixin
+
+
+class PaginationDetails(CamelCaseAttributesMixin, pyocle.response.PaginationDetails):
+    """
+    Pagination details extended with the cursor that can be used to select the following page.
+    Total counts are only serialized when given since they cost an additional query.
+    """
+
+    def __init__(self,
+                 page: int,
+                 limit: int,
+                 next_cursor: Optional[str] = None,
+                 total_count: Optional[int] = None,
+                 **kwargs):
+        super().__init__(page, limit)
+        self.next_cursor = next_cursor
+        if total_count is not None:
+            self.total_count = total_count
+            self.total_pages = math.ceil(total_count / limit)
+
+    def __repr__(self):
+        return f'PaginationDetails(page={self.page}, limit={self.limit}, next_cursor={self.next_cursor}, ' \
+               f'total_count={getattr(self, "total_count", None)})'
+
+
+# Responses are only valid for the authenticated caller and must be revalidated before reuse
+CACHE_CONTROL = 'private, no-cache'
+
+
+def ok(data: Any,
+       pagination_details: Optional[PaginationDetails] = None,
+       headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Same as pyocle.response.ok except pagination details are given directly rather than being built from
+    query parameters. This allows pagination details to include information only known after querying.
+
+    :param data: Data that will be used to populate the response body
+    :param pagination_details: Pagination details describing how the response data was collected
+    :param headers: Additional headers included in the response
+    :return: Ok response
+    """
+    meta = pyocle.response.ok_metadata()
+    meta.pagination_details = pagination_details or {}
+    return pyocle.response.response(200, meta, data, headers)
+
+
+def not_modified(etag: str) -> Response:
+    """
+    :param etag: The entity tag of the representation the client already holds
+    :return: Not modified response without a body
+    """
+    return Response(status_code=304, body='', headers=validator_headers(etag))
+
+
+def too_many_requests(retry_after: int) -> Response:
+    """
+    :param retry_after: Seconds until the client may make another request
+    :return: Too many requests response
+    """
+    meta = pyocle.response.metadata(message='Too many requests. Try again later.')
+    return pyocle.response.response(429, meta, headers={'Retry-After': str(retry_after)})
+
+
+def validator_headers(etag: str) -> Dict[str, str]:
+    """
+    :param etag: The entity tag of the representation being returned
+    :return: Headers allowing clients to make conditional requests for the representation
+    """
+    return {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+
+
+def entity_tag(*parts: Any) -> str:
+    """
+    Creates a strong entity tag from every value that determines a representation, such as a resource identifier,
+    its last update time and the fields selected.
+
+    :param parts: The values identifying the representation
+    :return: The quoted entity tag
+    """
+    digest = hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluates an If-None-Match header against the current entity tag of a representation.
+    Uses weak comparison as required for If-None-Match, so weak tags sent back by clients or proxies still match.
+
+    :param if_none_match: The If-None-Match header value. None when the header was not sent
+    :param etag: The current entity tag
+    :return: Whether the client already holds the current representation
+    """
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+
+        if tag == etag:
+            return True
+
+    return False
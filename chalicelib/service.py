@@ -1,53 +1,384 @@
-from typing import Dict, Any, Type, TypeVar, List, Union
+from typing import Dict, Any, Type, TypeVar, List, Union, Optional, Sequence, Iterator, Callable
 
-import jsonpickle
+import heapq
+import json
+from datetime import datetime
+from itertools import islice
 from bson import ObjectId
-from chalice.app import SNSEvent
-from mongoengine import Document, DoesNotExist, QuerySet
+from chalice.app import SQSEvent
+from mongoengine import Document, DoesNotExist, QuerySet, Q, ValidationError, FieldDoesNotExist
+from mongoengine import DEFAULT_CONNECTION_NAME
+from mongoengine.queryset import transform
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, PyMongoError
 from pyocle.serialization import CamelCaseAttributesMixin
 from pyocle.service.core import ResourceNotFoundError
 from pyocle.service.sns import SimpleNotificationService, PublishMessageForm
 
-from chalicelib.form import ContactMessageCreationForm
-from chalicelib.model import ContactMessage
+from chalicelib.cache import LRUCache
+from chalicelib.config import int_env_var, float_env_var, bool_env_var
+from chalicelib.cursor import decode_cursor, encode_cursor, InvalidCursorError
+from chalicelib.database import ensure_connection
+from chalicelib.duplicate import DuplicateDetector
+from chalicelib.form import ContactMessageCreationForm, decode_contact_message, contact_message_fields
+from chalicelib.model import ContactMessage, RawDocument, ContactMessageStatistics, MessageCounts, OutboxMessage, \
+    ArchivedContactMessage
+from chalicelib.ratelimit import RateLimiter
 
 T = TypeVar('T', bound=Document)
 
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+CONTACT_MESSAGE_CREATED_TOPIC_ARN = 'arn:aws:sns:us-east-2:811393626934:contact-message-created'
+
+
+class BulkCreateResult:
+    """
+    Outcome of creating many resources at once.
+    Failures are creation forms whose write failed and may succeed when retried. Rejections are creation forms that
+    are invalid and could never be created. Both are keyed by what identifies the creation form, such as its position.
+    """
+
+    def __init__(self, created_count: int, failures: Dict[Any, str], rejections: Optional[Dict[Any, str]] = None):
+        self.created_count = created_count
+        self.failures = failures
+        self.rejections = rejections or {}
+
+    def __repr__(self):
+        return f'BulkCreateResult(created_count={self.created_count}, failures={self.failures}, ' \
+               f'rejections={self.rejections})'
+
+
+class BulkCreateFailedError(Exception):
+    """
+    Raised when every write of a bulk creation failed, such as while the database is unavailable
+    """
+
+    def __init__(self, result: BulkCreateResult):
+        """
+        :param result: The outcome of the failed bulk creation
+        """
+        super().__init__(f'Every write failed: {result.failures}')
+        self.result = result
+
+
+class BulkUpdateResult(CamelCaseAttributesMixin):
+    """
+    Outcome of updating many resources at once.
+    Resources already in the requested state are matched but not modified.
+    """
+
+    def __init__(self, matched_count: int, modified_count: int):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, BulkUpdateResult) and vars(other) == vars(self)
+
+    def __repr__(self):
+        return f'BulkUpdateResult(matched_count={self.matched_count}, modified_count={self.modified_count})'
+
 
 class ResourceService:
     """
     General resource provider capable of basic and common resource selection and manipulation
     """
 
-    def __init__(self, document: Type[T]):
+    def __init__(self, document: Type[T], ordering: Sequence[str] = ('-id',)):
+        """
+        :param document: The document type this service provides
+        :param ordering: Field names, prefixed with '-' for descending order, that paginated results are sorted by.
+                         The fields must uniquely identify a document so they can be used as a keyset cursor.
+        """
         self.document = document
+        self.ordering = tuple(ordering)
+
+    @property
+    def objects(self) -> QuerySet:
+        """
+        :return: The document query set. The database connection is registered on first use
+        """
+        self._connect()
+        return self.document.objects
+
+    @property
+    def collection(self) -> Collection:
+        """
+        :return: The raw document collection. The database connection is registered on first use
+        """
+        self._connect()
+        return self.document._get_collection()
 
     def create(self, creation_form: Dict[str, Any]) -> T:
+        self._connect()
         return self.document(**creation_form).save()
 
+    def create_many(self, creation_forms: Sequence[Dict[str, Any]]) -> BulkCreateResult:
+        """
+        Validates and creates many resources with a single unordered bulk insert.
+        Invalid forms and failed writes do not prevent the remaining resources from being created.
+        Invalid forms are rejected while failed writes, including writes that could not reach the database, are
+        reported as failures. Resources that already exist are neither since creating them again could never succeed.
+
+        :param creation_forms: The forms used to create each resource
+        :return: The number of created resources and the reason each failed or rejected form was not created,
+                 keyed by position
+        """
+        failures = {}
+        rejections = {}
+        documents = {}
+        for position, creation_form in enumerate(creation_forms):
+            try:
+                document = self.document(**creation_form)
+                document.validate()
+                documents[position] = document
+            except (ValidationError, FieldDoesNotExist, TypeError) as ex:
+                rejections[position] = str(ex)
+
+        if len(documents) == 0:
+            return BulkCreateResult(created_count=0, failures=failures, rejections=rejections)
+
+        positions = list(documents)
+        sons = [documents[position].to_mongo() for position in positions]
+        try:
+            created_count = len(self.collection.insert_many(sons, ordered=False).inserted_ids)
+        except BulkWriteError as ex:
+            created_count = ex.details['nInserted']
+            for error in ex.details['writeErrors']:
+                if error['code'] != DUPLICATE_KEY_ERROR_CODE:
+                    failures[positions[error['index']]] = error['errmsg']
+        except PyMongoError as ex:
+            # Some documents may have been inserted before the error. Retrying them is harmless since they are
+            # recognized as already existing
+            created_count = 0
+            failures.update({position: str(ex) for position in positions})
+
+        return BulkCreateResult(created_count=created_count, failures=failures, rejections=rejections)
+
+    def count(self, **kwargs) -> int:
+        """
+        Counts the resources matching the given filters. Unfiltered counts are estimated from collection metadata,
+        which costs the same regardless of collection size but may drift slightly after an unclean shutdown.
+
+        :return: The number of matching resources
+        """
+        if len(kwargs) == 0:
+            return self.collection.estimated_document_count()
+
+        return self.objects(**kwargs).count()
+
     def find(self, **kwargs) -> List[T]:
-        return self._collect_to_list(self.document.objects(**kwargs))
+        return self._collect_to_list(self.objects(**kwargs))
+
+    def find_paginated(self,
+                       page: int,
+                       limit: int,
+                       cursor: Optional[str] = None,
+                       fields: Optional[Sequence[str]] = None,
+                       **kwargs) -> List[T]:
+        """
+        Selects a single page of resources sorted by the service ordering.
+        When a cursor is given, the page is ignored and the resources directly after the cursor position are selected.
+        Unlike page offsets, a cursor seeks directly to its position so deep pages cost the same as the first.
+
+        :param page: The zero based page number used to offset results when no cursor is given
+        :param limit: The maximum number of resources to select
+        :param cursor: Cursor returned by next_cursor for a previous page
+        :param fields: Field names that will be selected and serialized. All fields are selected when not given
+        :return: The selected resources
+        """
+        query_set = self.query_paginated(page, limit, cursor, fields, **kwargs)
+        return self._select_fields(self._collect_to_list(query_set), fields)
+
+    def find_paginated_raw(self,
+                           page: int,
+                           limit: int,
+                           cursor: Optional[str] = None,
+                           fields: Optional[Sequence[str]] = None,
+                           **kwargs) -> List[RawDocument]:
+        """
+        Same as find_paginated except resources are read as raw documents. Raw documents skip document hydration
+        and serialize straight from the selected BSON, which is considerably cheaper for read only responses.
+        See find_paginated for parameter details.
+
+        :return: The selected resources as raw documents
+        """
+        query_set = self.query_paginated(page, limit, cursor, fields, **kwargs).as_pymongo()
+        documents = [RawDocument(self.document, son) for son in query_set]
+        return self._select_fields(documents, fields)
+
+    def query_paginated(self,
+                        page: int,
+                        limit: int,
+                        cursor: Optional[str] = None,
+                        fields: Optional[Sequence[str]] = None,
+                        **kwargs) -> QuerySet:
+        """
+        Builds the unevaluated query set used by find_paginated. See find_paginated for parameter details.
+
+        :return: The query set selecting a single page of resources
+        """
+        query_set = self.query_sorted(cursor, fields, **kwargs)
+        if cursor is None:
+            query_set = query_set.skip(page * limit)
+
+        return query_set.limit(limit)
+
+    def query_sorted(self, cursor: Optional[str] = None, fields: Optional[Sequence[str]] = None, **kwargs) -> QuerySet:
+        """
+        Builds an unevaluated query set selecting every resource sorted by the service ordering.
+        When a cursor is given, only the resources after the cursor position are selected.
+
+        :param cursor: Cursor created for a previously selected resource
+        :param fields: Field names that will be selected. All fields are selected when not given
+        :return: The sorted query set
+        """
+        query_set = self._only(self.objects(**kwargs), fields).order_by(*self.ordering)
+        if cursor is not None:
+            query_set = query_set.filter(self._keyset_query(decode_cursor(cursor)))
+
+        return query_set
+
+    def iter_documents(self,
+                       batch_size: int = 500,
+                       cursor: Optional[str] = None,
+                       fields: Optional[Sequence[str]] = None,
+                       **kwargs) -> Iterator[T]:
+        """
+        Streams every resource sorted by the service ordering. Resources are read from a single database cursor
+        batch_size resources at a time, so memory use stays flat regardless of how many resources are selected.
+
+        :param batch_size: The number of resources read from the database per round trip
+        :param cursor: Cursor created for a previously selected resource. Streaming continues after its position
+        :param fields: Field names that will be selected and serialized. All fields are selected when not given
+        :return: Generator yielding each resource
+        """
+        for document in self.query_sorted(cursor, fields, **kwargs).batch_size(batch_size):
+            yield self._select_fields([document], fields)[0]
+
+    def iter_documents_raw(self,
+                           batch_size: int = 500,
+                           cursor: Optional[str] = None,
+                           fields: Optional[Sequence[str]] = None,
+                           **kwargs) -> Iterator[RawDocument]:
+        """
+        Same as iter_documents except resources are read as raw documents. See find_paginated_raw for details.
+
+        :return: Generator yielding each resource as a raw document
+        """
+        for son in self.query_sorted(cursor, fields, **kwargs).batch_size(batch_size).as_pymongo():
+            yield self._select_fields([RawDocument(self.document, son)], fields)[0]
+
+    def next_cursor(self, documents: Sequence[T], limit: int) -> Optional[str]:
+        """
+        Creates the cursor that selects the page following the given page of resources.
+
+        :param documents: The page of resources selected by find_paginated
+        :param limit: The limit used to select the page
+        :return: The cursor for the next page. None if the given page was the last page
+        """
+        if len(documents) < limit:
+            return None
+
+        return self.cursor(documents[-1])
 
-    def find_paginated(self, page: int, limit: int, **kwargs) -> List[T]:
-        offset = page * limit
-        return self._collect_to_list(self.document.objects(**kwargs).skip(offset).limit(limit))
+    def cursor(self, document: T) -> str:
+        """
+        :param document: The resource whose position will be encoded
+        :return: The cursor selecting the resources after the given resource
+        """
+        return encode_cursor([getattr(document, field.lstrip('-')) for field in self.ordering])
 
-    def find_one(self, identifier: str) -> T:
+    def find_one(self, identifier: str, fields: Optional[Sequence[str]] = None) -> T:
         """
         Selects a single resource with given identifier. Raises ResourceNotFoundError if no resource existed
         with the given identifier.
 
         :param identifier: The identifier that will be used to select the specific resource
+        :param fields: Field names that will be selected and serialized. All fields are selected when not given
         :return: The selected resource
         """
         if not ObjectId.is_valid(identifier):
             raise ResourceNotFoundError(identifier)
 
         try:
-            return self.document.objects.get(id=identifier)
+            document = self._only(self.objects, fields).get(id=identifier)
         except DoesNotExist:
             raise ResourceNotFoundError(identifier)
 
+        return self._select_fields([document], fields)[0]
+
+    def find_one_raw(self, identifier: str, fields: Optional[Sequence[str]] = None) -> RawDocument:
+        """
+        Same as find_one except the resource is read as a raw document. See find_paginated_raw for details.
+
+        :param identifier: The identifier that will be used to select the specific resource
+        :param fields: Field names that will be selected and serialized. All fields are selected when not given
+        :return: The selected resource as a raw document
+        """
+        if not ObjectId.is_valid(identifier):
+            raise ResourceNotFoundError(identifier)
+
+        son = self._only(self.objects(id=identifier), fields).as_pymongo().first()
+        if son is None:
+            raise ResourceNotFoundError(identifier)
+
+        return self._select_fields([RawDocument(self.document, son)], fields)[0]
+
+    def _connect(self):
+        ensure_connection(self.document._meta.get('db_alias', DEFAULT_CONNECTION_NAME))
+
+    def _only(self, query_set: QuerySet, fields: Optional[Sequence[str]]) -> QuerySet:
+        """
+        Limits the fields loaded by a query set. Ordering fields are always loaded so cursors can be created.
+
+        :param query_set: The query set to limit
+        :param fields: The field names to load. All fields are loaded when not given
+        :return: The limited query set
+        """
+        if fields is None:
+            return query_set
+
+        ordering_fields = [field.lstrip('-') for field in self.ordering]
+        return query_set.only(*dict.fromkeys([*fields, *ordering_fields]))
+
+    def _select_fields(self, documents: List[T], fields: Optional[Sequence[str]]) -> List[T]:
+        """
+        Limits the fields that will be serialized for each given document.
+        Documents must implement FieldSelectionMixin for fields to be selected.
+
+        :param documents: The documents whose serialized fields will be limited
+        :param fields: The field names that will be serialized. All fields are serialized when not given
+        :return: The given documents
+        """
+        if fields is not None:
+            for document in documents:
+                document.select_fields(fields)
+
+        return documents
+
+    def _keyset_query(self, values: Sequence[Any]) -> Q:
+        """
+        Builds a query matching every resource positioned after the given sort key values in the service ordering.
+        For an ordering of (a, b) this is equivalent to: a after value_a OR (a == value_a AND b after value_b)
+
+        :param values: The decoded cursor sort key values
+        :return: The keyset query
+        """
+        if len(values) != len(self.ordering):
+            raise InvalidCursorError('cursor does not match the ordering of this resource')
+
+        fields = [field.lstrip('-') for field in self.ordering]
+        query = Q()
+        for index, field in enumerate(fields):
+            operator = 'lt' if self.ordering[index].startswith('-') else 'gt'
+            conditions = dict(zip(fields[:index], values[:index]))
+            conditions[f'{field}__{operator}'] = values[index]
+            query = query | Q(**conditions)
+
+        return query
+
     def _collect_to_list(self, query_set: QuerySet) -> List[T]:
         return [document for document in query_set]
 
@@ -55,12 +386,13 @@ class ResourceService:
 class ContactMessageFormPublished(CamelCaseAttributesMixin):
     """
     Class representing data field that will be presented in a response after publishing a
-    create contact message form
+    create contact message form. The sns message id is None when the message was placed in the outbox
+    or was a duplicate of an earlier message, whose id is given instead.
     """
 
     def __init__(self,
                  contact_message_id: Union[str, ObjectId],
-                 sns_message_id: str):
+                 sns_message_id: Optional[str]):
         if isinstance(contact_message_id, ObjectId):
             contact_message_id = str(contact_message_id)
 
@@ -73,49 +405,561 @@ class ContactMessageService(ResourceService):
     Capable of interfacing with contact message resources
     """
 
-    def __init__(self):
-        super().__init__(ContactMessage)
-        self.sns = SimpleNotificationService()
+    def __init__(self,
+                 cache: Optional[LRUCache] = None,
+                 count_cache: Optional[LRUCache] = None,
+                 outbox_enabled: Optional[bool] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 duplicates: Optional[DuplicateDetector] = None):
+        """
+        :param cache: Cache of contact messages shared by invocations of a warm container.
+                      Defaults to a cache configured with CONTACT_MESSAGE_CACHE_SIZE and
+                      CONTACT_MESSAGE_CACHE_TTL_SECONDS
+        :param count_cache: Cache of contact message counts keyed by filters. Defaults to a cache configured with
+                            CONTACT_MESSAGE_COUNT_TTL_SECONDS
+        :param outbox_enabled: Whether published messages are placed in the outbox. Defaults to OUTBOX_ENABLED
+        :param rate_limiter: Limits how often each sender publishes messages. Defaults to a limiter configured with
+                             the RATE_LIMIT environment variables
+        :param duplicates: Detects duplicate messages before they are published. Defaults to a detector configured
+                           with the DUPLICATE environment variables
+        """
+        super().__init__(ContactMessage, ordering=('-time_created', '-id'))
+        # Archived contact messages moved out of the contact message collection by move_archived
+        self.archive = ResourceService(ArchivedContactMessage, ordering=self.ordering)
+        self.cache = cache or LRUCache(
+            max_size=int_env_var('CONTACT_MESSAGE_CACHE_SIZE', 256),
+            ttl_seconds=float_env_var('CONTACT_MESSAGE_CACHE_TTL_SECONDS', 30)
+        )
+        self.count_cache = count_cache or LRUCache(
+            max_size=128,
+            ttl_seconds=float_env_var('CONTACT_MESSAGE_COUNT_TTL_SECONDS', 10)
+        )
+        self.statistics_cache = LRUCache(
+            max_size=16,
+            ttl_seconds=float_env_var('CONTACT_MESSAGE_STATISTICS_TTL_SECONDS', 60)
+        )
+        self.outbox_enabled = outbox_enabled if outbox_enabled is not None \
+            else bool_env_var('OUTBOX_ENABLED', False)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.duplicates = duplicates or DuplicateDetector()
+        self._sns = None
 
-    def create_with_identity(self,
-                             creation_form: ContactMessageCreationForm,
-                             identity: Dict[str, Any]) -> ContactMessage:
-        creation_form_dict = creation_form.dict()
+    @property
+    def sns(self) -> SimpleNotificationService:
+        """
+        :return: The notification service. The client is created on first use
+        """
+        if self._sns is None:
+            self._sns = SimpleNotificationService()
+
+        return self._sns
+
+    def find_one(self, identifier: str, fields: Optional[Sequence[str]] = None) -> ContactMessage:
+        """
+        Same as ResourceService.find_one except contact messages moved to the archive are found as well
+        """
+        try:
+            return super().find_one(identifier, fields)
+        except ResourceNotFoundError:
+            return self.archive.find_one(identifier, fields)
+
+    def find_one_raw(self, identifier: str, fields: Optional[Sequence[str]] = None) -> RawDocument:
+        """
+        Same as ResourceService.find_one_raw except contact messages moved to the archive are found as well
+        """
+        try:
+            return super().find_one_raw(identifier, fields)
+        except ResourceNotFoundError:
+            return self.archive.find_one_raw(identifier, fields)
+
+    def find_paginated_raw(self,
+                           page: int,
+                           limit: int,
+                           cursor: Optional[str] = None,
+                           fields: Optional[Sequence[str]] = None,
+                           include_archive: bool = False,
+                           **kwargs) -> List[RawDocument]:
+        """
+        Same as ResourceService.find_paginated_raw except contact messages moved to the archive can be included.
+        Both collections are read in the same order and merged, so cursors work across both. Page offsets read every
+        earlier page from both collections and should be avoided for deep pages.
+
+        :param include_archive: Whether contact messages moved to the archive are selected as well
+        :return: The selected contact messages as raw documents
+        """
+        if not include_archive:
+            return super().find_paginated_raw(page, limit, cursor, fields, **kwargs)
+
+        offset = 0 if cursor is not None else page * limit
+        tiers = [
+            service.query_sorted(cursor, fields, **kwargs).limit(offset + limit).as_pymongo()
+            for service in (self, self.archive)
+        ]
+        sort_fields = [self.document._fields[field.lstrip('-')].db_field for field in self.ordering]
+        documents = self._merge_tiers(tiers, lambda son: tuple(son[field] for field in sort_fields), offset, limit)
+        return self._select_fields(documents, fields)
+
+    def find_one_cached(self, identifier: str) -> RawDocument:
+        """
+        Same as find_one_raw except the contact message is served from the container cache when possible.
+        Cached messages are kept until evicted, expired or invalidated. Every method updating a contact message
+        must invalidate it, while the cache time to live bounds how long updates made by other containers go unseen.
+
+        :param identifier: The identifier that will be used to select the specific contact message
+        :return: The selected contact message as a raw document with every field selected
+        """
+        son = self.cache.get(identifier)
+        if son is None:
+            son = self.find_one_raw(identifier).to_son()
+            self.cache.set(identifier, son)
+
+        # Field selection is kept per raw document so each request gets its own view of the cached message
+        return RawDocument(self.document, son)
+
+    def count(self, q: Optional[str] = None, include_archive: bool = False, **kwargs) -> int:
+        """
+        Same as ResourceService.count except the count can be limited to the results of a search
+        and can include contact messages moved to the archive
+
+        :param q: The search the counted contact messages must match
+        :param include_archive: Whether contact messages moved to the archive are counted as well
+        :return: The number of matching contact messages
+        """
+        services = (self, self.archive) if include_archive else (self,)
+        if q is None:
+            return sum(ResourceService.count(service, **kwargs) for service in services)
+
+        return sum(service.collection.count_documents(self._search_query(q, kwargs)) for service in services)
+
+    def search_paginated_raw(self,
+                             q: str,
+                             page: int,
+                             limit: int,
+                             cursor: Optional[str] = None,
+                             fields: Optional[Sequence[str]] = None,
+                             include_archive: bool = False,
+                             **kwargs) -> List[RawDocument]:
+        """
+        Searches message bodies along with sender aliases and emails using the text index.
+        Results are sorted most relevant first and include their relevance as score.
+        See find_paginated_raw for the remaining parameter details.
+
+        :param q: The words or "quoted phrases" to search for
+        :param cursor: Cursor returned by next_search_cursor for a previous page of the same search
+        :param include_archive: Whether contact messages moved to the archive are searched as well
+        :return: The selected contact messages as raw documents
+        """
+        if not include_archive:
+            pipeline = self.search_pipeline(q, page, limit, cursor, fields, **kwargs)
+            documents = self.collection.aggregate(pipeline)
+            return [RawDocument(self.document, son, defaults=fields is None) for son in documents]
+
+        offset = 0 if cursor is not None else page * limit
+        pipeline = self.search_pipeline(q, 0, offset + limit, cursor, fields, **kwargs)
+        tiers = [self.collection.aggregate(pipeline), self.archive.collection.aggregate(pipeline)]
+        return self._merge_tiers(tiers, lambda son: (son['score'], son['_id']), offset, limit, defaults=fields is None)
+
+    def _merge_tiers(self,
+                     tiers: Sequence[Iterator[Dict[str, Any]]],
+                     key: Callable[[Dict[str, Any]], Any],
+                     offset: int,
+                     limit: int,
+                     defaults: bool = True) -> List[RawDocument]:
+        """
+        Merges pages selected from each storage tier into a single page.
+
+        :param tiers: The raw documents selected from each tier, each sorted descending by the given key
+        :param key: Builds the sort key of a raw document
+        :param offset: The number of merged documents skipped
+        :param limit: The most documents selected
+        :param defaults: Whether fields missing from the selected documents read as their defaults
+        :return: The merged page as raw documents
+        """
+        merged = heapq.merge(*tiers, key=key, reverse=True)
+        return [RawDocument(self.document, son, defaults) for son in islice(merged, offset, offset + limit)]
+
+    def search_pipeline(self,
+                        q: str,
+                        page: int,
+                        limit: int,
+                        cursor: Optional[str] = None,
+                        fields: Optional[Sequence[str]] = None,
+                        **kwargs) -> List[Dict[str, Any]]:
+        """
+        Builds the aggregation pipeline used by search_paginated_raw. The text index selects matching messages, which
+        are then sorted by score and id. Sorting directly before the limit keeps only a single page in memory.
+        Fields are selected with a projection since raw documents hold no defaults for unselected fields.
+
+        :return: The aggregation pipeline
+        """
+        pipeline = [
+            {'$match': self._search_query(q, kwargs)},
+            {'$addFields': {'score': {'$meta': 'textScore'}}}
+        ]
+        if cursor is not None:
+            score, identifier = decode_cursor(cursor)
+            pipeline.append({'$match': {'$or': [
+                {'score': {'$lt': score}},
+                {'score': score, '_id': {'$lt': identifier}}
+            ]}})
+
+        pipeline.append({'$sort': {'score': {'$meta': 'textScore'}, '_id': -1}})
+        if cursor is None:
+            pipeline.append({'$skip': page * limit})
+
+        pipeline.append({'$limit': limit})
+        if fields is not None:
+            projection = {self.document._fields[field].db_field: 1 for field in fields}
+            pipeline.append({'$project': {**projection, 'score': 1}})
+
+        return pipeline
+
+    def next_search_cursor(self, documents: Sequence[RawDocument], limit: int) -> Optional[str]:
+        """
+        Same as next_cursor except for pages selected by search_paginated_raw
+
+        :return: The cursor for the next page. None if the given page was the last page
+        """
+        if len(documents) < limit:
+            return None
+
+        last_document = documents[-1].to_son()
+        return encode_cursor([last_document['score'], last_document['_id']])
+
+    def _search_query(self, q: str, filters: Dict[str, Any]) -> Dict[str, Any]:
+        return {'$text': {'$search': q}, **transform.query(self.document, **filters)}
+
+    def count_cached(self, **kwargs) -> int:
+        """
+        Same as count except counts are served from the container cache when possible.
+        Counts are cached per filter combination for CONTACT_MESSAGE_COUNT_TTL_SECONDS, so they may briefly lag
+        behind messages created or updated since.
+
+        :return: The number of matching contact messages
+        """
+        key = tuple(sorted(kwargs.items()))
+        count = self.count_cache.get(key)
+        if count is None:
+            count = self.count(**kwargs)
+            self.count_cache.set(key, count)
+
+        return count
+
+    def statistics(self, since: datetime) -> ContactMessageStatistics:
+        """
+        Summarizes every contact message, including those moved to the archive, with two aggregations per
+        collection. Counts by reason are grouped over the whole collection. Creations per day are grouped in a
+        separate aggregation whose leading match on the given window is served by the time_created index.
+        Messages are counted as read from their readers, so messages created before reader counts existed are
+        counted correctly whether or not they have been backfilled.
+
+        :param since: The earliest creation time counted per day
+        :return: The contact message statistics
+        """
+        def count_if(condition: Any) -> Dict[str, Any]:
+            return {'$sum': {'$cond': [condition, 1, 0]}}
+
+        by_reason_pipeline = [{
+            '$group': {
+                '_id': '$reason',
+                'total': {'$sum': 1},
+                'archived': count_if('$archived'),
+                'responded': count_if('$responded'),
+                'readByAny': count_if({'$gt': [{'$size': {'$ifNull': ['$readers', []]}}, 0]})
+            }
+        }]
+        created_per_day_pipeline = [
+            {'$match': {'timeCreated': {'$gte': since}}},
+            {'$group': {
+                '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timeCreated'}},
+                'count': {'$sum': 1}
+            }}
+        ]
+
+        by_reason = {}
+        created_per_day = {}
+        for collection in (self.collection, self.archive.collection):
+            for group in collection.aggregate(by_reason_pipeline):
+                by_reason[group['_id']] = by_reason.get(group['_id'], MessageCounts()) + MessageCounts(
+                    total=group['total'],
+                    archived=group['archived'],
+                    responded=group['responded'],
+                    read_by_any=group['readByAny']
+                )
+
+            for group in collection.aggregate(created_per_day_pipeline):
+                created_per_day[group['_id']] = created_per_day.get(group['_id'], 0) + group['count']
+
+        return ContactMessageStatistics(by_reason, dict(sorted(created_per_day.items())))
+
+    def statistics_cached(self, since: datetime) -> ContactMessageStatistics:
+        """
+        Same as statistics except statistics are served from the container cache when possible.
+        Statistics are cached per window for CONTACT_MESSAGE_STATISTICS_TTL_SECONDS.
+
+        :param since: The earliest creation time counted per day
+        :return: The contact message statistics
+        """
+        statistics = self.statistics_cache.get(since)
+        if statistics is None:
+            statistics = self.statistics(since)
+            self.statistics_cache.set(since, statistics)
+
+        return statistics
+
+    def mark_read(self,
+                  identifiers: Sequence[str],
+                  user_id: str,
+                  flagged: Optional[bool] = None) -> BulkUpdateResult:
+        """
+        Marks contact messages read by a user and optionally flags or unflags them for that user.
+        Readers are added and flags changed with guarded update_many calls, so each step is atomic per message,
+        repeated requests modify nothing and reader and flagged counts are always kept in step with the readers.
+        Contact messages moved to the archive are restored before they are marked.
+
+        :param identifiers: The identifiers of the contact messages to mark
+        :param user_id: The user reading the contact messages
+        :param flagged: Whether the user flags the contact messages. Existing flags are kept when not given
+        :return: The number of matched and modified contact messages
+        """
+        now = datetime.utcnow()
+        selected = {'_id': {'$in': [ObjectId(identifier) for identifier in identifiers]}}
+        self._restore(selected)
+
+        added = self.collection.update_many(
+            {**selected, 'readers.userId': {'$ne': user_id}},
+            {
+                '$push': {'readers': {'userId': user_id, 'flagged': bool(flagged), 'timeUpdated': now}},
+                '$inc': {'readerCount': 1, 'flaggedCount': 1 if flagged else 0},
+                '$set': {'timeUpdated': now}
+            }
+        )
+        modified_count = added.modified_count
+
+        if flagged is not None:
+            changed = self.collection.update_many(
+                {**selected, 'readers': {'$elemMatch': {'userId': user_id, 'flagged': not flagged}}},
+                {
+                    '$set': {'readers.$.flagged': flagged, 'readers.$.timeUpdated': now, 'timeUpdated': now},
+                    '$inc': {'flaggedCount': 1 if flagged else -1}
+                }
+            )
+            modified_count += changed.modified_count
+
+        for identifier in identifiers:
+            self.invalidate(identifier)
+
+        return BulkUpdateResult(matched_count=self.collection.count_documents(selected), modified_count=modified_count)
+
+    def update_many(self,
+                    changes: Dict[str, Any],
+                    identifiers: Optional[Sequence[str]] = None,
+                    filters: Optional[Dict[str, Any]] = None) -> BulkUpdateResult:
+        """
+        Applies changes to every selected contact message with a single server side update_many.
+        Messages already holding every given value are left untouched, so repeated requests modify nothing
+        and the update time only moves when a message actually changes.
+
+        :param changes: The new field values keyed by contact message field name
+        :param identifiers: The identifiers of the contact messages to update. Takes precedence over filters.
+                            Contact messages moved to the archive are restored before they are updated
+        :param filters: The filters, optionally including a search, selecting the contact messages to update.
+                        Only contact messages that have not been moved to the archive are selected
+        :return: The number of matched and modified contact messages
+        """
+        if identifiers is not None:
+            selected = {'_id': {'$in': [ObjectId(identifier) for identifier in identifiers]}}
+            self._restore(selected)
+        else:
+            filters = dict(filters or {})
+            q = filters.pop('q', None)
+            selected = transform.query(self.document, **filters) if q is None else self._search_query(q, filters)
 
-        # Hate this. Make create an object and map this identity dictionary to it?
-        creation_form_dict['sender']['ip'] = identity.get('sourceIp', 'unknown')
-        creation_form_dict['sender']['user_agent'] = identity.get('userAgent', 'unknown')
+        matched_count = self.collection.count_documents(selected)
+        values = {self.document._fields[name].db_field: value for name, value in changes.items()}
+        result = self.collection.update_many(
+            {**selected, '$nor': [values]},
+            {'$set': {**values, 'timeUpdated': datetime.utcnow()}}
+        )
+
+        if identifiers is not None:
+            for identifier in identifiers:
+                self.invalidate(identifier)
+        else:
+            # Updated messages are unknown when selected by filter
+            self.cache.clear()
+            self.invalidate(None)
+
+        return BulkUpdateResult(matched_count=matched_count, modified_count=result.modified_count)
+
+    def backfill_reader_counts(self, batch_size: int = 500) -> int:
+        """
+        Recomputes the reader and flagged counts of every contact message from its readers. Messages created before
+        the counts were maintained have none, and messages marked read before being backfilled only count the readers
+        added since, so counts are recomputed whether or not they are set. Only messages whose counts differ are
+        updated, and running the backfill again corrects messages marked while they were being backfilled.
+
+        :param batch_size: The number of contact messages read and updated per round trip
+        :return: The number of updated contact messages
+        """
+        updated_count = 0
+        updates = []
+        for son in self.collection.find({}, {'readers': 1}).batch_size(batch_size):
+            readers = son.get('readers') or []
+            counts = {
+                'readerCount': len(readers),
+                'flaggedCount': sum(1 for reader in readers if reader.get('flagged'))
+            }
+            differs = [{field: {'$ne': count}} for field, count in counts.items()]
+            updates.append(UpdateOne({'_id': son['_id'], '$or': differs}, {'$set': counts}))
+            if len(updates) == batch_size:
+                updated_count += self.collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
 
-        # Should create custom mongo engine field for enums in the future that do this conversion
-        # is completed more naturally
-        creation_form_dict['reason'] = creation_form_dict['reason'].value
+        if len(updates) > 0:
+            updated_count += self.collection.bulk_write(updates, ordered=False).modified_count
 
-        return super().create(creation_form_dict)
+        return updated_count
 
-    def create_with_sns_event(self, event: SNSEvent) -> ContactMessage:
+    def move_archived(self, archived_before: datetime, batch_size: int = 500, max_batches: int = 100) -> int:
         """
-        :param event:
-        :return:
+        Moves contact messages that were archived and left unchanged since before the given time into the archive
+        collection, keeping the contact message collection limited to messages that are still being worked on.
+        Each batch is copied with one bulk upsert and then removed with one delete, so a move interrupted part way
+        is finished by the next move. Messages updated while being moved stay in the contact message collection.
+
+        :param archived_before: Messages last updated before this time are moved
+        :param batch_size: The number of messages moved per round trip
+        :param max_batches: The most batches moved by this call
+        :return: The number of moved contact messages
+        """
+        selected = {'archived': True, 'timeUpdated': {'$lt': archived_before}}
+        moved_count = 0
+        for _ in range(max_batches):
+            sons = list(self.collection.find(selected).limit(batch_size))
+            if len(sons) == 0:
+                break
+
+            self.archive.collection.bulk_write([ReplaceOne({'_id': son['_id']}, son, upsert=True) for son in sons],
+                                               ordered=False)
+            identifiers = [son['_id'] for son in sons]
+            self.collection.delete_many({'_id': {'$in': identifiers}, **selected})
+
+            # Copies of messages updated since they were read are stale, the originals stay where they are
+            updated = [son['_id'] for son in self.collection.find({'_id': {'$in': identifiers}}, {'_id': 1})]
+            if len(updated) > 0:
+                self.archive.collection.delete_many({'_id': {'$in': updated}})
+
+            moved_count += len(identifiers) - len(updated)
+
+        if moved_count > 0:
+            self.invalidate(None)
+
+        return moved_count
+
+    def _restore(self, selected: Dict[str, Any]):
         """
-        creation_form_dict = jsonpickle.decode(event.message)
-        return super().create(creation_form_dict)
+        Moves the selected contact messages back from the archive so they can be updated
+
+        :param selected: Query selecting the contact messages to restore
+        """
+        sons = list(self.archive.collection.find(selected))
+        if len(sons) == 0:
+            return
+
+        self.collection.bulk_write([ReplaceOne({'_id': son['_id']}, son, upsert=True) for son in sons], ordered=False)
+        self.archive.collection.delete_many({'_id': {'$in': [son['_id'] for son in sons]}})
+
+    def invalidate(self, identifier: Union[None, str, ObjectId]):
+        """
+        Removes a contact message from the container cache. Must be called whenever a contact message is updated.
+        Cached counts and statistics are cleared as well since the update may move the message between filters.
+
+        :param identifier: The identifier of the updated contact message. Only counts and statistics are cleared
+                           when not given
+        """
+        if identifier is not None:
+            self.cache.pop(str(identifier))
+
+        self.count_cache.clear()
+        self.statistics_cache.clear()
+
+    def create_with_identity(self,
+                             creation_form: ContactMessageCreationForm,
+                             identity: Dict[str, Any]) -> ContactMessage:
+        return super().create(creation_form.contact_message_dict(identity))
+
+    def create_with_sqs_event(self, event: SQSEvent) -> BulkCreateResult:
+        """
+        Creates contact messages from a batch of queued contact message created messages with a single bulk insert.
+        Messages may either be raw published messages or SNS notifications delivered to the queue.
+        Messages that cannot be decoded or are invalid are rejected, since redelivering them could never succeed.
+        Only messages whose write failed are reported as failures to be retried.
+
+        :param event: The sqs event holding the batch of messages
+        :return: The created count and the reason each failed or rejected message was not created,
+                 keyed by SQS message id
+        """
+        rejections = {}
+        creation_forms = {}
+        for record in event:
+            message_id = record.to_dict()['messageId']
+            try:
+                creation_forms[message_id] = _decode_queued_message(record.body)
+            except ValueError as ex:
+                rejections[message_id] = str(ex)
+
+        message_ids = list(creation_forms)
+        result = super().create_many([creation_forms[message_id] for message_id in message_ids])
+        rejections.update({message_ids[position]: reason for position, reason in result.rejections.items()})
+        return BulkCreateResult(
+            created_count=result.created_count,
+            failures={message_ids[position]: reason for position, reason in result.failures.items()},
+            rejections=rejections
+        )
 
     def publish_form_with_identity(self,
                                    creation_form: ContactMessageCreationForm,
                                    identity: Dict[str, Any]) -> ContactMessageFormPublished:
-        creation_form_dict = creation_form.dict()
+        # Senders are limited by both address and email so neither rotating emails nor addresses gets around the limit
+        self.rate_limiter.acquire(f'ip:{identity.get("sourceIp", "unknown")}',
+                                  f'email:{creation_form.sender.email.lower()}')
 
         # We generate our contact message id now so that we can give this back for tracking purposes.
         # The message will not be inserted into the database until some time later
         identifier = ObjectId()
+
+        # Duplicates are answered with the original message so resubmissions look accepted,
+        # but they are never published, inserted or emailed
+        fingerprint = creation_form.fingerprint()
+        original_id = self.duplicates.claim(fingerprint, identifier)
+        if original_id is not None:
+            return ContactMessageFormPublished(contact_message_id=original_id, sns_message_id=None)
+
+        creation_form_dict = creation_form.contact_message_dict(identity)
         creation_form_dict['id'] = str(identifier)
-        creation_form_dict['sender']['ip'] = identity.get('sourceIp', 'unknown')
-        creation_form_dict['sender']['user_agent'] = identity.get('userAgent', 'unknown')
-        creation_form_dict['reason'] = creation_form_dict['reason'].value
+
+        try:
+            return self._publish(identifier, creation_form_dict)
+        except Exception:
+            self.duplicates.release(fingerprint)
+            raise
+
+    def _publish(self, identifier: ObjectId, creation_form_dict: Dict[str, Any]) -> ContactMessageFormPublished:
+        # In outbox mode the message is only saved to the outbox and published later by the outbox relay,
+        # so the request neither waits on nor fails with SNS.
+        if self.outbox_enabled:
+            self._connect()
+            OutboxMessage(
+                id=identifier,
+                topic_arn=CONTACT_MESSAGE_CREATED_TOPIC_ARN,
+                message=json.dumps(creation_form_dict)
+            ).save(force_insert=True)
+            return ContactMessageFormPublished(contact_message_id=identifier, sns_message_id=None)
 
         form = PublishMessageForm(
             message=creation_form_dict,
-            topic_arn='arn:aws:sns:us-east-2:811393626934:contact-message-created',
+            topic_arn=CONTACT_MESSAGE_CREATED_TOPIC_ARN,
         )
         response = self.sns.publish(form)
 
@@ -123,3 +967,18 @@ class ContactMessageService(ResourceService):
             contact_message_id=identifier,
             sns_message_id=response['MessageId']
         )
+
+
+def _decode_queued_message(body: str) -> Dict[str, Any]:
+    """
+    Decodes the creation form of a queued message. SNS notifications are unwrapped when the
+    topic subscription does not use raw message delivery.
+
+    :param body: The SQS message body
+    :return: The decoded creation form
+    """
+    data = json.loads(body)
+    if isinstance(data, dict) and data.get('Type') == 'Notification':
+        return decode_contact_message(data['Message'])
+
+    return contact_message_fields(data)
@@ -1,5 +1,6 @@
 pytest_plugins = [
     'tests.fixtures.contact_message',
     'tests.fixtures.response',
+    'tests.fixtures.sns',
     'tests.fixtures.util'
 ]
@@ -1,5 +1,5 @@
-from datetime import datetime
-from typing import Dict, Any
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
 
 import pytest
 
@@ -54,12 +54,36 @@ def contact_message(sender: Sender, reader: Reader) -> ContactMessage:
     contact_message.message = 'test message'
     contact_message.sender = sender
     contact_message.readers = [reader]
+    contact_message.reader_count = 1
+    contact_message.flagged_count = 1
     contact_message.time_updated = datetime.utcfromtimestamp(1000000000)
     contact_message.time_created = datetime.utcfromtimestamp(1000000000)
 
     return contact_message
 
 
+@pytest.fixture
+def saved_contact_messages(database, sender: Sender) -> List[ContactMessage]:
+    """
+    Contact messages saved to the test database. Returned newest first, matching the default service ordering.
+    Two messages share a creation time so ties must be broken by id.
+    """
+    base_time = datetime.utcfromtimestamp(1000000000)
+    offsets = [0, 1, 2, 2, 3, 4, 5]
+    contact_messages = [
+        ContactMessage(
+            message=f'test message {index}',
+            reason='business' if index % 2 == 0 else 'question',
+            archived=index % 3 == 0,
+            sender=sender,
+            time_created=base_time + timedelta(minutes=offset)
+        ).save()
+        for index, offset in enumerate(offsets)
+    ]
+
+    return sorted(contact_messages, key=lambda message: (message.time_created, message.id), reverse=True)
+
+
 @pytest.fixture
 def contact_message_json() -> Dict[str, Any]:
     return {
@@ -74,6 +98,8 @@ def contact_message_json() -> Dict[str, Any]:
                 'timeUpdated': '2001-09-09T01:46:40'
             }
         ],
+        'readerCount': 1,
+        'flaggedCount': 1,
         'sender': {
             'alias': 'test name',
             'ip': "123.456.8.5",
@@ -115,3 +141,24 @@ def message_form_published_json() -> Dict[str, Any]:
         'contactMessageId': '123',
         'snsMessageId': '123'
     }
+
+
+@pytest.fixture
+def queued_contact_message_json(message_creation_form_json) -> Dict[str, Any]:
+    message_creation_form_json['id'] = '5eeaa9f461cf5af67b7feaae'
+    message_creation_form_json['sender']['ip'] = '123.456.8.5'
+    message_creation_form_json['sender']['user_agent'] = 'chrome'
+    return message_creation_form_json
+
+
+@pytest.fixture
+def sqs_event():
+    def event(*message_bodies: str) -> Dict[str, Any]:
+        return {
+            'Records': [
+                {'messageId': f'message-{index}', 'receiptHandle': f'receipt-{index}', 'body': body}
+                for index, body in enumerate(message_bodies)
+            ]
+        }
+
+    return event
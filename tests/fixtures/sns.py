@@ -0,0 +1,50 @@
+from typing import Any, Dict, List
+
+import pytest
+from pyocle.service.sns import SimpleNotificationService
+
+
+class LocalSnsClient:
+    """
+    Stand in for the boto3 SNS client that records published messages instead of sending them.
+    Messages whose body is listed in failing_messages are reported as failed, and every call raises while
+    unavailable is set.
+    """
+
+    def __init__(self):
+        self.published: List[Dict[str, Any]] = []
+        self.failing_messages = set()
+        self.unavailable = False
+
+    def publish(self, **kwargs) -> Dict[str, Any]:
+        self._check_available()
+        self.published.append({'TopicArn': kwargs['TopicArn'], 'Message': kwargs['Message']})
+        return {'MessageId': f'sns-{len(self.published)}'}
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: List[Dict[str, str]]) -> Dict[str, Any]:
+        self._check_available()
+        successful = []
+        failed = []
+        for entry in PublishBatchRequestEntries:
+            if entry['Message'] in self.failing_messages:
+                failed.append({'Id': entry['Id'], 'Code': 'InternalError', 'SenderFault': False})
+                continue
+
+            self.published.append({'TopicArn': TopicArn, 'Message': entry['Message']})
+            successful.append({'Id': entry['Id'], 'MessageId': f'sns-{len(self.published)}'})
+
+        return {'Successful': successful, 'Failed': failed}
+
+    def _check_available(self):
+        if self.unavailable:
+            raise ConnectionError('sns is unavailable')
+
+
+@pytest.fixture
+def local_sns_client() -> LocalSnsClient:
+    return LocalSnsClient()
+
+
+@pytest.fixture
+def local_sns(local_sns_client) -> SimpleNotificationService:
+    return SimpleNotificationService(client=local_sns_client)
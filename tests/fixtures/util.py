@@ -1,4 +1,5 @@
 import pytest
+from mongoengine import connect, disconnect
 
 
 @pytest.fixture
@@ -7,3 +8,14 @@ def get_fixture(request):
         return request.getfixturevalue(name)
 
     return _get_fixture_by_name
+
+
+@pytest.fixture
+def database():
+    """
+    Replaces the application connection with an in memory mongo database for the duration of a test
+    """
+    disconnect()
+    connect('contact-message-service-test', host='mongomock://localhost')
+    yield
+    disconnect()
@@ -1,10 +1,23 @@
+import base64
+import gzip
+import json
+from typing import Dict
+
 import pytest
 from chalice.test import Client
 from pyocle.form import FormValidationError
 from pyocle.service.core import ResourceNotFoundError
 
 import app
-from chalicelib.service import ContactMessageService
+import chalicelib.metrics
+import chalicelib.response
+from chalicelib.compression import Compressor
+from chalicelib.cursor import decode_cursor
+from chalicelib.metrics import MetricLogger
+from chalicelib.model import ContactMessageStatistics, MessageCounts
+from chalicelib.outbox import RelayResult
+from chalicelib.ratelimit import RateLimitExceededError
+from chalicelib.service import ContactMessageService, BulkUpdateResult, BulkCreateResult, BulkCreateFailedError
 
 
 @pytest.fixture
@@ -25,6 +38,16 @@ def test_create_contact_message_responds_correctly(mocker, client,
     assert actual_response.json_body == ok_json(message_form_published_json)
 
 
+def test_create_contact_message_handles_rate_limited_sender(mocker, client):
+    mocker.patch('pyocle.form.resolve_form', return_value={})
+    mocker.patch.object(ContactMessageService, 'publish_form_with_identity', side_effect=RateLimitExceededError(42))
+    actual_response = client.http.request('POST', '/')
+
+    assert actual_response.status_code == 429
+    assert actual_response.headers['Retry-After'] == '42'
+    assert actual_response.json_body['success'] is False
+
+
 def test_create_contact_message_handles_bad_request(mocker, client, bad_request_json):
     mocker.patch('pyocle.form.resolve_form', side_effect=FormValidationError())
     actual_response = client.http.request('POST', '/')
@@ -43,7 +66,7 @@ def test_create_contact_message_handles_internal_server_error(mocker, client, se
 
 
 def test_get_message_responds_correctly(mocker, client, contact_message, contact_message_json, ok_json):
-    mocker.patch.object(ContactMessageService, 'find_one', return_value=contact_message)
+    mocker.patch.object(ContactMessageService, 'find_one_cached', return_value=contact_message)
     actual_response = client.http.request('GET', '/123')
 
     assert actual_response.status_code == 200
@@ -51,7 +74,7 @@ def test_get_message_responds_correctly(mocker, client, contact_message, contact
 
 
 def test_get_message_correctly_handles_not_found(mocker, client, not_found_json):
-    mocker.patch.object(ContactMessageService, 'find_one', side_effect=ResourceNotFoundError('123'))
+    mocker.patch.object(ContactMessageService, 'find_one_cached', side_effect=ResourceNotFoundError('123'))
     actual_response = client.http.request('GET', '/123')
 
     assert actual_response.status_code == 404
@@ -59,8 +82,249 @@ def test_get_message_correctly_handles_not_found(mocker, client, not_found_json)
 
 
 def test_get_message_correctly_handles_internal_server_error(mocker, client, server_error_json):
-    mocker.patch.object(ContactMessageService, 'find_one', side_effect=Exception())
+    mocker.patch.object(ContactMessageService, 'find_one_cached', side_effect=Exception())
     actual_response = client.http.request('GET', '/123')
 
     assert actual_response.status_code == 500
     assert actual_response.json_body == server_error_json
+
+
+def test_get_messages_responds_with_next_cursor(mocker, client, contact_message, contact_message_json):
+    mocker.patch.object(ContactMessageService, 'find_paginated_raw', return_value=[contact_message])
+    actual_response = client.http.request('GET', '/?limit=1')
+
+    assert actual_response.status_code == 200
+    assert actual_response.json_body['data'] == {'count': 1, 'contactMessages': [contact_message_json]}
+
+    pagination_details = actual_response.json_body['meta']['paginationDetails']
+    assert pagination_details['page'] == 0
+    assert pagination_details['limit'] == 1
+    assert decode_cursor(pagination_details['nextCursor']) == [contact_message.time_created, contact_message.id]
+
+
+def test_get_messages_omits_next_cursor_on_last_page(mocker, client, contact_message):
+    mocker.patch.object(ContactMessageService, 'find_paginated_raw', return_value=[contact_message])
+    actual_response = client.http.request('GET', '/?limit=2')
+
+    assert actual_response.status_code == 200
+    assert actual_response.json_body['meta']['paginationDetails'] == {'page': 0, 'limit': 2, 'nextCursor': None}
+
+
+def test_get_messages_includes_requested_total_count(mocker, client, contact_message):
+    mocker.patch.object(ContactMessageService, 'find_paginated_raw', return_value=[contact_message])
+    count_cached = mocker.patch.object(ContactMessageService, 'count_cached', return_value=5)
+    actual_response = client.http.request('GET', '/?limit=2&archived=true&total=true')
+
+    assert actual_response.json_body['meta']['paginationDetails'] == \
+        {'page': 0, 'limit': 2, 'nextCursor': None, 'totalCount': 5, 'totalPages': 3}
+    count_cached.assert_called_once_with(archived=True)
+
+
+def test_get_statistics_responds_correctly(mocker, client, ok_json):
+    statistics = ContactMessageStatistics({'business': MessageCounts(total=2, archived=1)}, {'2001-09-09': 2})
+    mocker.patch.object(ContactMessageService, 'statistics_cached', return_value=statistics)
+    actual_response = client.http.request('GET', '/stats?days=7')
+
+    assert actual_response.status_code == 200
+    assert actual_response.json_body == ok_json({
+        'counts': {'total': 2, 'archived': 1, 'responded': 0, 'readByAny': 0},
+        'byReason': {'business': {'total': 2, 'archived': 1, 'responded': 0, 'readByAny': 0}},
+        'createdPerDay': {'2001-09-09': 2}
+    })
+
+
+def test_get_statistics_handles_bad_request(client):
+    actual_response = client.http.request('GET', '/stats?days=0')
+
+    assert actual_response.status_code == 400
+
+
+def test_export_messages_continues_from_next_cursor(monkeypatch, client, saved_contact_messages):
+    monkeypatch.setenv('EXPORT_MAX_BYTES', '1500')
+    exported_ids = []
+    path = '/export?batchSize=2'
+    while True:
+        actual_response = client.http.request('GET', path)
+        assert actual_response.status_code == 200
+        assert actual_response.headers['Content-Type'] == 'application/x-ndjson'
+
+        exported_ids += [json.loads(line)['id'] for line in actual_response.body.decode().splitlines()]
+        if 'X-Next-Cursor' not in actual_response.headers:
+            break
+
+        path = f'/export?batchSize=2&cursor={actual_response.headers["X-Next-Cursor"]}'
+
+    assert exported_ids == [str(message.id) for message in saved_contact_messages]
+
+
+def test_export_messages_larger_than_max_bytes_continue_one_at_a_time(monkeypatch, client, saved_contact_messages):
+    monkeypatch.setenv('EXPORT_MAX_BYTES', '1')
+    actual_response = client.http.request('GET', '/export')
+
+    assert actual_response.status_code == 200
+    assert [json.loads(line)['id'] for line in actual_response.body.decode().splitlines()] == \
+        [str(saved_contact_messages[0].id)]
+    assert 'X-Next-Cursor' in actual_response.headers
+
+
+def test_get_messages_searches_when_q_is_given(mocker, client, contact_message):
+    search = mocker.patch.object(ContactMessageService, 'search_paginated_raw', return_value=[contact_message])
+    mocker.patch.object(ContactMessageService, 'next_search_cursor', return_value='cursor')
+    actual_response = client.http.request('GET', '/?q=hello&reason=business&limit=1')
+
+    assert actual_response.status_code == 200
+    assert actual_response.json_body['meta']['paginationDetails']['nextCursor'] == 'cursor'
+    search.assert_called_once_with(q='hello', reason='business', page=0, limit=1)
+
+
+def authorization(sub: str) -> Dict[str, str]:
+    """
+    Local mode decodes the claims of the authorization token without verifying its signature
+    """
+    claims = base64.urlsafe_b64encode(json.dumps({'sub': sub, 'cognito:username': sub}).encode()).decode()
+    return {'Authorization': f'header.{claims.rstrip("=")}.signature', 'Content-Type': 'application/json'}
+
+
+def test_mark_read_marks_messages_for_requesting_user(mocker, client):
+    mark_read = mocker.patch.object(ContactMessageService, 'mark_read', return_value=BulkUpdateResult(1, 1))
+    identifier = '5eeaa9f461cf5af67b7feaae'
+    actual_response = client.http.request('POST', '/read', headers=authorization('user-1'),
+                                          body=json.dumps({'ids': [identifier]}))
+
+    assert actual_response.status_code == 200
+    assert actual_response.json_body['data'] == {'matchedCount': 1, 'modifiedCount': 1}
+    mark_read.assert_called_once_with([identifier], 'user-1')
+
+
+def test_flag_flags_messages_for_requesting_user(mocker, client):
+    mark_read = mocker.patch.object(ContactMessageService, 'mark_read', return_value=BulkUpdateResult(1, 0))
+    identifier = '5eeaa9f461cf5af67b7feaae'
+    actual_response = client.http.request('POST', '/flag', headers=authorization('user-1'),
+                                          body=json.dumps({'ids': [identifier], 'flagged': False}))
+
+    assert actual_response.status_code == 200
+    mark_read.assert_called_once_with([identifier], 'user-1', flagged=False)
+
+
+@pytest.mark.parametrize('body', [{}, {'ids': []}, {'ids': ['invalid']}, {'ids': ['5eeaa9f461cf5af67b7feaae'], 'x': 1}])
+def test_mark_read_handles_bad_request(client, body):
+    actual_response = client.http.request('POST', '/read', headers=authorization('user-1'), body=json.dumps(body))
+
+    assert actual_response.status_code == 400
+
+
+def test_update_messages_by_filter(mocker, client):
+    update_many = mocker.patch.object(ContactMessageService, 'update_many', return_value=BulkUpdateResult(3, 2))
+    actual_response = client.http.request('PATCH', '/', headers=authorization('user-1'), body=json.dumps({
+        'filter': {'reason': 'business', 'responded': True}, 'archived': True
+    }))
+
+    assert actual_response.status_code == 200
+    assert actual_response.json_body['data'] == {'matchedCount': 3, 'modifiedCount': 2}
+    update_many.assert_called_once_with({'archived': True}, identifiers=None,
+                                        filters={'reason': 'business', 'responded': True})
+
+
+@pytest.mark.parametrize('body', [
+    {'archived': True},
+    {'ids': ['5eeaa9f461cf5af67b7feaae']},
+    {'ids': ['5eeaa9f461cf5af67b7feaae'], 'filter': {}, 'archived': True},
+    {'ids': ['invalid'], 'archived': True},
+    {'filter': {'unknown': 1}, 'responded': True},
+    {'filter': {}, 'archived': True},
+    {'filter': {'reason': None}, 'archived': True}
+])
+def test_update_messages_handles_bad_request(client, body):
+    actual_response = client.http.request('PATCH', '/', headers=authorization('user-1'), body=json.dumps(body))
+
+    assert actual_response.status_code == 400
+
+
+def test_get_messages_logs_stage_metrics(mocker, client, contact_message):
+    lines = []
+    mocker.patch.object(chalicelib.metrics, 'metric_logger', MetricLogger(enabled=True, write=lines.append))
+    mocker.patch.object(ContactMessageService, 'find_paginated_raw', return_value=[contact_message])
+    client.http.request('GET', '/')
+
+    record = json.loads(lines[0])
+    assert record['Route'] == 'get_multiple_contact_message'
+    assert {'validate', 'query', 'serialize', 'total'} <= record.keys()
+
+
+def test_get_messages_handles_invalid_cursor(client):
+    actual_response = client.http.request('GET', '/?cursor=invalid')
+
+    assert actual_response.status_code == 400
+
+
+def test_get_message_selects_requested_fields(mocker, client, contact_message):
+    find_one_cached = mocker.patch.object(ContactMessageService, 'find_one_cached', return_value=contact_message)
+    actual_response = client.http.request('GET', '/123?fields=message,timeCreated')
+
+    assert actual_response.status_code == 200
+    assert set(actual_response.json_body['data']) == {'id', 'message', 'timeCreated'}
+    find_one_cached.assert_called_once_with('123')
+
+
+def test_get_message_responds_with_etag(mocker, client, contact_message):
+    mocker.patch.object(ContactMessageService, 'find_one_cached', return_value=contact_message)
+    actual_response = client.http.request('GET', '/123')
+
+    assert actual_response.headers['ETag'] == \
+        chalicelib.response.entity_tag(contact_message.id, contact_message.time_updated, None)
+    assert actual_response.headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_get_message_responds_not_modified_when_etag_matches(mocker, client, contact_message):
+    mocker.patch.object(ContactMessageService, 'find_one_cached', return_value=contact_message)
+    etag = client.http.request('GET', '/123').headers['ETag']
+    actual_response = client.http.request('GET', '/123', headers={'If-None-Match': etag})
+
+    assert actual_response.status_code == 304
+    assert actual_response.body == b''
+    assert actual_response.headers['ETag'] == etag
+
+
+def test_get_message_etag_depends_on_selected_fields(mocker, client, contact_message):
+    mocker.patch.object(ContactMessageService, 'find_one_cached', return_value=contact_message)
+    etag = client.http.request('GET', '/123').headers['ETag']
+    actual_response = client.http.request('GET', '/123?fields=reason', headers={'If-None-Match': etag})
+
+    assert actual_response.status_code == 200
+    assert actual_response.headers['ETag'] != etag
+
+
+def test_insert_batch_only_reports_failed_writes(mocker, client, sqs_event):
+    result = BulkCreateResult(created_count=1, failures={'message-1': 'shutdown'}, rejections={'message-0': 'invalid'})
+    mocker.patch.object(ContactMessageService, 'create_with_sqs_event', return_value=result)
+    response = client.lambda_.invoke('insert_batch_into_database_on_received', sqs_event('{}', '{}', '{}'))
+
+    assert response.payload == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+
+
+def test_insert_batch_fails_whole_batch_when_every_write_fails(mocker, client, sqs_event):
+    result = BulkCreateResult(created_count=0, failures={'message-0': 'shutdown', 'message-1': 'shutdown'})
+    mocker.patch.object(ContactMessageService, 'create_with_sqs_event', return_value=result)
+
+    with pytest.raises(BulkCreateFailedError):
+        client.lambda_.invoke('insert_batch_into_database_on_received', sqs_event('{}', '{}'))
+
+
+def test_get_messages_compresses_accepted_encoding(mocker, client, contact_message, contact_message_json):
+    mocker.patch.object(app, 'compressor', Compressor(enabled=True, min_size=0))
+    mocker.patch.object(ContactMessageService, 'find_paginated_raw', return_value=[contact_message])
+    actual_response = client.http.request('GET', '/', headers={'Accept-Encoding': 'gzip'})
+
+    assert actual_response.status_code == 200
+    assert actual_response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(actual_response.body))['data'] == \
+        {'count': 1, 'contactMessages': [contact_message_json]}
+
+
+@pytest.mark.parametrize('outbox_enabled', [True, False])
+def test_relay_outbox_only_relays_in_outbox_mode(mocker, client, outbox_enabled):
+    mocker.patch.object(app.cms, 'outbox_enabled', outbox_enabled)
+    relay = mocker.patch.object(app.outbox_relay, 'relay', return_value=RelayResult(published_count=0, failures={}))
+    client.lambda_.invoke('relay_outbox', client.events.generate_cw_event('aws.events', 'Scheduled Event', {}, []))
+
+    assert relay.called == outbox_enabled
@@ -0,0 +1,52 @@
+from chalicelib.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_returns_default_when_missing():
+    cache = LRUCache(max_size=1)
+
+    assert cache.get('missing') is None
+    assert cache.get('missing', 'default') == 'default'
+
+
+def test_set_evicts_least_recently_used_entry():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_get_expires_entries_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(max_size=1, ttl_seconds=10, clock=clock)
+    cache.set('a', 1)
+    clock.now = 9.9
+
+    assert cache.get('a') == 1
+
+    clock.now = 10
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_pop_removes_entry():
+    cache = LRUCache(max_size=1)
+    cache.set('a', 1)
+    cache.pop('a')
+    cache.pop('missing')
+
+    assert cache.get('a') is None
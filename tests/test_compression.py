@@ -0,0 +1,86 @@
+import base64
+import gzip
+
+import pytest
+from chalice import Response
+
+import chalicelib.compression
+from chalicelib.compression import CompressedResponse, Compressor
+
+BODY = '{"data": "' + 'contact message ' * 100 + '"}'
+
+
+@pytest.fixture
+def compressor(mocker):
+    mocker.patch.object(chalicelib.compression, 'brotli', None)
+    return Compressor(enabled=True, min_size=100, gzip_level=6)
+
+
+@pytest.mark.parametrize('accept_encoding,expected', [
+    (None, None),
+    ('', None),
+    ('gzip', 'gzip'),
+    ('deflate, gzip;q=0.5', 'gzip'),
+    ('gzip;q=0', None),
+    ('*', 'gzip'),
+    ('*;q=0.5, gzip;q=0', None),
+    ('identity', None),
+    ('GZIP ; q=1.0', 'gzip'),
+    ('gzip;q=invalid', None)
+])
+def test_negotiate_selects_accepted_coding(compressor, accept_encoding, expected):
+    assert compressor.negotiate(accept_encoding) == expected
+
+
+def test_negotiate_prefers_brotli_on_ties(mocker, compressor):
+    mocker.patch.object(chalicelib.compression, 'brotli', mocker.Mock())
+
+    assert compressor.negotiate('gzip, br') == 'br'
+    assert compressor.negotiate('gzip, br;q=0.5') == 'gzip'
+
+
+def test_compress_gzips_large_bodies(compressor):
+    response = compressor.compress(Response(body=BODY, headers={'ETag': '"tag"'}), 'gzip, deflate')
+
+    assert isinstance(response, CompressedResponse)
+    assert gzip.decompress(response.body).decode('utf-8') == BODY
+    assert response.headers == {'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding', 'ETag': 'W/"tag"'}
+
+    response_dict = response.to_dict()
+    assert response_dict['isBase64Encoded']
+    assert gzip.decompress(base64.b64decode(response_dict['body'])).decode('utf-8') == BODY
+
+
+def test_compress_skips_small_bodies(compressor):
+    response = Response(body='{}')
+
+    assert compressor.compress(response, 'gzip') is response
+    assert response.headers == {}
+
+
+def test_compress_varies_uncompressed_responses_on_accept_encoding(compressor):
+    response = compressor.compress(Response(body=BODY, headers={'Vary': 'Origin'}), None)
+
+    assert response.body == BODY
+    assert response.headers == {'Vary': 'Origin, Accept-Encoding'}
+
+
+def test_compress_does_nothing_when_disabled():
+    response = Response(body=BODY)
+
+    assert Compressor(enabled=False).compress(response, 'gzip') is response
+
+
+def test_compress_skips_encoded_responses(compressor):
+    response = Response(body=BODY, headers={'Content-Encoding': 'br'})
+
+    assert compressor.compress(response, 'gzip') is response
+
+
+def test_binary_types_include_every_media_type_when_enabled(compressor):
+    assert compressor.binary_types(['image/png']) == ['image/png', '*/*']
+    assert compressor.binary_types(['*/*']) == ['*/*']
+
+
+def test_binary_types_unchanged_when_disabled():
+    assert Compressor(enabled=False).binary_types(['image/png']) == ['image/png']
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from chalicelib.cursor import encode_cursor, decode_cursor, InvalidCursorError
+
+
+def test_cursor_round_trips_sort_key_values():
+    values = [datetime(2001, 9, 9, 1, 46, 40, 123000), ObjectId('5eeaa9f461cf5af67b7feaae')]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    'bm90IGpzb24=',
+    encode_cursor([])
+])
+def test_decode_cursor_rejects_invalid_cursors(cursor: str):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
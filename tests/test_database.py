@@ -0,0 +1,64 @@
+from mongoengine import disconnect
+from mongoengine.connection import get_db
+
+from chalicelib.database import ensure_connection, connection_settings, ConnectionPoolMetrics, HeartbeatMonitor
+
+
+def test_ensure_connection_registers_connection_once(mocker):
+    disconnect('lazy')
+    connection_string = mocker.patch('pyocle.config.connection_string', return_value='mongomock://localhost/lazy')
+
+    ensure_connection('lazy')
+    ensure_connection('lazy')
+
+    connection_string.assert_called_once()
+    assert get_db('lazy').name == 'lazy'
+    disconnect('lazy')
+
+
+def test_ensure_connection_leaves_registered_connection_untouched(mocker, database):
+    connection_string = mocker.patch('pyocle.config.connection_string')
+
+    ensure_connection()
+
+    connection_string.assert_not_called()
+    assert get_db().name == 'contact-message-service-test'
+
+
+def test_pool_metrics_count_checkouts_and_wait_times(mocker):
+    metrics = ConnectionPoolMetrics()
+    event = mocker.Mock()
+
+    metrics.connection_created(event)
+    metrics.connection_check_out_started(event)
+    metrics.connection_checked_out(event)
+    metrics.connection_check_out_started(event)
+    metrics.connection_check_out_failed(event)
+    snapshot = metrics.snapshot(reset=True)
+
+    assert snapshot['checkouts'] == 1
+    assert snapshot['checkoutFailures'] == 1
+    assert snapshot['connectionsCreated'] == 1
+    assert 0 <= snapshot['maxWaitMs'] <= snapshot['totalWaitMs']
+    assert metrics.snapshot()['checkouts'] == 0
+
+
+def test_heartbeat_monitor_reports_latest_heartbeat_of_each_server(mocker):
+    monitor = HeartbeatMonitor()
+    assert monitor.healthy() is None
+
+    monitor.failed(mocker.Mock(connection_id=('primary', 27017)))
+    assert monitor.healthy() is False
+
+    monitor.succeeded(mocker.Mock(connection_id=('secondary', 27017)))
+    assert monitor.healthy() is True
+
+
+def test_connection_settings_are_configurable_with_environment_variables(monkeypatch):
+    monkeypatch.setenv('MONGO_MAX_POOL_SIZE', '10')
+    monkeypatch.setenv('MONGO_SOCKET_TIMEOUT_MS', '1000')
+
+    settings = connection_settings()
+
+    assert settings['maxPoolSize'] == 10
+    assert settings['socketTimeoutMS'] == 1000
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import ServerSelectionTimeoutError
+
+from chalicelib.duplicate import DuplicateDetector
+from chalicelib.model import ContactMessageFingerprint
+
+
+@pytest.fixture
+def detector(database) -> DuplicateDetector:
+    return DuplicateDetector(enabled=True, window_seconds=60)
+
+
+def test_claim_returns_original_for_duplicates(detector):
+    original_id = ObjectId()
+
+    assert detector.claim('fingerprint', original_id) is None
+    assert detector.claim('fingerprint', ObjectId()) == str(original_id)
+    assert DuplicateDetector(enabled=True, window_seconds=60).claim('fingerprint', ObjectId()) == str(original_id)
+    assert detector.claim('other', ObjectId()) is None
+
+
+def test_claim_serves_known_duplicates_from_cache(mocker, detector):
+    original_id = ObjectId()
+    detector.claim('fingerprint', original_id)
+    detector.claim('fingerprint', ObjectId())
+    collection = mocker.patch.object(DuplicateDetector, 'collection', new_callable=mocker.PropertyMock)
+
+    assert detector.claim('fingerprint', ObjectId()) == str(original_id)
+    collection.assert_not_called()
+
+
+def test_claim_takes_over_expired_claims(detector):
+    ContactMessageFingerprint(
+        id='fingerprint',
+        contact_message_id=ObjectId(),
+        time_expires=datetime.utcnow() - timedelta(seconds=1)
+    ).save()
+    identifier = ObjectId()
+
+    assert detector.claim('fingerprint', identifier) is None
+    assert ContactMessageFingerprint.objects.get(id='fingerprint').contact_message_id == identifier
+
+
+def test_release_allows_fingerprint_to_be_claimed_again(detector):
+    detector.claim('fingerprint', ObjectId())
+    detector.release('fingerprint')
+
+    assert detector.claim('fingerprint', ObjectId()) is None
+
+
+def test_claim_treats_messages_as_original_when_claims_are_unavailable(mocker):
+    detector = DuplicateDetector(enabled=True)
+    collection = mocker.patch.object(DuplicateDetector, 'collection', new_callable=mocker.PropertyMock)
+    collection.return_value.update_one.side_effect = ServerSelectionTimeoutError()
+
+    assert detector.claim('fingerprint', ObjectId()) is None
+
+
+def test_claim_skips_claims_while_database_is_down(mocker):
+    mocker.patch('chalicelib.duplicate.healthy', return_value=False)
+    detector = DuplicateDetector(enabled=True)
+    collection = mocker.patch.object(DuplicateDetector, 'collection', new_callable=mocker.PropertyMock)
+
+    assert detector.claim('fingerprint', ObjectId()) is None
+    detector.release('fingerprint')
+    collection.assert_not_called()
+
+
+def test_claim_does_nothing_when_disabled(mocker):
+    collection = mocker.patch.object(DuplicateDetector, 'collection', new_callable=mocker.PropertyMock)
+    detector = DuplicateDetector(enabled=False)
+
+    assert detector.claim('fingerprint', ObjectId()) is None
+    assert detector.claim('fingerprint', ObjectId()) is None
+    collection.assert_not_called()
@@ -0,0 +1,46 @@
+import io
+import json
+
+from chalicelib.export import write_ndjson
+from chalicelib.service import ContactMessageService
+
+
+def test_write_ndjson_writes_one_document_per_line(saved_contact_messages):
+    stream = io.StringIO()
+    result = write_ndjson(ContactMessageService().iter_documents_raw(batch_size=2), stream, chunk_size=100)
+    lines = stream.getvalue().splitlines()
+
+    assert result.complete
+    assert result.count == 7
+    assert result.bytes_written == len(stream.getvalue())
+    assert [json.loads(line)['id'] for line in lines] == [str(message.id) for message in saved_contact_messages]
+
+
+def test_write_ndjson_stops_at_last_whole_document(saved_contact_messages):
+    line_size = len(json.dumps(saved_contact_messages[0].__getstate__(), separators=(',', ':'))) + 1
+    stream = io.StringIO()
+    result = write_ndjson(ContactMessageService().iter_documents_raw(), stream, max_bytes=line_size * 2 + 10)
+
+    assert not result.complete
+    assert result.count == 2
+    assert result.last_document.id == saved_contact_messages[1].id
+    assert len(stream.getvalue().splitlines()) == 2
+
+
+def test_write_ndjson_always_writes_first_document(saved_contact_messages):
+    stream = io.StringIO()
+    result = write_ndjson(ContactMessageService().iter_documents_raw(), stream, max_bytes=1)
+
+    assert not result.complete
+    assert result.count == 1
+    assert result.last_document.id == saved_contact_messages[0].id
+    assert len(stream.getvalue().splitlines()) == 1
+
+
+def test_write_ndjson_handles_no_documents():
+    stream = io.StringIO()
+    result = write_ndjson([], stream)
+
+    assert result.complete
+    assert result.count == 0
+    assert stream.getvalue() == ''
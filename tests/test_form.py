@@ -1,7 +1,13 @@
+import json
+from datetime import datetime
+
 import pytest
-from pyocle.form import resolve_form, FormValidationError
+from bson import ObjectId
+from pyocle.form import resolve_form, resolve_query_params, FormValidationError
 
-from chalicelib.form import ContactMessageCreationForm, _clean_phone_number
+from chalicelib.cursor import encode_cursor
+from chalicelib.form import ContactMessageCreationForm, ContactMessageQueryParameters, _clean_phone_number, \
+    resolve_creation_form, decode_contact_message, MessageDecodeError, ContactMessageStatisticsQueryParameters
 
 
 @pytest.fixture
@@ -78,3 +84,122 @@ def test_resolve_form_when_form_is_invalid(get_fixture, fixture_name, error_coun
 ])
 def test_clean_phone_number_correctly_cleans_given_string(phone: str, expected: str):
     assert expected == _clean_phone_number(phone)
+
+
+def test_resolve_query_params_maps_fields_to_contact_message_fields():
+    params = resolve_query_params({'fields': 'id, reason,timeCreated'}, ContactMessageQueryParameters)
+    assert params.fields == ['id', 'reason', 'time_created']
+
+
+def test_resolve_query_params_only_passes_archive_option_when_included():
+    params = resolve_query_params({'archived': 'true'}, ContactMessageQueryParameters)
+    archive_params = resolve_query_params({'archived': 'true', 'includeArchive': 'true'}, ContactMessageQueryParameters)
+
+    assert 'include_archive' not in params.query() and 'include_archive' not in params.filters()
+    assert archive_params.query()['include_archive'] is True
+    assert archive_params.filters() == {'archived': True, 'include_archive': True}
+
+
+def test_resolve_query_params_rejects_unknown_fields():
+    with pytest.raises(FormValidationError) as exception_info:
+        resolve_query_params({'fields': 'reason,password'}, ContactMessageQueryParameters)
+
+    assert len(exception_info.value.errors) == 1
+
+
+def test_resolve_query_params_strips_search():
+    params = resolve_query_params({'q': ' hello world '}, ContactMessageQueryParameters)
+    assert params.q == 'hello world'
+    assert params.filters() == {'q': 'hello world'}
+
+
+@pytest.mark.parametrize('params', [
+    {'q': '  '},
+    {'q': 'hello', 'cursor': encode_cursor([datetime(2020, 1, 1), ObjectId()])},
+    {'cursor': encode_cursor([1.5, ObjectId()])}
+])
+def test_resolve_query_params_rejects_invalid_search(params):
+    with pytest.raises(FormValidationError):
+        resolve_query_params(params, ContactMessageQueryParameters)
+
+
+def test_resolve_creation_form_parses_raw_body(message_creation_form_json):
+    form = resolve_creation_form(json.dumps(message_creation_form_json).encode('utf-8'))
+    assert form == resolve_form(message_creation_form_json, ContactMessageCreationForm)
+
+
+@pytest.mark.parametrize('raw_body', [None, b'', b'not json', b'[]'])
+def test_resolve_creation_form_rejects_missing_or_invalid_json(raw_body):
+    with pytest.raises(FormValidationError) as exception_info:
+        resolve_creation_form(raw_body)
+
+    assert exception_info.value.errors[0]['loc'] == ['requestBody']
+
+
+def test_contact_message_dict_matches_form_dict_with_identity(message_creation_form_json):
+    form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+    identity = {'sourceIp': '127.0.0.1', 'userAgent': 'chrome'}
+
+    expected = form.dict()
+    expected['reason'] = expected['reason'].value
+    expected['sender']['ip'] = '127.0.0.1'
+    expected['sender']['user_agent'] = 'chrome'
+
+    assert form.contact_message_dict(identity) == expected
+    assert form.contact_message_dict({})['sender']['ip'] == 'unknown'
+
+
+def test_fingerprint_ignores_case_whitespace_and_email(message_creation_form_json):
+    form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+    message_creation_form_json['message'] = f'  {form.message.upper()}\n\n'.replace(' ', '   ')
+    message_creation_form_json['sender']['email'] = 'rotated@example.com'
+    resubmitted_form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+    message_creation_form_json['sender']['alias'] = 'someone else'
+    other_sender_form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+
+    assert form.fingerprint() == resubmitted_form.fingerprint()
+    assert form.fingerprint() != other_sender_form.fingerprint()
+
+
+def test_decode_contact_message_decodes_published_message(queued_contact_message_json):
+    queued_contact_message_json['reason'] = 'BUSINESS'
+    fields = decode_contact_message(json.dumps(queued_contact_message_json))
+
+    assert fields == {**queued_contact_message_json, 'reason': 'business'}
+
+
+def test_decode_contact_message_allows_missing_phone(queued_contact_message_json):
+    del queued_contact_message_json['sender']['phone']
+    assert decode_contact_message(json.dumps(queued_contact_message_json))['sender']['phone'] is None
+
+
+@pytest.mark.parametrize('path,value', [
+    (('unknown',), 'value'),
+    (('sender', 'unknown'), 'value'),
+    (('message',), 123),
+    (('reason',), 'invalid'),
+    (('reason',), None),
+    (('id',), 'not an object id'),
+    (('sender', 'ip'), None),
+    (('sender',), 'not an object'),
+    (('py/object',), 'chalicelib.model.ContactMessage')
+])
+def test_decode_contact_message_rejects_unknown_shapes(queued_contact_message_json, path, value):
+    target = queued_contact_message_json
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = value
+
+    with pytest.raises(MessageDecodeError):
+        decode_contact_message(json.dumps(queued_contact_message_json))
+
+
+def test_decode_contact_message_rejects_invalid_json():
+    with pytest.raises(MessageDecodeError):
+        decode_contact_message('not json')
+
+
+def test_statistics_window_starts_at_midnight():
+    query_params = ContactMessageStatisticsQueryParameters(days=7)
+
+    assert query_params.since(now=datetime(2020, 6, 19, 13, 30)) == datetime(2020, 6, 13)
@@ -0,0 +1,67 @@
+import pytest
+
+from chalicelib.indexes import covering_index, query_shapes, missing_indexes, winning_index, \
+    CONTACT_MESSAGE_FILTER_SAMPLES
+from chalicelib.model import ContactMessage
+from chalicelib.service import ContactMessageService
+
+
+@pytest.mark.parametrize('filters', query_shapes(CONTACT_MESSAGE_FILTER_SAMPLES))
+def test_every_contact_message_query_shape_has_covering_index(filters):
+    ordering = ContactMessageService().ordering
+    assert covering_index(ContactMessage, list(filters), ordering) is not None
+
+
+def test_covering_index_is_none_when_sort_order_is_not_indexed():
+    assert covering_index(ContactMessage, ['reason'], ['time_updated']) is None
+
+
+def test_missing_indexes_are_created_by_ensure_indexes(database):
+    assert len(missing_indexes(ContactMessage)) == 9
+
+    ContactMessage.ensure_indexes()
+    assert missing_indexes(ContactMessage) == {}
+
+
+def test_winning_index_reads_index_from_plan(mocker):
+    query_set = mocker.Mock()
+    query_set.explain.return_value = {
+        'queryPlanner': {
+            'winningPlan': {
+                'stage': 'LIMIT',
+                'inputStage': {
+                    'stage': 'FETCH',
+                    'inputStage': {'stage': 'IXSCAN', 'indexName': 'reason_archived_responded'}
+                }
+            }
+        }
+    }
+
+    assert winning_index(query_set) == 'reason_archived_responded'
+
+
+@pytest.mark.parametrize('stage', ['COLLSCAN', 'SORT'])
+def test_winning_index_is_none_when_plan_scans_or_sorts(mocker, stage):
+    query_set = mocker.Mock()
+    query_set.explain.return_value = {
+        'queryPlanner': {
+            'winningPlan': {
+                'stage': stage,
+                'inputStages': [{'stage': 'IXSCAN', 'indexName': 'time_created'}]
+            }
+        }
+    }
+
+    assert winning_index(query_set) is None
+
+
+def test_missing_indexes_recognizes_text_indexes_reported_by_server(mocker):
+    collection = mocker.patch.object(ContactMessage, '_get_collection').return_value
+    collection.index_information.return_value = {
+        'text_search': {
+            'key': [('_fts', 'text'), ('_ftsx', 1)],
+            'weights': {'sender.email': 1, 'message': 1, 'sender.alias': 1}
+        }
+    }
+
+    assert 'text_search' not in missing_indexes(ContactMessage)
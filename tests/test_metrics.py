@@ -0,0 +1,86 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from pyocle.response import error_handler
+
+import chalicelib.metrics
+from chalicelib.metrics import CommandTimings, MetricLogger, Timings, current_timings, stage, timed
+
+
+@pytest.fixture
+def lines(mocker):
+    written = []
+    mocker.patch.object(chalicelib.metrics, 'metric_logger', MetricLogger(enabled=True, write=written.append))
+    return written
+
+
+def test_stage_does_nothing_outside_timed_handlers():
+    with stage('query'):
+        pass
+
+    assert current_timings() is None
+
+
+def test_timed_logs_stages_and_total(lines):
+    @timed
+    def handler(value):
+        with stage('query'):
+            pass
+
+        with stage('query'):
+            pass
+
+        return value
+
+    assert handler('response') == 'response'
+    handler('response')
+
+    first, second = [json.loads(line) for line in lines]
+    assert first['Route'] == 'handler'
+    assert first['ColdStart'] == 'true' and second['ColdStart'] == 'false'
+    assert first['total'] >= first['query'] >= 0
+    metric_names = [metric['Name'] for metric in first['_aws']['CloudWatchMetrics'][0]['Metrics']]
+    assert metric_names == ['query', 'total']
+    assert first['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Route', 'ColdStart']]
+    assert current_timings() is None
+
+
+def test_timed_composes_with_error_handler(lines):
+    @error_handler
+    @timed
+    def handler():
+        with stage('publish'):
+            raise Exception('publish failed')
+
+    assert handler().status_code == 500
+    record = json.loads(lines[0])
+    assert record['Route'] == 'handler'
+    assert 'publish' in record and 'total' in record
+
+
+def test_command_timings_records_commands_of_timed_invocations(lines):
+    listener = CommandTimings()
+    event = SimpleNamespace(command_name='find', duration_micros=1500)
+    listener.succeeded(event)
+
+    @timed
+    def handler():
+        listener.succeeded(event)
+        listener.failed(SimpleNamespace(command_name='insert', duration_micros=500))
+
+    handler()
+
+    record = json.loads(lines[0])
+    assert (record['mongo'], record['mongo.find'], record['mongo.insert']) == (2.0, 1.5, 0.5)
+    assert record['mongoCommands'] == 2
+    assert {'Name': 'mongoCommands', 'Unit': 'Count'} in record['_aws']['CloudWatchMetrics'][0]['Metrics']
+
+
+def test_metric_logger_writes_nothing_when_disabled():
+    written = []
+    logger = MetricLogger(enabled=False, write=written.append)
+    logger.log('handler', Timings())
+
+    assert written == []
+    assert not logger.cold_start
@@ -1,8 +1,9 @@
 from typing import Dict, Any
 
 import pytest
+from bson import ObjectId
 
-from chalicelib.model import Reason, Sender, Reader, ContactMessage, ReaderCollection
+from chalicelib.model import Reason, Sender, Reader, ContactMessage, ReaderCollection, RawDocument
 
 
 @pytest.mark.parametrize('reason', [
@@ -70,3 +71,41 @@ def test_reader_collection_fields_are_calculated_correctly_with_unknown_id(reade
         'flagged_by_you': False,
         'reader_list': readers
     }
+
+
+def test_raw_document_is_serialized_like_document(contact_message: ContactMessage):
+    contact_message.id = ObjectId(contact_message.id)
+    raw_document = RawDocument(ContactMessage, contact_message.to_mongo().to_dict())
+
+    assert raw_document.__getstate__() == contact_message.__getstate__()
+
+
+def test_raw_document_defaults_fields_missing_from_stored_document(contact_message: ContactMessage):
+    contact_message.id = ObjectId(contact_message.id)
+    son = contact_message.to_mongo().to_dict()
+    del son['readerCount'], son['flaggedCount'], son['readers']
+    raw_document = RawDocument(ContactMessage, son)
+
+    assert raw_document.reader_count == 0
+    assert raw_document.__getstate__() == ContactMessage._from_son(son).__getstate__()
+    assert list(raw_document.__getstate__()) == list(ContactMessage._from_son(son).__getstate__())
+
+
+def test_raw_document_exposes_fields_by_field_name(contact_message: ContactMessage):
+    raw_document = RawDocument(ContactMessage, contact_message.to_mongo().to_dict())
+
+    assert raw_document.id == ObjectId(contact_message.id)
+    assert raw_document.time_created == contact_message.time_created
+    with pytest.raises(AttributeError):
+        raw_document.unknown_field
+
+
+def test_raw_document_serializes_selected_fields_only(contact_message: ContactMessage):
+    raw_document = RawDocument(ContactMessage, contact_message.to_mongo().to_dict())
+    raw_document.select_fields(['archived', 'time_updated'])
+
+    assert raw_document.__getstate__() == {
+        'id': '5eeaa9f461cf5af67b7feaae',
+        'archived': False,
+        'timeUpdated': '2001-09-09T01:46:40'
+    }
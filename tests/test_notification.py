@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from pyocle.service.ses import SimpleEmailService
+
+from chalicelib.model import PendingNotification
+from chalicelib.notification import NotificationService
+
+
+@pytest.fixture
+def send_templated_email(mocker):
+    return mocker.patch.object(SimpleEmailService, 'send_templated_email', return_value={'MessageId': '1'})
+
+
+@pytest.fixture
+def ses_client(mocker):
+    # Clients are created lazily, so patching construction keeps tests from needing AWS credentials
+    return mocker.patch('boto3.client')
+
+
+def sent_digests(send_templated_email):
+    return [json.loads(call.args[0].template_data) for call in send_templated_email.call_args_list]
+
+
+def test_notify_sends_immediately_without_digest(database, ses_client, send_templated_email,
+                                                 queued_contact_message_json):
+    service = NotificationService(digest_enabled=False)
+
+    assert service.notify(json.dumps(queued_contact_message_json)) == 1
+    assert send_templated_email.call_args.args[0].template == 'contact-message-created'
+    assert PendingNotification.objects.count() == 0
+
+
+def test_notify_buffers_until_digest_is_full(database, ses_client, send_templated_email, queued_contact_message_json):
+    service = NotificationService(digest_enabled=True, digest_max_size=3)
+    sent = [service.notify(json.dumps(queued_contact_message_json)) for _ in range(4)]
+
+    assert sent == [0, 0, 3, 0]
+    assert [digest['count'] for digest in sent_digests(send_templated_email)] == [3]
+    assert send_templated_email.call_args.args[0].template == 'contact-message-digest'
+    assert PendingNotification.objects.count() == 1
+
+
+def test_flush_sends_digests_once_oldest_notification_is_due(database, ses_client, send_templated_email,
+                                                             queued_contact_message_json):
+    service = NotificationService(digest_enabled=True, digest_max_size=10, digest_max_age=timedelta(minutes=15))
+    service.notify(json.dumps(queued_contact_message_json))
+
+    assert service.flush() == 0
+    assert service.flush(now=datetime.utcnow() + timedelta(minutes=16)) == 1
+    assert sent_digests(send_templated_email) == [{'count': 1, 'contactMessages': [queued_contact_message_json]}]
+    assert PendingNotification.objects.count() == 0
+
+
+def test_flush_splits_digests_by_max_size(database, ses_client, send_templated_email, queued_contact_message_json):
+    service = NotificationService(digest_enabled=True, digest_max_size=2, digest_max_age=timedelta(minutes=15))
+    for _ in range(5):
+        PendingNotification(template_data=queued_contact_message_json).save()
+
+    assert service.flush(now=datetime.utcnow() + timedelta(minutes=16)) == 5
+    assert [digest['count'] for digest in sent_digests(send_templated_email)] == [2, 2, 1]
+
+
+def test_flush_releases_claims_when_sending_fails(database, ses_client, mocker, queued_contact_message_json):
+    mocker.patch.object(SimpleEmailService, 'send_templated_email', side_effect=Exception())
+    service = NotificationService(digest_enabled=True, digest_max_size=1)
+    PendingNotification(template_data=queued_contact_message_json).save()
+
+    with pytest.raises(Exception):
+        service.flush()
+
+    assert PendingNotification.objects(claimed_by=None).count() == 1
+
+
+def test_flush_skips_notifications_claimed_by_another_flush(database, ses_client, send_templated_email,
+                                                            queued_contact_message_json):
+    service = NotificationService(digest_enabled=True, digest_max_size=1)
+    PendingNotification(template_data=queued_contact_message_json, claimed_by='other',
+                        time_claimed=datetime.utcnow()).save()
+
+    assert service.flush() == 0
+    assert service.flush(now=datetime.utcnow() + timedelta(minutes=6)) == 1
@@ -0,0 +1,104 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from pyocle.form import resolve_form
+
+from chalicelib.duplicate import DuplicateDetector
+from chalicelib.form import ContactMessageCreationForm, decode_contact_message
+from chalicelib.model import OutboxMessage
+from chalicelib.outbox import OutboxRelay
+from chalicelib.ratelimit import RateLimiter
+from chalicelib.service import ContactMessageService, CONTACT_MESSAGE_CREATED_TOPIC_ARN
+
+IDENTITY = {'sourceIp': '127.0.0.1', 'userAgent': 'chrome'}
+
+
+@pytest.fixture
+def creation_form(message_creation_form_json) -> ContactMessageCreationForm:
+    return resolve_form(message_creation_form_json, ContactMessageCreationForm)
+
+
+def save_outbox_messages(count: int, time_next_attempt: datetime = None):
+    for index in range(count):
+        OutboxMessage(
+            topic_arn=CONTACT_MESSAGE_CREATED_TOPIC_ARN,
+            message=f'message {index}',
+            time_next_attempt=time_next_attempt or datetime.utcnow()
+        ).save()
+
+
+def test_publish_form_with_identity_places_message_in_outbox(database, local_sns, local_sns_client, creation_form):
+    service = ContactMessageService(outbox_enabled=True)
+    service._sns = local_sns
+    published = service.publish_form_with_identity(creation_form, IDENTITY)
+
+    assert published.sns_message_id is None
+    assert local_sns_client.published == []
+
+    outbox_message = OutboxMessage.objects.get(id=published.contact_message_id)
+    assert decode_contact_message(outbox_message.message)['id'] == published.contact_message_id
+
+
+def test_relay_publishes_outbox_messages_in_batches(database, local_sns, local_sns_client, creation_form):
+    service = ContactMessageService(outbox_enabled=True,
+                                    rate_limiter=RateLimiter(enabled=False),
+                                    duplicates=DuplicateDetector(enabled=False))
+    identifiers = [service.publish_form_with_identity(creation_form, IDENTITY).contact_message_id for _ in range(25)]
+    result = OutboxRelay(sns=local_sns).relay()
+
+    assert result.published_count == 25
+    assert result.failures == {}
+    assert sorted(json.loads(message['Message'])['id'] for message in local_sns_client.published) == sorted(identifiers)
+    assert all(message['TopicArn'] == CONTACT_MESSAGE_CREATED_TOPIC_ARN for message in local_sns_client.published)
+    assert OutboxMessage.objects.count() == 0
+
+
+def test_relay_stops_after_max_batches(database, local_sns, local_sns_client):
+    save_outbox_messages(25)
+    result = OutboxRelay(sns=local_sns, batch_size=5).relay(max_batches=2)
+
+    assert result.published_count == 10
+    assert OutboxMessage.objects.count() == 15
+
+
+def test_relay_retries_failed_messages_with_backoff(database, local_sns, local_sns_client):
+    save_outbox_messages(3)
+    local_sns_client.failing_messages.add('message 1')
+    relay = OutboxRelay(sns=local_sns, backoff_base=timedelta(seconds=5))
+    now = datetime.utcnow()
+    result = relay.relay(now=now)
+
+    failed = OutboxMessage.objects.get(message='message 1')
+    assert result.published_count == 2
+    assert list(result.failures) == [str(failed.id)]
+    assert failed.attempts == 1
+    assert failed.claimed_by is None
+    assert abs(failed.time_next_attempt - (now + timedelta(seconds=5))) < timedelta(milliseconds=1)
+
+    local_sns_client.failing_messages.clear()
+    assert relay.relay(now=now + timedelta(seconds=4)).published_count == 0
+    assert relay.relay(now=now + timedelta(seconds=5)).published_count == 1
+
+
+def test_relay_keeps_messages_when_sns_is_unavailable(database, local_sns, local_sns_client):
+    save_outbox_messages(2)
+    local_sns_client.unavailable = True
+    result = OutboxRelay(sns=local_sns).relay()
+
+    assert result.published_count == 0
+    assert len(result.failures) == 2
+    assert [message.attempts for message in OutboxMessage.objects] == [1, 1]
+
+
+def test_relay_skips_messages_leased_by_another_relay(database, local_sns, local_sns_client):
+    save_outbox_messages(1, time_next_attempt=datetime.utcnow() + timedelta(minutes=2))
+
+    assert OutboxRelay(sns=local_sns).relay().published_count == 0
+
+
+@pytest.mark.parametrize('attempts,expected', [(1, 5), (2, 10), (4, 40), (20, 900)])
+def test_backoff_doubles_until_max(attempts, expected):
+    relay = OutboxRelay(backoff_base=timedelta(seconds=5), backoff_max=timedelta(minutes=15))
+
+    assert relay.backoff(attempts) == timedelta(seconds=expected)
@@ -0,0 +1,100 @@
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+from chalicelib.model import RateLimitCounter
+from chalicelib.ratelimit import RateLimiter, RateLimitExceededError, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=2, refill_per_second=0.5, clock=clock)
+
+    assert bucket.take()
+    assert bucket.take()
+    assert not bucket.take()
+    assert bucket.retry_after() == 2
+
+    clock.now += 2
+
+    assert bucket.take()
+    assert not bucket.take()
+
+
+def test_acquire_rejects_once_limit_is_reached(database):
+    limiter = RateLimiter(enabled=True, max_requests=2, window_seconds=60, clock=FakeClock())
+    limiter.acquire('ip:1.1.1.1')
+    limiter.acquire('ip:1.1.1.1')
+
+    with pytest.raises(RateLimitExceededError) as ex:
+        limiter.acquire('ip:1.1.1.1')
+
+    assert ex.value.retry_after == 30
+    limiter.acquire('ip:2.2.2.2')
+
+
+def test_acquire_rejects_locally_without_counting(mocker, database):
+    limiter = RateLimiter(enabled=True, max_requests=1, window_seconds=60, clock=FakeClock())
+    limiter.acquire('ip:1.1.1.1')
+    count = mocker.spy(limiter, '_count')
+
+    with pytest.raises(RateLimitExceededError):
+        limiter.acquire('ip:1.1.1.1')
+
+    count.assert_not_called()
+
+
+def test_acquire_counts_requests_shared_by_containers(database):
+    clock = FakeClock()
+    containers = [RateLimiter(enabled=True, max_requests=2, window_seconds=60, clock=clock) for _ in range(3)]
+    containers[0].acquire('email:sender@example.com')
+    containers[1].acquire('email:sender@example.com')
+
+    with pytest.raises(RateLimitExceededError) as ex:
+        containers[2].acquire('email:sender@example.com')
+
+    assert ex.value.retry_after == 20
+    counter = RateLimitCounter.objects.get()
+    assert counter.count == 3
+    assert 'sender@example.com' not in counter.id
+
+
+def test_acquire_rejects_when_any_key_is_limited(database):
+    limiter = RateLimiter(enabled=True, max_requests=1, window_seconds=60, clock=FakeClock())
+    limiter.acquire('ip:1.1.1.1', 'email:sender@example.com')
+
+    with pytest.raises(RateLimitExceededError):
+        limiter.acquire('ip:2.2.2.2', 'email:sender@example.com')
+
+
+def test_acquire_allows_requests_when_counter_is_unavailable(mocker):
+    limiter = RateLimiter(enabled=True, max_requests=1, window_seconds=60, clock=FakeClock())
+    collection = mocker.patch.object(RateLimiter, 'collection', new_callable=mocker.PropertyMock)
+    collection.return_value.find_one_and_update.side_effect = ServerSelectionTimeoutError()
+
+    limiter.acquire('ip:1.1.1.1')
+
+
+def test_acquire_skips_counter_while_database_is_down(mocker):
+    mocker.patch('chalicelib.ratelimit.healthy', return_value=False)
+    limiter = RateLimiter(enabled=True, max_requests=1, window_seconds=60, clock=FakeClock())
+    collection = mocker.patch.object(RateLimiter, 'collection', new_callable=mocker.PropertyMock)
+
+    limiter.acquire('ip:1.1.1.1')
+    collection.assert_not_called()
+
+
+def test_acquire_does_nothing_when_disabled(mocker):
+    limiter = RateLimiter(enabled=False, max_requests=1)
+    count = mocker.spy(limiter, '_count')
+    for _ in range(3):
+        limiter.acquire('ip:1.1.1.1')
+
+    count.assert_not_called()
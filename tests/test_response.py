@@ -0,0 +1,31 @@
+import pytest
+
+from chalicelib.response import entity_tag, etag_matches, not_modified
+
+
+def test_entity_tag_is_quoted_and_stable():
+    etag = entity_tag('5eeaa9f461cf5af67b7feaae', '2001-09-09T01:46:40')
+
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == entity_tag('5eeaa9f461cf5af67b7feaae', '2001-09-09T01:46:40')
+    assert etag != entity_tag('5eeaa9f461cf5af67b7feaae', '2001-09-09T01:46:41')
+
+
+@pytest.mark.parametrize('if_none_match,expected', [
+    (None, False),
+    ('"other"', False),
+    ('"tag"', True),
+    ('W/"tag"', True),
+    ('"other", "tag"', True),
+    ('*', True)
+])
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches(if_none_match, '"tag"') == expected
+
+
+def test_not_modified_has_no_body():
+    response = not_modified('"tag"')
+
+    assert response.status_code == 304
+    assert response.body == ''
+    assert response.headers['ETag'] == '"tag"'
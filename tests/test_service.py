@@ -1,6 +1,19 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
 from bson import ObjectId
+from chalice.app import SQSEvent
+from pymongo.errors import AutoReconnect, BulkWriteError
+from pyocle.form import resolve_form
+from pyocle.service.core import ResourceNotFoundError
 
-from chalicelib.service import ContactMessageFormPublished
+from chalicelib.cursor import encode_cursor, decode_cursor, InvalidCursorError
+from chalicelib.duplicate import DuplicateDetector
+from chalicelib.form import ContactMessageCreationForm
+from chalicelib.model import ContactMessage, MessageCounts, ArchivedContactMessage
+from chalicelib.ratelimit import RateLimiter
+from chalicelib.service import ContactMessageFormPublished, ContactMessageService, BulkUpdateResult
 
 
 def test_contact_message_form_published_should_correctly_convert_id_to_string():
@@ -12,3 +25,513 @@ def test_contact_message_form_published_should_correctly_convert_id_to_string():
     contact_message_id = form.contact_message_id
     assert isinstance(contact_message_id, str) is True
     assert ObjectId.is_valid(contact_message_id)
+
+
+def test_publish_form_with_identity_suppresses_duplicates(database, local_sns, local_sns_client,
+                                                          message_creation_form_json):
+    service = ContactMessageService(rate_limiter=RateLimiter(enabled=False))
+    service._sns = local_sns
+    form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+
+    published = service.publish_form_with_identity(form, {'sourceIp': '1.1.1.1'})
+    duplicate = service.publish_form_with_identity(form, {'sourceIp': '2.2.2.2'})
+
+    assert duplicate.contact_message_id == published.contact_message_id
+    assert duplicate.sns_message_id is None
+    assert len(local_sns_client.published) == 1
+
+
+def test_publish_form_with_identity_releases_fingerprint_when_publish_fails(database, local_sns, local_sns_client,
+                                                                            message_creation_form_json):
+    service = ContactMessageService(rate_limiter=RateLimiter(enabled=False))
+    service._sns = local_sns
+    form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+    local_sns_client.unavailable = True
+
+    with pytest.raises(ConnectionError):
+        service.publish_form_with_identity(form, {})
+
+    local_sns_client.unavailable = False
+    assert service.publish_form_with_identity(form, {}).sns_message_id is not None
+
+
+def test_publish_form_with_identity_skips_database_while_it_is_down(mocker, local_sns, local_sns_client,
+                                                                    message_creation_form_json):
+    mocker.patch('chalicelib.ratelimit.healthy', return_value=False)
+    mocker.patch('chalicelib.duplicate.healthy', return_value=False)
+    ensure_connection = mocker.patch('chalicelib.ratelimit.ensure_connection')
+    mocker.patch('chalicelib.duplicate.ensure_connection', ensure_connection)
+    service = ContactMessageService(rate_limiter=RateLimiter(enabled=True), duplicates=DuplicateDetector(enabled=True))
+    service._sns = local_sns
+    form = resolve_form(message_creation_form_json, ContactMessageCreationForm)
+
+    assert service.publish_form_with_identity(form, {'sourceIp': '1.1.1.1'}).sns_message_id is not None
+    assert len(local_sns_client.published) == 1
+    ensure_connection.assert_not_called()
+
+
+def test_find_paginated_sorts_newest_first(saved_contact_messages):
+    service = ContactMessageService()
+    contact_messages = service.find_paginated(page=0, limit=100)
+
+    assert contact_messages == saved_contact_messages
+
+
+def test_find_paginated_with_page_offsets_results(saved_contact_messages):
+    service = ContactMessageService()
+    contact_messages = service.find_paginated(page=1, limit=3)
+
+    assert contact_messages == saved_contact_messages[3:6]
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7])
+def test_find_paginated_with_cursor_visits_every_message_once(saved_contact_messages, limit: int):
+    service = ContactMessageService()
+    visited = []
+    cursor = None
+    while True:
+        contact_messages = service.find_paginated(page=0, limit=limit, cursor=cursor)
+        visited.extend(contact_messages)
+        cursor = service.next_cursor(contact_messages, limit)
+        if cursor is None:
+            break
+
+    assert visited == saved_contact_messages
+
+
+def test_find_paginated_with_cursor_applies_filters(saved_contact_messages):
+    service = ContactMessageService()
+    first_page = service.find_paginated(page=0, limit=2, reason='business')
+    cursor = service.next_cursor(first_page, 2)
+    second_page = service.find_paginated(page=0, limit=2, cursor=cursor, reason='business')
+
+    expected = [message for message in saved_contact_messages if message.reason == 'business']
+    assert first_page + second_page == expected[:4]
+
+
+def test_next_cursor_is_none_for_last_page(contact_message):
+    service = ContactMessageService()
+    assert service.next_cursor([contact_message], 2) is None
+
+
+def test_find_paginated_rejects_cursor_for_different_ordering(saved_contact_messages):
+    service = ContactMessageService()
+    with pytest.raises(InvalidCursorError):
+        service.find_paginated(page=0, limit=2, cursor=encode_cursor([ObjectId()]))
+
+
+def test_find_paginated_with_fields_serializes_selected_fields_only(saved_contact_messages):
+    service = ContactMessageService()
+    contact_messages = service.find_paginated(page=0, limit=100, fields=['archived'])
+
+    expected = [{'id': str(message.id), 'archived': message.archived} for message in saved_contact_messages]
+    assert [message.__getstate__() for message in contact_messages] == expected
+
+
+def test_find_paginated_with_fields_still_creates_cursor(saved_contact_messages):
+    service = ContactMessageService()
+    contact_messages = service.find_paginated(page=0, limit=2, fields=['reason'])
+    cursor = service.next_cursor(contact_messages, 2)
+
+    assert service.find_paginated(page=0, limit=1, cursor=cursor) == saved_contact_messages[2:3]
+
+
+def test_find_one_with_fields_serializes_selected_fields_only(saved_contact_messages):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+    contact_message = service.find_one(identifier, fields=['reason', 'time_created'])
+
+    assert contact_message.__getstate__() == {
+        'id': identifier,
+        'reason': saved_contact_messages[0].reason,
+        'timeCreated': saved_contact_messages[0].time_created.isoformat()
+    }
+
+
+@pytest.mark.parametrize('fields', [None, ['reason', 'time_created']])
+def test_find_one_raw_is_serialized_like_find_one(saved_contact_messages, fields):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+
+    assert service.find_one_raw(identifier, fields=fields).__getstate__() == \
+        service.find_one(identifier, fields=fields).__getstate__()
+
+
+@pytest.mark.parametrize('identifier', ['invalid', '5eeaa9f461cf5af67b7feaae'])
+def test_find_one_raw_raises_not_found(database, identifier):
+    with pytest.raises(ResourceNotFoundError):
+        ContactMessageService().find_one_raw(identifier)
+
+
+def test_find_one_cached_serves_cached_message(saved_contact_messages):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+    expected = service.find_one_cached(identifier).__getstate__()
+    saved_contact_messages[0].delete()
+
+    assert service.find_one_cached(identifier).__getstate__() == expected
+
+
+def test_find_one_cached_reselects_invalidated_message(saved_contact_messages):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+    service.find_one_cached(identifier)
+    saved_contact_messages[0].delete()
+    service.invalidate(saved_contact_messages[0].id)
+
+    with pytest.raises(ResourceNotFoundError):
+        service.find_one_cached(identifier)
+
+
+def test_find_one_cached_field_selection_does_not_affect_cache(saved_contact_messages):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+    service.find_one_cached(identifier).select_fields(['reason'])
+
+    assert service.find_one_cached(identifier).__getstate__() == service.find_one_raw(identifier).__getstate__()
+
+
+@pytest.mark.parametrize('filters,expected', [
+    ({}, 7),
+    ({'archived': True}, 3),
+    ({'reason': 'question', 'archived': False}, 2)
+])
+def test_count_counts_matching_messages(saved_contact_messages, filters, expected):
+    assert ContactMessageService().count(**filters) == expected
+
+
+def test_count_cached_serves_cached_count(saved_contact_messages):
+    service = ContactMessageService()
+    service.count_cached(archived=True)
+    saved_contact_messages[0].delete()
+
+    assert service.count_cached(archived=True) == 3
+    assert service.count_cached(archived=False) == 4
+
+
+def test_invalidate_clears_cached_counts(saved_contact_messages):
+    service = ContactMessageService()
+    service.count_cached(archived=True)
+    saved_contact_messages[0].delete()
+    service.invalidate(saved_contact_messages[0].id)
+
+    assert service.count_cached(archived=True) == 2
+
+
+def test_statistics_summarizes_messages(saved_contact_messages, reader):
+    saved_contact_messages[0].update(responded=True, readers=[reader], unset__reader_count=True)
+    statistics = ContactMessageService().statistics(since=datetime.utcfromtimestamp(1000000000 + 120))
+
+    assert statistics.counts == MessageCounts(total=7, archived=3, responded=1, read_by_any=1)
+    assert statistics.by_reason == {
+        'business': MessageCounts(total=4, archived=2, responded=1, read_by_any=1),
+        'question': MessageCounts(total=3, archived=1, responded=0, read_by_any=0)
+    }
+    assert statistics.created_per_day == {'2001-09-09': 5}
+
+
+def test_statistics_cached_serves_cached_statistics(saved_contact_messages):
+    service = ContactMessageService()
+    since = datetime.utcfromtimestamp(1000000000)
+    service.statistics_cached(since)
+    saved_contact_messages[0].delete()
+
+    assert service.statistics_cached(since).counts.total == 7
+
+    service.invalidate(saved_contact_messages[0].id)
+
+    assert service.statistics_cached(since).counts.total == 6
+
+
+def move_every_archived_message(service: ContactMessageService) -> int:
+    return service.move_archived(datetime.utcnow() + timedelta(seconds=1))
+
+
+def test_move_archived_moves_archived_messages_to_archive(saved_contact_messages):
+    service = ContactMessageService()
+    archived_ids = sorted(message.id for message in saved_contact_messages if message.archived)
+
+    assert service.move_archived(datetime.utcnow() - timedelta(days=1)) == 0
+    assert service.move_archived(datetime.utcnow() + timedelta(seconds=1), batch_size=2) == 3
+    assert move_every_archived_message(service) == 0
+    assert ContactMessage.objects(archived=True).count() == 0
+    assert sorted(message.id for message in ArchivedContactMessage.objects) == archived_ids
+
+
+def test_find_one_falls_back_to_archive(saved_contact_messages):
+    service = ContactMessageService()
+    archived = next(message for message in saved_contact_messages if message.archived)
+    move_every_archived_message(service)
+
+    assert service.find_one_raw(str(archived.id)).id == archived.id
+    assert service.find_one(str(archived.id), fields=['message']).message == archived.message
+    with pytest.raises(ResourceNotFoundError):
+        service.find_one_raw(str(ObjectId()))
+
+
+def test_find_paginated_raw_merges_archive_when_included(saved_contact_messages):
+    service = ContactMessageService()
+    move_every_archived_message(service)
+    identifiers = [message.id for message in saved_contact_messages]
+
+    assert [message.id for message in service.find_paginated_raw(page=0, limit=100)] == \
+        [message.id for message in saved_contact_messages if not message.archived]
+    assert [message.id for message in service.find_paginated_raw(page=0, limit=100, include_archive=True)] == \
+        identifiers
+
+    first_page = service.find_paginated_raw(page=0, limit=3, include_archive=True)
+    second_page = service.find_paginated_raw(page=1, limit=3, include_archive=True)
+    after_cursor = service.find_paginated_raw(page=0, limit=3, cursor=service.next_cursor(first_page, 3),
+                                              include_archive=True)
+    assert [message.id for message in second_page] == [message.id for message in after_cursor] == identifiers[3:6]
+
+
+def test_count_and_statistics_include_archive(saved_contact_messages):
+    service = ContactMessageService()
+    move_every_archived_message(service)
+
+    assert service.count() == 4
+    assert service.count(include_archive=True) == 7
+    assert service.count(include_archive=True, reason='business') == 4
+    assert service.statistics(since=datetime.utcfromtimestamp(1000000000)).counts.archived == 3
+
+
+def test_update_many_restores_archived_messages(saved_contact_messages):
+    service = ContactMessageService()
+    archived = next(message for message in saved_contact_messages if message.archived)
+    move_every_archived_message(service)
+
+    assert service.update_many({'archived': False}, identifiers=[str(archived.id)]) == \
+        BulkUpdateResult(matched_count=1, modified_count=1)
+    assert not ContactMessage.objects.get(id=archived.id).archived
+    assert ArchivedContactMessage.objects.count() == 2
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 100])
+def test_iter_documents_streams_every_message_in_order(saved_contact_messages, batch_size):
+    service = ContactMessageService()
+
+    assert list(service.iter_documents(batch_size=batch_size)) == saved_contact_messages
+    assert [message.id for message in service.iter_documents_raw(batch_size=batch_size)] == \
+        [message.id for message in saved_contact_messages]
+
+
+def test_iter_documents_raw_continues_after_cursor(saved_contact_messages):
+    service = ContactMessageService()
+    cursor = service.cursor(saved_contact_messages[2])
+    contact_messages = list(service.iter_documents_raw(cursor=cursor, fields=['reason'], archived=False))
+
+    assert [message.id for message in contact_messages] == \
+        [message.id for message in saved_contact_messages[3:] if not message.archived]
+    assert set(contact_messages[0].__getstate__()) == {'id', 'reason'}
+
+
+def test_search_pipeline_matches_text_and_filters():
+    pipeline = ContactMessageService().search_pipeline('hello', page=2, limit=10, archived=True, reason='business')
+
+    assert pipeline == [
+        {'$match': {'$text': {'$search': 'hello'}, 'archived': True, 'reason': 'business'}},
+        {'$addFields': {'score': {'$meta': 'textScore'}}},
+        {'$sort': {'score': {'$meta': 'textScore'}, '_id': -1}},
+        {'$skip': 20},
+        {'$limit': 10}
+    ]
+
+
+def test_search_pipeline_continues_after_cursor_and_projects_fields():
+    identifier = ObjectId()
+    pipeline = ContactMessageService().search_pipeline('hello', page=2, limit=10,
+                                                       cursor=encode_cursor([1.5, identifier]),
+                                                       fields=['reason', 'time_created'])
+
+    assert pipeline[2] == {'$match': {'$or': [
+        {'score': {'$lt': 1.5}},
+        {'score': 1.5, '_id': {'$lt': identifier}}
+    ]}}
+    assert {'$skip': 20} not in pipeline
+    assert pipeline[-1] == {'$project': {'reason': 1, 'timeCreated': 1, 'score': 1}}
+
+
+def test_search_paginated_raw_serializes_score(mocker):
+    identifier = ObjectId()
+    collection = mocker.patch.object(ContactMessageService, 'collection', new_callable=mocker.PropertyMock)
+    collection.return_value.aggregate.return_value = iter([{'_id': identifier, 'reason': 'business', 'score': 1.5}])
+    service = ContactMessageService()
+    contact_messages = service.search_paginated_raw('hello', page=0, limit=1, fields=['reason'])
+
+    assert [message.__getstate__() for message in contact_messages] == \
+        [{'id': str(identifier), 'reason': 'business', 'score': 1.5}]
+    assert decode_cursor(service.next_search_cursor(contact_messages, limit=1)) == [1.5, identifier]
+    assert service.next_search_cursor(contact_messages, limit=2) is None
+
+
+def test_mark_read_adds_reader_once(saved_contact_messages):
+    service = ContactMessageService()
+    identifiers = [str(message.id) for message in saved_contact_messages[:2]] + [str(ObjectId())]
+    time_updated = datetime.utcfromtimestamp(1000000000)
+    ContactMessage.objects(id__in=identifiers[:2]).update(time_updated=time_updated)
+
+    assert service.mark_read(identifiers, 'user-1') == BulkUpdateResult(matched_count=2, modified_count=2)
+    assert service.mark_read(identifiers, 'user-1') == BulkUpdateResult(matched_count=2, modified_count=0)
+
+    contact_message = ContactMessage.objects.get(id=identifiers[0])
+    assert [(reader.user_id, reader.flagged) for reader in contact_message.readers] == [('user-1', False)]
+    assert (contact_message.reader_count, contact_message.flagged_count) == (1, 0)
+    assert contact_message.time_updated > time_updated
+
+
+def test_mark_read_flags_and_unflags_for_user(saved_contact_messages):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+    service.mark_read([identifier], 'user-1')
+    service.mark_read([identifier], 'user-2', flagged=True)
+
+    assert service.mark_read([identifier], 'user-1', flagged=True).modified_count == 1
+    assert service.mark_read([identifier], 'user-1', flagged=True).modified_count == 0
+
+    contact_message = ContactMessage.objects.get(id=identifier)
+    assert [(reader.user_id, reader.flagged) for reader in contact_message.readers] == \
+        [('user-1', True), ('user-2', True)]
+    assert (contact_message.reader_count, contact_message.flagged_count) == (2, 2)
+
+    service.mark_read([identifier], 'user-2', flagged=False)
+    contact_message.reload()
+    assert (contact_message.reader_count, contact_message.flagged_count) == (2, 1)
+
+
+def test_mark_read_invalidates_cached_messages(saved_contact_messages):
+    service = ContactMessageService()
+    identifier = str(saved_contact_messages[0].id)
+    service.find_one_cached(identifier)
+    service.mark_read([identifier], 'user-1')
+
+    assert service.find_one_cached(identifier).reader_count == 1
+
+
+def test_update_many_updates_selected_messages_once(saved_contact_messages):
+    service = ContactMessageService()
+    identifiers = [str(message.id) for message in saved_contact_messages[:2]]
+    time_updated = datetime.utcfromtimestamp(1000000000)
+    ContactMessage.objects(id__in=identifiers).update(time_updated=time_updated)
+
+    assert service.update_many({'responded': True}, identifiers=identifiers) == \
+        BulkUpdateResult(matched_count=2, modified_count=2)
+    assert service.update_many({'responded': True}, identifiers=identifiers) == \
+        BulkUpdateResult(matched_count=2, modified_count=0)
+
+    contact_message = ContactMessage.objects.get(id=identifiers[0])
+    assert contact_message.responded
+    assert contact_message.time_updated > time_updated
+
+
+def test_update_many_updates_filtered_messages(saved_contact_messages):
+    service = ContactMessageService()
+    service.count_cached(archived=True)
+
+    result = service.update_many({'archived': True, 'responded': True}, filters={'archived': False})
+
+    assert result == BulkUpdateResult(matched_count=4, modified_count=4)
+    assert service.count_cached(archived=True) == len(saved_contact_messages)
+
+
+def test_backfill_reader_counts_sets_missing_counts(saved_contact_messages, reader):
+    service = ContactMessageService()
+    service.collection.update_many({}, {'$unset': {'readerCount': '', 'flaggedCount': ''}})
+    saved_contact_messages[0].update(readers=[reader], unset__reader_count=True, unset__flagged_count=True)
+
+    assert service.backfill_reader_counts(batch_size=3) == 7
+    assert service.backfill_reader_counts() == 0
+
+    contact_message = ContactMessage.objects.get(id=saved_contact_messages[0].id)
+    assert (contact_message.reader_count, contact_message.flagged_count) == (1, 1)
+
+
+def test_backfill_reader_counts_corrects_messages_marked_before_backfill(saved_contact_messages, reader):
+    service = ContactMessageService()
+    saved_contact_messages[0].update(readers=[reader], unset__reader_count=True, unset__flagged_count=True)
+    service.mark_read([str(saved_contact_messages[0].id)], 'second reader', flagged=False)
+
+    assert service.backfill_reader_counts() == 1
+
+    contact_message = ContactMessage.objects.get(id=saved_contact_messages[0].id)
+    assert (contact_message.reader_count, contact_message.flagged_count) == (2, 1)
+
+
+@pytest.mark.parametrize('fields', [None, ['reason', 'sender']])
+def test_find_paginated_raw_is_serialized_like_find_paginated(saved_contact_messages, fields):
+    service = ContactMessageService()
+    contact_messages = service.find_paginated(page=0, limit=100, fields=fields)
+    raw_contact_messages = service.find_paginated_raw(page=0, limit=100, fields=fields)
+
+    assert [message.__getstate__() for message in raw_contact_messages] == \
+           [message.__getstate__() for message in contact_messages]
+    assert service.next_cursor(raw_contact_messages, 2) == service.next_cursor(contact_messages, 2)
+
+
+def test_create_many_rejects_invalid_forms_and_creates_the_rest(database, queued_contact_message_json):
+    invalid_form = {**queued_contact_message_json, 'id': str(ObjectId()), 'message': ''}
+    unknown_field_form = {**queued_contact_message_json, 'id': str(ObjectId()), 'unknown': True}
+
+    result = ContactMessageService().create_many([queued_contact_message_json, invalid_form, unknown_field_form])
+
+    assert result.created_count == 1
+    assert result.failures == {}
+    assert set(result.rejections) == {1, 2}
+    assert ContactMessage.objects.count() == 1
+
+
+def test_create_many_reports_unreachable_database_as_failures(mocker, queued_contact_message_json):
+    collection = mocker.patch.object(ContactMessageService, 'collection', new_callable=mocker.PropertyMock)
+    collection.return_value.insert_many.side_effect = AutoReconnect('connection lost')
+
+    result = ContactMessageService().create_many([queued_contact_message_json])
+
+    assert result.created_count == 0
+    assert result.failures == {0: 'connection lost'}
+    assert result.rejections == {}
+
+
+def test_create_many_ignores_messages_that_already_exist(database, queued_contact_message_json):
+    service = ContactMessageService()
+    service.create_many([queued_contact_message_json])
+    result = service.create_many([queued_contact_message_json, {**queued_contact_message_json, 'id': str(ObjectId())}])
+
+    assert result.failures == {}
+    assert ContactMessage.objects.count() == 2
+
+
+def test_create_with_sqs_event_rejects_invalid_messages(database, sqs_event, queued_contact_message_json):
+    notification = {'Type': 'Notification', 'Message': json.dumps({**queued_contact_message_json, 'id': str(ObjectId())})}
+    invalid = json.dumps({**queued_contact_message_json, 'id': str(ObjectId()), 'message': ''})
+    event = sqs_event(json.dumps(queued_contact_message_json), 'not json', json.dumps(notification), '[]', invalid)
+
+    result = ContactMessageService().create_with_sqs_event(SQSEvent(event, None))
+
+    assert result.created_count == 2
+    assert result.failures == {}
+    assert set(result.rejections) == {'message-1', 'message-3', 'message-4'}
+    assert ContactMessage.objects.count() == 2
+
+
+def test_create_with_sqs_event_reports_failed_writes_by_message_id(mocker, sqs_event, queued_contact_message_json):
+    collection = mocker.patch.object(ContactMessageService, 'collection', new_callable=mocker.PropertyMock)
+    collection.return_value.insert_many.side_effect = BulkWriteError({'nInserted': 1, 'writeErrors': [
+        {'index': 0, 'code': 11000, 'errmsg': 'duplicate key'},
+        {'index': 1, 'code': 91, 'errmsg': 'shutdown in progress'}
+    ]})
+    event = sqs_event(json.dumps(queued_contact_message_json), 'not json',
+                      json.dumps({**queued_contact_message_json, 'id': str(ObjectId())}))
+
+    result = ContactMessageService().create_with_sqs_event(SQSEvent(event, None))
+
+    assert result.failures == {'message-2': 'shutdown in progress'}
+    assert set(result.rejections) == {'message-1'}
+
+
+def test_contact_message_service_creates_sns_client_on_first_use(mocker):
+    sns = mocker.patch('chalicelib.service.SimpleNotificationService')
+    service = ContactMessageService()
+
+    sns.assert_not_called()
+    assert service.sns is service.sns
+    sns.assert_called_once()